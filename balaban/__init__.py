@@ -1,2 +1,4 @@
+__version__ = '0.0.20'
+
 from balaban.balaban import bosko
 from balaban.balaban import scrape_top_five_leagues
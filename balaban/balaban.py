@@ -1,213 +1,685 @@
+import contextlib
+
+from balaban.cache import ModelCache
+
+## the default fit settings for add_model & add_models (see estimate_model)
+FIT_DEFAULTS = dict(engine='advi', n_samples=6000, thin=1, dtype='float32', max_iter=30000, tol=None, param_tol=None,
+                    n_chains=4, n_tune=1000, chain_jobs=1)
+
+
 class bosko:
-    def __init__(self, df, league_season_string, query_position=None):
+    def __init__(self, df, league_season_string, query_position=None, memmap_dir=None, cache=None,
+                 report_callback=None, dataset_filter=None):
+        self.dataset_filter = dataset_filter
+        self.df, self.dataset = self._prepare_df(df, query_position, dataset_filter)
+        self.league_season_string = league_season_string
+        self.query_position = query_position
+        self.memmap_dir = memmap_dir
+        self.cache = ModelCache(cache) if isinstance(cache, str) else cache
+        self.report_callback = report_callback
+        self.models = []
+        self.labels = []
+        self.specs = {}
+
+    @staticmethod
+    def _prepare_df(df, query_position, dataset_filter=None):
+        ## returns the data frame, plus a DatasetSource (see balaban/dataset.py) if df is the path of a dataset
+        ## directory. In that case only the player details are read here; other columns are read as they're needed
+        ## (see _load_columns), and the data frame's index holds each player's row in the dataset.
+        import os
         import pandas as pd
-        import pymc3 as pm
-        if isinstance(df, str):
+        source = None
+        if isinstance(df, str) and os.path.isdir(df):
+            from balaban.dataset import DatasetSource
+            source = DatasetSource(df, dataset_filter)
+            df = source.read_base()
+        elif isinstance(df, str):
             df = pd.read_csv(df)
         df['Minutes'] = df['90s'] * 90
         if query_position is not None:
             to_keep = [(query_position == str(pos)[0:2]) for pos in list(df['Pos'])]
             df = df[to_keep]
-        self.df = df
-        self.league_season_string = league_season_string
-        self.models = []
-        self.labels = []
+        return df, source
+
+    def _load_columns(self, names):
+        ## reads any of the columns in names that aren't in self.df yet from the dataset (if there is one)
+        names = [name for name in dict.fromkeys(names) if name not in self.df.columns]
+        if (self.dataset is None) or (len(names) == 0):
+            return
+        names = [name for name in names if name in self.dataset.columns]
+        if len(names) > 0:
+            values = self.dataset.read(names)
+            rows = self.df.index.to_numpy()
+            for name in names:
+                self.df[name] = values[name].to_numpy()[rows]
 
-    def add_model(self, a, b, model_type, name):
+    def add_model(self, a, b, model_type, name, engine=FIT_DEFAULTS['engine'], n_samples=FIT_DEFAULTS['n_samples'],
+                  thin=FIT_DEFAULTS['thin'], dtype=FIT_DEFAULTS['dtype'], max_iter=FIT_DEFAULTS['max_iter'],
+                  tol=FIT_DEFAULTS['tol'], param_tol=FIT_DEFAULTS['param_tol'], n_chains=FIT_DEFAULTS['n_chains'],
+                  n_tune=FIT_DEFAULTS['n_tune'], chain_jobs=FIT_DEFAULTS['chain_jobs'], group_by=None):
+        ## group_by is an (optional) column name or list of column names, e.g. ['League', 'Pos'], to fit one model in which
+        ## each group of players has its own population-level parameters (with 'Pos' grouped by its first two characters,
+        ## as for query_position). Percentiles (on the plots, tables & queries) are then relative to the player's group.
         from balaban.utils import estimate_model
+        settings = dict(engine=engine, n_samples=n_samples, thin=thin, dtype=dtype, max_iter=max_iter, tol=tol,
+                        param_tol=param_tol, n_chains=n_chains, n_tune=n_tune, chain_jobs=chain_jobs)
+        self._record_spec(name, a, b, model_type, settings, group_by)
+        a, b = self._resolve_inputs(a, b, model_type)
+        groups = self._resolve_groups(group_by)
+        key, new_model = self._cache_lookup(a, b, model_type, settings, groups)
+        if new_model is None:
+            new_model = estimate_model(a, b, model_type, memmap_path=self._new_memmap_path(), groups=groups, **settings)
+            self._cache_store(key, new_model)
+        self._store_model(name, new_model)
+        self._report(name, new_model)
+
+    def add_models(self, specs, n_jobs=1):
+        ## fits several models, running independent fits in parallel across n_jobs worker processes
+        ## specs is a list of model specifications, each either a tuple (a, b, model_type, name) or a dictionary with
+        ## keys 'a', 'b', 'model_type' & 'name' (plus, optionally, any of add_model's other arguments, e.g. 'group_by')
+        ## for 'xSp90' specs, a & b can be the names of other models in specs (or already in the bosko object);
+        ## they're computed as soon as both of those have finished.
+        ## n_jobs=-1 uses all available cores. Models are added in the order given in specs.
+        import os
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+        from balaban.utils import estimate_model
+        specs = [dict(zip(('a', 'b', 'model_type', 'name'), spec)) if isinstance(spec, (tuple, list)) else dict(spec)
+                 for spec in specs]
+        spec_names = [spec['name'] for spec in specs]
+        if len(set(spec_names)) != len(spec_names):
+            raise ValueError("Model names in specs should be unique")
+        n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+        fitted = {}
+
+        def dependencies(spec):
+            if spec['model_type'] != 'xSp90':
+                return []
+            return [x for x in (spec['a'], spec['b']) if isinstance(x, str)]
+
+        def lookup(name):
+            return fitted[name] if name in fitted else self.get_model(name)
+
+        def task(spec):
+            settings = {key: spec.get(key, value) for key, value in FIT_DEFAULTS.items()}
+            self._record_spec(spec['name'], spec['a'], spec['b'], spec['model_type'], settings, spec.get('group_by'))
+            a, b = self._resolve_inputs(spec['a'], spec['b'], spec['model_type'], lookup)
+            groups = self._resolve_groups(spec.get('group_by'))
+            key, model = self._cache_lookup(a, b, spec['model_type'], settings, groups)
+            return key, model, (a, b, spec['model_type']), dict(settings, memmap_path=self._new_memmap_path(),
+                                                                 groups=groups)
+
+        for spec in specs:
+            missing = [d for d in dependencies(spec) if (d not in spec_names) and (d not in self.labels)]
+            if len(missing) > 0:
+                raise ValueError("Model(s) " + ', '.join(missing) + " referred to by '" + spec['name'] + "' not found")
+
+        pending = list(specs)
+        pool = None
+        ## the BLAS thread limits have to be in the environment the workers are spawned with: a worker can import numpy
+        ## (while unpickling its first task) before _init_fit_worker runs, and BLAS reads them when it's loaded
+        with (_single_threaded_blas() if n_jobs > 1 else contextlib.nullcontext()):
+            if n_jobs > 1:
+                context = multiprocessing.get_context('spawn')
+                slots = context.Queue()
+                for slot in range(n_jobs):
+                    slots.put(slot)
+                pool = ProcessPoolExecutor(max_workers=n_jobs, mp_context=context, initializer=_init_fit_worker,
+                                           initargs=(slots,))
+            try:
+                futures = {}
+                while pending or futures:
+                    for spec in list(pending):
+                        if any(((d in spec_names) and (d not in fitted)) for d in dependencies(spec)):
+                            continue
+                        pending.remove(spec)
+                        key, model, args, kwargs = task(spec)
+                        if model is not None:
+                            fitted[spec['name']] = model
+                        elif (pool is None) or (spec['model_type'] == 'xSp90'):
+                            ## xSp90 models are just products of existing samples, so aren't worth shipping to a worker
+                            fitted[spec['name']] = estimate_model(*args, **kwargs)
+                            self._cache_store(key, fitted[spec['name']])
+                        else:
+                            futures[pool.submit(estimate_model, *args, **kwargs)] = (spec['name'], key)
+                    if futures:
+                        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            name, key = futures.pop(future)
+                            fitted[name] = future.result()
+                            self._cache_store(key, fitted[name])
+            finally:
+                if pool is not None:
+                    pool.shutdown(cancel_futures=True)
+
+        for name in spec_names:
+            self._store_model(name, fitted[name])
+            self._report(name, fitted[name])
+
+    def _report(self, name, model):
+        if self.report_callback is not None:
+            self.report_callback(name, model.report)
+
+    def get_report(self, name):
+        ## the fit report for model name: iterations used, convergence, ELBO summary & time spent in each stage
+        return self.get_model(name).report
+
+    def fit_reports(self):
+        ## a data frame summarising the fit reports of every model (times in seconds)
+        import pandas as pd
+        rows = []
+        for name, model in zip(self.labels, self.models):
+            report = model.report
+            row = {'Model': name,
+                   'model_type': report.get('model_type'),
+                   'engine': report.get('engine'),
+                   'iterations': report.get('iterations'),
+                   'converged': report.get('converged'),
+                   'elbo': (report.get('elbo') or {}).get('last'),
+                   'rhat_max': (report.get('mcmc') or {}).get('rhat_max'),
+                   'rhat_player_q99': (report.get('mcmc') or {}).get('rhat_player_q99'),
+                   'ess_min': (report.get('mcmc') or {}).get('ess_min')}
+            row.update({'time_' + stage: t for stage, t in report.get('timings', {}).items()})
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def _record_spec(self, name, a, b, model_type, settings, group_by=None):
+        ## remembers how a model was specified so that update_data can refit it on new data. That's only possible
+        ## when a & b refer to columns (or, for 'xSp90', to other models) by name.
+        def by_name(x):
+            if isinstance(x, str):
+                return x
+            if (model_type == 'xSp90') and any(x is m for m in self.models):
+                return self.labels[[i for i, m in enumerate(self.models) if x is m][0]]
+            if isinstance(x, (list, tuple)) and all(isinstance(xx, str) for xx in x):
+                return list(x)
+            return None
+
+        a, b = by_name(a), by_name(b)
+        if (a is None) or (b is None):
+            self.specs.pop(name, None)
+        else:
+            self.specs[name] = dict(a=a, b=b, model_type=model_type, settings=settings, group_by=group_by)
+
+    def update_data(self, df, tol=1e-3):
+        ## refits every model on new data (e.g. after another matchweek), starting from the previous fits
+        ##      df, the new data (a data frame or file path, as for bosko)
+        ##      tol, relative tolerance on the change in the ADVI loss at which to stop each fit
+        ## players are matched to the previous fits by Player & Squad; new players start from the population level.
+        ## ADVI fits stop as soon as they've converged, so small changes in the data mean quick refits. Conjugate fits
+        ## re-estimate the population parameters starting from the previous estimates, and then update the players'
+        ## posteriors exactly. Every model must have been added with a & b given as column (or model) names.
         import numpy as np
-        if isinstance(a, str):
-            a = self.df[a]
-        if isinstance(b, str):
-            b = self.df[b]
-        a = np.array(a)
-        b = np.array(b)
-        new_model = estimate_model(a, b, model_type)
-        self.models.append(new_model)
-        self.labels.append(name)
+        from balaban.utils import estimate_model, warm_start_state
+        missing = [name for name in self.labels if name not in self.specs]
+        if len(missing) > 0:
+            raise ValueError("Can't refit model(s) " + ', '.join(missing) + " because they weren't specified by "
+                             "column names")
+        ## 'xSp90' models are refitted after the models they're made from, so work out that order before refitting
+        parents = {name: [self.specs[name]['a'], self.specs[name]['b']] if self.specs[name]['model_type'] == 'xSp90'
+                   else [] for name in self.labels}
+        for name in self.labels:
+            missing = [x for x in parents[name] if x not in self.labels]
+            if len(missing) > 0:
+                raise ValueError("Can't refit model '" + name + "' because model(s) " + ', '.join(missing) +
+                                 " it's made from no longer exist")
+        order = []
+        while len(order) < len(self.labels):
+            ready = [name for name in self.labels if (name not in order) and all(x in order for x in parents[name])]
+            if len(ready) == 0:
+                raise ValueError("Can't refit model(s) " + ', '.join(x for x in self.labels if x not in order) +
+                                 " because they're made from each other")
+            order += ready
+        old_keys = list(zip(self.df['Player'], self.df['Squad']))
+        self.df, self.dataset = self._prepare_df(df, self.query_position, self.dataset_filter)
+        new_keys = list(zip(self.df['Player'], self.df['Squad']))
+        refitted = {}
+        for name in order:
+            old_model = self.get_model(name)
+            spec = self.specs[name]
+            a, b = self._resolve_inputs(spec['a'], spec['b'], spec['model_type'], refitted.get)
+            init = None
+            if len(old_model.state) > 0:
+                init = warm_start_state(old_model.state, [old_keys[i] for i in np.where(old_model.mask)[0]],
+                                        new_keys)
+            settings = dict(spec['settings'], tol=tol)
+            refitted[name] = estimate_model(a, b, spec['model_type'], memmap_path=self._new_memmap_path(),
+                                            init=init, groups=self._resolve_groups(spec.get('group_by')),
+                                            **settings)
+        old_models = self.models
+        self.models = [refitted[name] for name in self.labels]
+        for model in old_models:
+            self._release_model(model)
+        for name, model in zip(self.labels, self.models):
+            self._report(name, model)
+
+    def _resolve_inputs(self, a, b, model_type, get_model=None):
+        ## turns add_model's a & b arguments into the arrays (or models, for 'xSp90') that estimate_model expects
+        ## character strings refer to columns of self.df, or to models for 'xSp90'
+        import numpy as np
+        get_model = self.get_model if get_model is None else get_model
+        if model_type == 'xSp90':
+            return [get_model(x) if isinstance(x, str) else x for x in (a, b)]
+        self._load_columns([xx for x in (a, b) for xx in (x if isinstance(x, (list, tuple)) else [x])
+                            if isinstance(xx, str)])
+        out = []
+        for x in (a, b):
+            if isinstance(x, str):
+                x = self.df[x]
+            elif isinstance(x, (list, tuple)):
+                x = [self.df[xx] if isinstance(xx, str) else xx for xx in x]
+            out.append(np.array(x))
+        return out
+
+    def _resolve_groups(self, group_by):
+        ## each player's group label for add_model's group_by (None if group_by is None)
+        import numpy as np
+        if group_by is None:
+            return None
+        group_by = [group_by] if isinstance(group_by, str) else list(group_by)
+        self._load_columns(group_by)
+        missing = [column for column in group_by if column not in self.df.columns]
+        if len(missing) > 0:
+            raise ValueError("Column(s) " + ', '.join(missing) + " in group_by not found")
+        values = [[str(x)[0:2] if column == 'Pos' else str(x) for x in self.df[column]] for column in group_by]
+        return np.array([', '.join(labels) for labels in zip(*values)])
+
+    def _cache_lookup(self, a, b, model_type, settings, groups=None):
+        ## returns (cache key, cached model or None). 'xSp90' models are cheap to recompute, so aren't cached
+        from balaban.cache import fingerprint
+        if (self.cache is None) or (model_type == 'xSp90'):
+            return None, None
+        ## chain_jobs only decides where the chains run, not what they draw
+        settings = {k: v for k, v in settings.items() if k != 'chain_jobs'}
+        key = fingerprint(a, b, model_type, settings if groups is None else dict(settings, groups=groups.tolist()))
+        return key, self.cache.get(key, self._new_memmap_path())
+
+    def _cache_store(self, key, model):
+        if key is not None:
+            self.cache.put(key, model)
+
+    def save(self, path):
+        ## writes the data frame, labels & all fitted models to the directory path, to be read back with bosko.load
+        import os
+        import json
+        import shutil
+        if os.path.isdir(os.path.join(path, 'models')):
+            shutil.rmtree(os.path.join(path, 'models'))
+        os.makedirs(path, exist_ok=True)
+        self.df.to_pickle(os.path.join(path, 'df.pkl'))
+        for i, model in enumerate(self.models):
+            model.save(os.path.join(path, 'models', str(i)))
+        with open(os.path.join(path, 'bosko.json'), 'w') as f:
+            json.dump({'league_season_string': self.league_season_string, 'query_position': self.query_position,
+                       'labels': self.labels, 'specs': self.specs,
+                       'dataset': None if self.dataset is None else self.dataset.path,
+                       'dataset_filter': self.dataset_filter}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True, memmap_dir=None, cache=None):
+        ## reads a bosko object written by bosko.save. If mmap is True the posterior samples are memory-mapped
+        import os
+        import json
+        import pandas as pd
+        from balaban.posterior import Posterior
+        with open(os.path.join(path, 'bosko.json')) as f:
+            meta = json.load(f)
+        bos = cls.__new__(cls)
+        bos.df = pd.read_pickle(os.path.join(path, 'df.pkl'))
+        bos.league_season_string = meta['league_season_string']
+        bos.query_position = meta.get('query_position')
+        bos.specs = meta.get('specs', {})
+        bos.dataset_filter = meta.get('dataset_filter')
+        bos.dataset = None
+        if (meta.get('dataset') is not None) and os.path.isdir(meta['dataset']):
+            from balaban.dataset import DatasetSource
+            bos.dataset = DatasetSource(meta['dataset'], bos.dataset_filter)
+        bos.memmap_dir = memmap_dir
+        bos.cache = ModelCache(cache) if isinstance(cache, str) else cache
+        bos.report_callback = None
+        bos.labels = list(meta['labels'])
+        bos.models = [Posterior.load(os.path.join(path, 'models', str(i)), mmap=mmap) for i in range(len(bos.labels))]
+        return bos
+
+    def _new_memmap_path(self):
+        import os
+        import uuid
+        if self.memmap_dir is None:
+            return None
+        os.makedirs(self.memmap_dir, exist_ok=True)
+        return os.path.join(self.memmap_dir, uuid.uuid4().hex + '.npy')
+
+    def _store_model(self, name, model):
+        ## adds model under name, replacing (and releasing, see _release_model) any existing model of that name
+        if name in self.labels:
+            i = self.labels.index(name)
+            old_model = self.models[i]
+            self.models[i] = model
+            self._release_model(old_model)
+        else:
+            self.models.append(model)
+            self.labels.append(name)
+
+    def _release_model(self, model):
+        ## deletes the memory-mapped samples file of a model that's been replaced or deleted, if it's one that this object
+        ## wrote to memmap_dir (files belonging to a saved store or the cache are left alone)
+        import os
+        if (self.memmap_dir is None) or (model.memmap_path is None) or any(m is model for m in self.models):
+            return
+        path = os.path.abspath(model.memmap_path)
+        if os.path.dirname(path) != os.path.abspath(self.memmap_dir):
+            return
+        if any((m.memmap_path is not None) and (os.path.abspath(m.memmap_path) == path) for m in self.models):
+            return
+        try:
+            os.remove(path)
+        except OSError:
+            pass
 
     def delete_model(self, name):
         import numpy as np
-        which_mod = np.min(np.where(self.labels == name)[0])
+        which_mod = np.min(np.where(np.array(self.labels) == name)[0])
+        model = self.models[which_mod]
         del self.models[which_mod]
         del self.labels[which_mod]
+        self.specs.pop(name, None)
+        self._release_model(model)
 
     def get_model(self, name):
         import numpy as np
         which_mod = np.min(np.where(np.array(self.labels) == name)[0])
         return self.models[which_mod]
 
-    def make_plot(self, player_query, subtit_text, model_names=None, use_pretty_font=True, dpi=125):
-        import matplotlib.pyplot as plt
-        import matplotlib.font_manager as fm
-        import matplotlib
+    def player_quantiles(self, model_names=None):
+        ## percentile histograms and credible intervals for every player on every model (or just those in model_names)
+        ## returns a data frame with one row per player per model, containing:
+        ##      Player, Squad & Model (plus Group, the player's group, for models fitted with group_by)
+        ##      lower, median & upper, the credible interval for the metric itself (as shown in red on the plots)
+        ##      percentile_median, the player's median percentile rank (between 0 and 1)
+        ##      hist_lo & hist_hi, the range of the percentile histogram
+        ##      hist_0, ..., hist_24, the percentile histogram counts (as used for the shading on the plots)
+        ## the underlying arrays are cached on each model, so repeated calls are cheap
+        import pandas as pd
         import numpy as np
+        from balaban.utils import player_quantile_table
+        if model_names is None:
+            model_names = self.labels
+        frames = []
+        for name in model_names:
+            model = self.get_model(name)
+            table = player_quantile_table(model)
+            frame = pd.DataFrame({'Player': np.array(self.df['Player'])[model.mask],
+                                  'Squad': np.array(self.df['Squad'])[model.mask],
+                                  'Model': name,
+                                  'lower': table['quantiles'][:, 0],
+                                  'median': table['quantiles'][:, 1],
+                                  'upper': table['quantiles'][:, 2],
+                                  'percentile_median': table['percentile_median'],
+                                  'hist_lo': table['hist_edges'][:, 0],
+                                  'hist_hi': table['hist_edges'][:, -1]})
+            if model.groups is not None:
+                frame.insert(3, 'Group', np.array(model.group_labels)[model.groups])
+            hist = pd.DataFrame(table['hist_counts'], columns=['hist_' + str(i) for i in range(25)])
+            frames.append(pd.concat([frame, hist], axis=1))
+        return pd.concat(frames, ignore_index=True)
+
+    def player_ranks(self, model_names=None, top_k=(1, 5, 10), bins=25, n_jobs=1):
+        ## each player's posterior rank among the other players in the model, on every model (or just those in model_names)
+        ##      top_k, the k's for which to compute each player's probability of ranking in the top k
+        ##      bins, the number of bins in the percentile rank histograms
+        ##      n_jobs, number of worker processes to compute the models' ranks in (-1 uses all available cores)
+        ## returns a data frame with one row per player per model, containing:
+        ##      Player, Squad & Model (plus Group, the player's group, for models fitted with group_by, in which case players
+        ##          are ranked within their group)
+        ##      rank_mean & rank_sd, the mean & standard deviation of the player's rank (1 is the highest)
+        ##      percentile_mean, percentile_lower, percentile_median & percentile_upper, the mean & the 5%, 50% & 95%
+        ##          quantiles of the player's percentile rank (between 0 and 1)
+        ##      p_top_1, p_top_5, ..., the probability that the player ranks in the top k
+        ##      rank_hist_0, ..., the percentile rank histogram counts
+        ## see balaban.utils.player_rank_table. The results are cached on each model, so repeated calls are cheap
         import os
-        from balaban.utils import obtain_player_quantiles
-        from importlib_resources import path as get_font_path
-        if use_pretty_font:
-            font_path = get_font_path('balaban', 'JosefinSans-Regular.ttf')
-            try:
-                with font_path as f:
-                    fname = str(f)
-                    fp_title = fm.FontProperties(fname=fname, size=10)
-                    fp_subtitle = fm.FontProperties(fname=fname, size=9)
-                    fp_labels = fm.FontProperties(fname=fname, size=8)
-                    fp_medians = fm.FontProperties(fname=fname, size=7)
-            except:
-                fp_title = fm.FontProperties(size=10)
-                fp_subtitle = fm.FontProperties(size=9)
-                fp_labels = fm.FontProperties(size=8)
-                fp_medians = fm.FontProperties(size=7)
-        else:
-            fp_title = fm.FontProperties(size=10)
-            fp_subtitle = fm.FontProperties(size=9)
-            fp_labels = fm.FontProperties(size=8)
-            fp_medians = fm.FontProperties(size=7)
+        import multiprocessing
+        import pandas as pd
+        import numpy as np
+        from concurrent.futures import ProcessPoolExecutor
+        from balaban.utils import player_rank_table
+        if model_names is None:
+            model_names = self.labels
+        models = [self.get_model(name) for name in model_names]
+        top_k = tuple(sorted(set(int(k) for k in top_k)))
+        todo = [model for model in models if (model.cache.get('rank_table') is None)
+                or (model.cache['rank_table']['bins'] != bins) or (model.cache['rank_table']['top_k'] != top_k)]
+        n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+        n_jobs = max(1, min(n_jobs, len(todo)))
+        if n_jobs > 1:
+            with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context('spawn')) as pool:
+                futures = [pool.submit(_rank_worker, model, bins, top_k) for model in todo]
+                for model, future in zip(todo, futures):
+                    model.cache['rank_table'], seconds = future.result()
+                    model.report.setdefault('timings', {})['ranks'] = seconds
+        frames = []
+        for name, model in zip(model_names, models):
+            table = player_rank_table(model, bins, top_k)
+            frame = pd.DataFrame({'Player': np.array(self.df['Player'])[model.mask],
+                                  'Squad': np.array(self.df['Squad'])[model.mask],
+                                  'Model': name,
+                                  'rank_mean': table['rank_mean'],
+                                  'rank_sd': table['rank_sd'],
+                                  'percentile_mean': table['percentile_mean'],
+                                  'percentile_lower': table['percentile_quantiles'][:, 0],
+                                  'percentile_median': table['percentile_quantiles'][:, 1],
+                                  'percentile_upper': table['percentile_quantiles'][:, 2]})
+            if model.groups is not None:
+                frame.insert(3, 'Group', np.array(model.group_labels)[model.groups])
+            for j, k in enumerate(table['top_k']):
+                frame['p_top_' + str(k)] = table['p_top'][j]
+            hist = pd.DataFrame(table['hist_counts'], columns=['rank_hist_' + str(i) for i in range(bins)])
+            frames.append(pd.concat([frame, hist], axis=1))
+        return pd.concat(frames, ignore_index=True)
 
-        player_list = np.array(self.df['Player'])
-        team_list = np.array(self.df['Squad'])
-        mins_played = np.array(self.df['Minutes'])
+    def query(self, conditions=None, min_prob=0.5, min_joint=None, min_minutes=None, max_minutes=None, positions=None,
+              sort_by=None, ascending=False, top_k=None, model_names=None):
+        ## finds the players who meet a set of conditions on their percentile ranks, across several models at once
+        ##      conditions, dictionary of {model name: percentile threshold} or {model name: (percentile threshold, prob)},
+        ##                  keeping the players whose probability of being above each threshold (between 0 and 1) is
+        ##                  at least prob (or min_prob, if not given)
+        ##      min_joint, (optional) minimum probability of being above every threshold at once
+        ##      min_minutes & max_minutes, (optional) limits on minutes played
+        ##      positions, (optional) list of positions (the first two characters of 'Pos', e.g. ['MF', 'FW']) to keep
+        ##      sort_by, a model name (to sort by its posterior means) or a column of the result, e.g. 'p_joint' (the default
+        ##               when there are conditions)
+        ##      ascending, whether to sort in ascending order
+        ##      top_k, (optional) the number of players to return
+        ##      model_names, (optional) list of other models to include in the result
+        ## returns a data frame with one row per player, containing Player, Squad, Pos & Minutes, then for each model:
+        ##      <model>_mean & <model>_median, the player's posterior mean & median
+        ##      <model>_percentile, the player's median percentile rank
+        ##      <model>_p, the probability of being above the model's threshold (for models in conditions)
+        ## and p_joint, the probability of meeting every condition at once. That's computed from the posterior samples for
+        ## models whose samples share draws (an 'xSp90' model & its parents), along with those models' <model>_p from the
+        ## same draws, and as the product of the probabilities otherwise.
+        ## the per-model arrays come from player_quantile_table, which is cached on each model, so after the first query
+        ## (for each model) the filtering & sorting are just array operations.
+        import numpy as np
+        import pandas as pd
+        from balaban.utils import player_quantile_table, exceedance_probability, shared_draws, joint_exceedance
+        conditions = {name: (tuple(c) if isinstance(c, (tuple, list)) else (c, min_prob))
+                      for name, c in (conditions or {}).items()}
+        names = list(conditions) + ([sort_by] if sort_by in self.labels else []) + list(model_names or [])
+        names = list(dict.fromkeys(names))
+        missing = [name for name in names if name not in self.labels]
+        if len(missing) > 0:
+            raise ValueError("Model(s) " + ', '.join(missing) + " not found")
+        if sort_by is None and len(conditions) > 0:
+            sort_by = 'p_joint'
+
+        n = self.df.shape[0]
+        minutes = np.asarray(self.df['Minutes'], dtype=float)
+        keep = np.ones(n, dtype=bool)
+        if min_minutes is not None:
+            keep &= minutes >= min_minutes
+        if max_minutes is not None:
+            keep &= minutes <= max_minutes
+        if positions is not None:
+            keep &= np.isin(np.array([str(pos)[0:2] for pos in self.df['Pos']]), list(positions))
+        out = {'Player': np.array(self.df['Player']),
+               'Squad': np.array(self.df['Squad']),
+               'Pos': np.array(self.df['Pos']),
+               'Minutes': minutes}
+        for name in names:
+            model = self.get_model(name)
+            table = player_quantile_table(model)
+            for column, values in (('_mean', table['mean']), ('_median', table['quantiles'][:, 1]),
+                                   ('_percentile', table['percentile_median'])):
+                out[name + column] = np.full(n, np.nan)
+                out[name + column][model.mask] = values
+            if name in conditions:
+                out[name + '_p'] = np.zeros(n)
+                out[name + '_p'][model.mask] = exceedance_probability(table, conditions[name][0])
+
+        if len(conditions) > 0:
+            models = [self.get_model(name) for name in conditions]
+            thresholds = [conditions[name][0] for name in conditions]
+            groups = shared_draws(models)
+            ## models that share draws get their own probabilities from the same draws as their joint probability (so
+            ## the joint is never above them), which is only worth doing for the players left after the other conditions
+            for group in groups:
+                if len(group) == 1:
+                    name = list(conditions)[group[0]]
+                    keep &= out[name + '_p'] >= conditions[name][1]
+            rows = np.where(keep)[0]
+            p_joint = np.ones(rows.shape[0])
+            for group in groups:
+                if len(group) == 1:
+                    p_joint *= out[list(conditions)[group[0]] + '_p'][rows]
+                    continue
+                joint, marginals = joint_exceedance([models[i] for i in group], [thresholds[i] for i in group], rows)
+                p_joint *= joint
+                for i, marginal in zip(group, marginals):
+                    name = list(conditions)[i]
+                    out[name + '_p'][rows] = marginal
+                    keep[rows] &= marginal >= conditions[name][1]
+            out['p_joint'] = np.full(n, np.nan)
+            out['p_joint'][rows] = p_joint
+            p_joint = p_joint[keep[rows]]
+            rows = rows[keep[rows]]
+            if min_joint is not None:
+                rows = rows[p_joint >= min_joint]
+        else:
+            rows = np.where(keep)[0]
+        result = pd.DataFrame(out).iloc[rows]
+        if sort_by is not None:
+            result = result.sort_values(sort_by + '_mean' if sort_by in self.labels else sort_by, ascending=ascending,
+                                        kind='stable')
+        if top_k is not None:
+            result = result.head(top_k)
+        return result.reset_index(drop=True)
 
+    def _plot_models(self, model_names=None):
         if model_names is not None:
             which_mods = [self.labels.index(m_name) for m_name in model_names]
-            models = [self.models[i] for i in which_mods]
-            labels = [self.labels[i] for i in which_mods]
+            return [self.models[i] for i in which_mods], [self.labels[i] for i in which_mods]
+        return self.models, self.labels
 
-        else:
-            models = self.models
-            labels = self.labels
-
-        pl = np.where(player_list == player_query)[0][0]
-        n_bars = len(models)
-        fig = plt.figure(dpi=dpi)
-        ax = plt.subplot(111, projection='polar')
-        p90_collected = [None] * n_bars
-        for j in range(n_bars):
-            h, p90 = obtain_player_quantiles(models[j], pl)
-            p90_collected[j] = p90
-            ax.bar(np.pi / 2 + j * 2 * np.pi / n_bars,
-                   1,
-                   color='white',
-                   edgecolor='seagreen',
-                   width=2 * np.pi / n_bars,
-                   linewidth=0.2)
-            for i in range(1, 25):
-                ax.bar(np.pi / 2 + j * 2 * np.pi / n_bars,
-                       h[1][i] - h[1][i - 1],
-                       alpha=h[0][i] / np.max(h[0]),
-                       color='seagreen',
-                       width=2 * np.pi / n_bars,
-                       bottom=h[1][i - 1])
-
-        ax.axis('off')
-        for quantile in [0.25, 0.5, 0.75]:
-            ax.plot(np.linspace(0, 2 * np.pi, 200), quantile * np.ones(200), c='gray',
-                    alpha=0.2 + 0.3 * (quantile == 0.5), ls='--')
-        ax.plot(np.linspace(0, 2 * np.pi, 200), np.ones(200), c='gray', alpha=0.5)
-
-        fig.suptitle(player_list[pl] + ' (' + team_list[pl] + '), ' + self.league_season_string, y=1.04, fontsize=10,
-                     fontproperties=fp_title)
-        tit = ax.set_title(subtit_text + '; 90s played: ' + str(mins_played[pl] / 90), fontsize=9, y=1.1,
-                           fontproperties=fp_subtitle)
-        theta = np.pi / 2 + np.arange(n_bars) * 2 * np.pi / n_bars
-        theta_lower = np.pi / 2 + np.arange(n_bars) * 2 * np.pi / n_bars + np.pi / 20
-        rotations = np.rad2deg(theta) - 90 - 180 * ((theta > np.pi) & (theta < 2 * np.pi))
-        rotations_lower = np.rad2deg(theta_lower) - 90 - 180 * ((theta_lower > np.pi) & (theta_lower < 2 * np.pi))
-
-        for idx in range(n_bars):
-            lab = ax.text(theta[idx], 1.2, labels[idx],
-                          ha='center',
-                          va='center',
-                          rotation=rotations[idx],
-                          rotation_mode="anchor",
-                          fontsize=8,
-                          fontproperties=fp_labels, )
-            lab = ax.text(theta[idx], 1.075,
-                          f'{p90_collected[idx][1]:.3}' + ' (' + f'{p90_collected[idx][0]:.3}' + ', ' + f'{p90_collected[idx][2]:.3}' + ')',
-                          ha='center',
-                          va='center',
-                          rotation=rotations[idx],
-                          rotation_mode="anchor",
-                          fontsize=9,
-                          fontproperties=fp_medians,
-                          color='firebrick')
+    def _plot_titles(self, pl, subtit_text):
+        title = self.df['Player'].iloc[pl] + ' (' + self.df['Squad'].iloc[pl] + '), ' + self.league_season_string
+        subtitle = subtit_text + '; 90s played: ' + str(self.df['Minutes'].iloc[pl] / 90)
+        return title, subtitle
+
+    def make_plot(self, player_query, subtit_text, model_names=None, use_pretty_font=True, dpi=125):
+        import matplotlib.pyplot as plt
+        import numpy as np
+        from balaban.plotting import RadarTemplate, radar_data
+        models, labels = self._plot_models(model_names)
+        pl = np.where(np.array(self.df['Player']) == player_query)[0][0]
+        template = RadarTemplate(labels, use_pretty_font=use_pretty_font, fig=plt.figure(dpi=dpi))
+        template.draw(*self._plot_titles(pl, subtit_text), radar_data(models, pl))
         plt.show()
 
+    def render_all(self, out_dir, subtit_text='', players=None, model_names=None, fmt='png', n_jobs=1,
+                   use_pretty_font=True, dpi=125):
+        ## renders the radar plot (as in make_plot) of every player to a file in out_dir, without a display
+        ##      players, (optional) list of player names to render (by default, everyone in the data frame)
+        ##      fmt, file format, e.g. 'png' or 'svg'
+        ##      n_jobs, number of worker processes to render in (-1 uses all available cores)
+        ## files are named <Player>_<Squad>.<fmt>. The plot data are computed here, from each model's (cached)
+        ## player_quantile_table, and the workers only draw. Returns the list of file paths written.
+        import os
+        import multiprocessing
+        import numpy as np
+        from concurrent.futures import ProcessPoolExecutor
+        from balaban.utils import player_quantile_table
+        from balaban.plotting import radar_data, render_chunk, file_name
+        os.makedirs(out_dir, exist_ok=True)
+        models, labels = self._plot_models(model_names)
+        for model in models:
+            player_quantile_table(model)
+        rows = np.arange(self.df.shape[0])
+        if players is not None:
+            rows = rows[np.isin(np.array(self.df['Player']), list(players))]
+        jobs = [(os.path.join(out_dir, file_name(self.df['Player'].iloc[pl], self.df['Squad'].iloc[pl], fmt)),
+                 *self._plot_titles(pl, subtit_text), radar_data(models, pl)) for pl in rows]
+        n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+        n_jobs = max(1, min(n_jobs, len(jobs)))
+        if n_jobs == 1:
+            return render_chunk(labels, jobs, fmt, use_pretty_font, dpi)
+        chunks = [jobs[i::n_jobs] for i in range(n_jobs)]
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_render_worker) as pool:
+            futures = [pool.submit(render_chunk, labels, chunk, fmt, use_pretty_font, dpi) for chunk in chunks]
+            written = set(path for future in futures for path in future.result())
+        return [job[0] for job in jobs if job[0] in written]
+
+
+def _init_render_worker():
+    ## render_all workers only ever draw to files
+    import matplotlib
+    matplotlib.use('Agg')
+
 
-def scrape_top_five_leagues(path_to_chromedriver, league_names=['epl', 'laliga', 'bundesliga', 'ligue1', 'seriea']):
-    from selenium import webdriver
-    import pandas as pd
-    import numpy as np
-    from balaban.utils import get_col_dtype
-    from selenium.webdriver.chrome.options import Options
+def _rank_worker(model, bins, top_k):
+    ## player_ranks worker. The timing is recorded on the worker's copy of the model, so it's sent back with the table
+    from balaban.utils import player_rank_table
+    table = player_rank_table(model, bins, top_k)
+    return table, model.report['timings']['ranks']
 
-    top_5_league_nums = np.array(['9', '12', '20', '13', '11'])
-    top_5_league_names = np.array(['Premier-League', 'La-Liga', 'Bundesliga', 'Ligue-1', 'Serie-A'])
-    league_codes = ['epl', 'laliga', 'bundesliga', 'ligue1', 'seriea']
-    league_names = list(league_names) if (type(league_names) is np.ndarray) or (
-            type(league_names) is tuple) else league_names
-    league_names = [league_names] if type(league_names) is str else league_names
 
+def _init_fit_worker(slots):
+    ## runs at the start of each add_models worker process, before Theano is imported (by the first PyMC3 fit)
+    ## each worker takes a slot number from the slots queue and uses the Theano compile directory for that slot, under
+    ## the usual base_compiledir, so that workers don't contend for the compilation lock. The directories are the same
+    ## on every add_models call, so later calls reuse the compiled models (Theano locks each directory itself, so it's
+    ## fine for several processes to share them).
+    import os
+    flags = os.environ.get('THEANO_FLAGS', '')
+    base = os.path.join(os.path.expanduser('~'), '.theano')
+    for flag in flags.split(','):
+        if flag.strip().startswith('base_compiledir='):
+            base = flag.split('=', 1)[1].strip()
+    compiledir = os.path.join(base, 'balaban-worker-' + str(slots.get()))
+    os.environ['THEANO_FLAGS'] = (flags + ',' if flags else '') + 'base_compiledir=' + compiledir
+
+
+@contextlib.contextmanager
+def _single_threaded_blas():
+    ## single-threaded BLAS for any processes started inside the with block, so that n_jobs workers don't oversubscribe
+    ## the cores (limits the user has already set are kept). The parent's environment is restored afterwards
+    import os
+    saved = {var: os.environ.get(var) for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')}
+    for var in saved:
+        os.environ.setdefault(var, '1')
     try:
-        league_matches = np.isin(league_codes, league_names)
-    except:
-        raise ValueError(
-            "league_names should be a list of characters. Available options are 'epl', 'laliga', 'bundesliga',  "
-            "'ligue1', 'seriea'")
-
-    if np.sum(league_matches) == 0:
-        raise ValueError(
-            "league_names should be a list of characters. Available options are 'epl', 'laliga', 'bundesliga',  "
-            "'ligue1', 'seriea'")
-    elif np.sum(league_matches) != len(league_names):
-        raise ValueError(
-            "league_names contains strings that weren't matched. Available options are 'epl', 'laliga', 'bundesliga', "
-            " 'ligue1', 'seriea'")
-
-    chrome_options = webdriver.ChromeOptions()
-    chrome_options.add_argument('--headless')
-    chrome_options.add_argument('--no-sandbox')
-    chrome_options.add_argument('--disable-dev-shm-usage')
-    browser = webdriver.Chrome(path_to_chromedriver, chrome_options=chrome_options)
-
-    top_5_league_names = list(top_5_league_names[league_matches])
-    top_5_league_nums = list(top_5_league_nums[league_matches])
-
-    categories = ['passing', 'shooting', 'misc','possession','defense','gca','passing_types']
-    all_players_df = pd.DataFrame()
-    for lnum, lnam in zip(top_5_league_nums, top_5_league_names):
-        for category in categories:
-            url = 'https://fbref.com/en/comps/' + lnum + '/' + category + '/' + lnam + '-Stats'
-            browser.get(url)
-            if category == 'passing':
-                my_table = browser.find_element_by_id('div_stats_passing')
-                my_table = my_table.find_element_by_xpath("table")
-                df = pd.read_html(my_table.get_attribute('outerHTML'))[0]
-                col_names = np.array(
-                    [('Unnamed:' not in val[0]) * (val[0] + ': ') + val[1] for val in df.columns.values])
-                tmp = np.array(df)[:, np.r_[1, 3, 4, np.arange(7, df.shape[1] - 1)]]
-                tmp = np.c_[np.tile(lnam, tmp.shape[0]), tmp]
-                tmp_col_names = np.r_[np.array('League'), col_names[np.r_[1, 3, 4, np.arange(7, df.shape[1] - 1)]]]
-                league_df = pd.DataFrame(tmp)
-                league_df.columns = tmp_col_names
-                league_df = league_df[league_df['Player'] != 'Player']
-                league_df = league_df.astype(league_df.apply(get_col_dtype).to_dict())
-                league_df.index = league_df['Player']
+        yield
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                os.environ.pop(var, None)
             else:
-                my_table = browser.find_element_by_id('div_stats_'+category)
-                my_table = my_table.find_element_by_xpath("table")
-                df = pd.read_html(my_table.get_attribute('outerHTML'))[0]
-                col_names = np.array(
-                    [('Unnamed:' not in val[0]) * (val[0] + ': ') + val[1] for val in df.columns.values])
-                tmp = np.array(df)[:, np.r_[1, np.arange(8, df.shape[1] - 1)]]
-                tmp_df = pd.DataFrame(tmp)
-                tmp_df.columns = col_names[np.r_[1, np.arange(8, df.shape[1] - 1)]]
-                tmp_df = tmp_df[tmp_df['Player'] != 'Player']
-                tmp_df = tmp_df.astype(tmp_df.apply(get_col_dtype).to_dict())
-                tmp_df = tmp_df.set_index(list(tmp_df)[0])
-                league_df = pd.concat([league_df, tmp_df], axis=1, sort=False)
-
-        all_players_df = pd.concat([all_players_df, league_df])
-
-    return all_players_df
+                os.environ[var] = value
+
+
+def scrape_top_five_leagues(path_to_chromedriver=None, league_names=['epl', 'laliga', 'bundesliga', 'ligue1', 'seriea'],
+                            **kwargs):
+    ## see balaban/scrape.py (the other keyword arguments, e.g. fetcher, cache_dir & max_workers, are passed on)
+    from balaban.scrape import scrape_top_five_leagues as scrape
+    return scrape(path_to_chromedriver, league_names, **kwargs)
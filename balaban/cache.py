@@ -0,0 +1,108 @@
+def fingerprint(a, b, model_type, settings):
+    ## content-addressed key for a model fit
+    ## hashes the input data a & b, the model_type, the inference settings (a dictionary) and the package version
+    import hashlib
+    import json
+    import numpy as np
+    from balaban import __version__
+    h = hashlib.sha256()
+    h.update(json.dumps([__version__, model_type, settings], sort_keys=True, default=str).encode())
+    for x in (a, b):
+        x = np.ascontiguousarray(np.asarray(x, dtype=np.float64))
+        h.update(str(x.shape).encode())
+        h.update(x.tobytes())
+    return h.hexdigest()
+
+
+class ModelCache:
+    ## on-disk cache of fitted models, one directory (see Posterior.save) per fingerprint
+    ##      directory, where the cache lives
+    ##      max_bytes, (optional) total size above which the least recently used entries are evicted after each put
+    ##      max_age, (optional) age in seconds above which entries are evicted after each put
+    ## a hit's samples never refer to the entry itself, so entries can be evicted or replaced while models loaded from
+    ## them are still in use (see get)
+    def __init__(self, directory, max_bytes=None, max_age=None):
+        import os
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def _entry(self, key):
+        import os
+        return os.path.join(self.directory, key)
+
+    def get(self, key, memmap_path=None):
+        ## returns the cached Posterior for key, or None if there isn't one
+        ##      memmap_path, (optional) .npy file for the samples, which are then memory-mapped from there. The file is
+        ##                   a hard link to the entry's samples where possible (so a hit costs next to nothing), or a
+        ##                   copy otherwise. Without it, the samples are read into memory.
+        import os
+        import shutil
+        import numpy as np
+        from balaban.posterior import Posterior
+        entry = self._entry(key)
+        if not os.path.isfile(os.path.join(entry, 'meta.json')):
+            return None
+        os.utime(entry)
+        model = Posterior.load(entry, mmap=False if memmap_path is None else True)
+        if memmap_path is not None:
+            try:
+                os.link(model.memmap_path, memmap_path)
+            except OSError:
+                shutil.copyfile(model.memmap_path, memmap_path)
+            model.samples = np.load(memmap_path, mmap_mode='r')
+            model.memmap_path = memmap_path
+        return model
+
+    def put(self, key, model):
+        ## stores model under key (written to a temporary directory first, so readers never see a partial entry)
+        import os
+        import shutil
+        import tempfile
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix='.tmp-')
+        try:
+            model.save(tmp)
+            if os.path.isdir(self._entry(key)):
+                shutil.rmtree(self._entry(key))
+            os.replace(tmp, self._entry(key))
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        if (self.max_bytes is not None) or (self.max_age is not None):
+            self.evict(self.max_bytes, self.max_age)
+
+    def entries(self):
+        ## returns a list of (key, size in bytes, last used time) for every entry, least recently used first
+        import os
+        out = []
+        for key in os.listdir(self.directory):
+            entry = self._entry(key)
+            if key.startswith('.') or not os.path.isdir(entry):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+            out.append((key, size, os.path.getmtime(entry)))
+        return sorted(out, key=lambda e: e[2])
+
+    def evict(self, max_bytes=None, max_age=None):
+        ## removes entries older than max_age seconds, then the least recently used entries until the cache is no
+        ## bigger than max_bytes. Returns the keys that were removed.
+        import shutil
+        import time
+        entries = self.entries()
+        removed = []
+        if max_age is not None:
+            now = time.time()
+            removed += [e for e in entries if now - e[2] > max_age]
+            entries = [e for e in entries if now - e[2] <= max_age]
+        if max_bytes is not None:
+            total = sum(e[1] for e in entries)
+            while entries and total > max_bytes:
+                total -= entries[0][1]
+                removed.append(entries.pop(0))
+        for e in removed:
+            shutil.rmtree(self._entry(e[0]), ignore_errors=True)
+        return [e[0] for e in removed]
+
+    def clear(self):
+        return self.evict(max_bytes=0)
@@ -0,0 +1,73 @@
+## columnar storage for scraped league tables: a Parquet (or Feather) dataset partitioned by League & Season,
+## i.e. path/League=<league>/Season=<season>/part-0.parquet. bosko can be pointed at such a dataset, in which case it
+## only reads the player details up front and then each stats column the first time a model uses it.
+## needs pyarrow.
+
+## the columns bosko reads up front (those that are present)
+BASE_COLUMNS = ['League', 'Season', 'Player', 'Squad', 'Pos', '90s']
+
+
+def _partitioning():
+    ## the League & Season partitions are always strings, so that e.g. a season of '2021' isn't read back as a number
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    return ds.partitioning(pa.schema([('League', pa.string()), ('Season', pa.string())]), flavor='hive')
+
+
+def save_dataset(df, path, season, fmt='parquet'):
+    ## writes a data frame of league tables (e.g. from scrape_top_five_leagues) to the dataset at path, under the given
+    ## season (e.g. '2020-2021'). Any data already stored for the same leagues & season is replaced.
+    ##      fmt, 'parquet' (compressed) or 'feather' (uncompressed, so its columns can be memory-mapped directly)
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    if fmt not in ('parquet', 'feather'):
+        raise ValueError("fmt should be one of 'parquet' or 'feather'")
+    df = df.reset_index(drop=True).assign(Season=str(season))
+    df['League'] = df['League'].astype(str)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for column in ('League', 'Season'):
+        table = table.set_column(table.schema.get_field_index(column), column, table[column].cast(pa.string()))
+    ds.write_dataset(table, path, format=fmt, partitioning=_partitioning(), existing_data_behavior='delete_matching')
+
+
+class DatasetSource:
+    ## a dataset (see save_dataset) opened for reading columns on demand
+    ##      path, the dataset's directory
+    ##      filters, (optional) dictionary of {column: value or list of values} selecting the rows to use,
+    ##               e.g. {'League': 'Premier-League', 'Season': '2020-2021'}
+    ## rows always come back in the same order, so columns read at different times line up.
+    def __init__(self, path, filters=None):
+        import os
+        import pyarrow.dataset as ds
+        import pyarrow.fs as fs
+        self.path = os.path.abspath(path)
+        self.filters = filters
+        fmt = 'feather'
+        for _, _, files in os.walk(self.path):
+            if any(f.endswith('.parquet') for f in files):
+                fmt = 'parquet'
+                break
+        self.dataset = ds.dataset(self.path, format=fmt, partitioning=_partitioning(),
+                                  filesystem=fs.LocalFileSystem(use_mmap=True))
+
+    @property
+    def columns(self):
+        return self.dataset.schema.names
+
+    def _filter(self):
+        import pyarrow.dataset as ds
+        expression = None
+        for column, value in (self.filters or {}).items():
+            if isinstance(value, (list, tuple)):
+                condition = ds.field(column).isin(list(value))
+            else:
+                condition = ds.field(column) == value
+            expression = condition if expression is None else expression & condition
+        return expression
+
+    def read(self, columns):
+        ## returns a data frame of the given columns, for every selected row
+        return self.dataset.to_table(columns=list(columns), filter=self._filter()).to_pandas()
+
+    def read_base(self):
+        return self.read([c for c in BASE_COLUMNS if c in self.columns])
@@ -0,0 +1,218 @@
+## streaming aggregation of match logs (one row per player per match) and/or event data (one row per event) into the
+## season table bosko expects: one row per player with 'Player', 'Squad', 'Pos', '90s' and the totals the models use.
+## files are read a chunk at a time and only the running totals per player are kept, so memory use depends on the number
+## of players rather than the number of matches/events. The totals can be saved and later topped up with new matches.
+##
+## e.g. for match logs with columns Player, Squad, Pos, Date, Comp, Match, Min, Sh, xG, Cmp & Att, plus event data with
+## columns Player, Squad, Date, Comp, Match, type, long & outcome:
+##      acc = PlayerAccumulator(sums={'Sh': 'Sh', 'xG': 'xG', 'Cmp': 'Cmp', 'Att': 'Att'},
+##                              counts={'LongAtt': {'type': 'Pass', 'long': True},
+##                                      'LongCmp': {'type': 'Pass', 'long': True, 'outcome': 'Complete'}},
+##                              start='2020-09-01', competitions=['Premier League'], match_column='Match')
+##      acc.update('match_logs/')
+##      acc.update('events/')
+##      bos = bosko(acc.table(), 'Premier League, 2020/21')
+
+
+def read_chunks(source, columns=None, chunk_size=100000):
+    ## yields data frames of at most chunk_size rows from source, which can be:
+    ##      a data frame, or an iterable of data frames (yielded as they are)
+    ##      the path of a .csv (optionally compressed, e.g. .csv.gz) or .parquet file
+    ##      the path of a directory (every .csv & .parquet file in it, in name order) or a list of paths
+    ## columns is an (optional) list of the columns to read; any that a file doesn't have are skipped
+    import os
+    import pandas as pd
+    if isinstance(source, pd.DataFrame):
+        yield source
+        return
+    if isinstance(source, str) and os.path.isdir(source):
+        source = [os.path.join(source, f) for f in sorted(os.listdir(source))
+                  if f.endswith('.parquet') or ('.csv' in f)]
+    if not isinstance(source, str):
+        for item in source:
+            yield from read_chunks(item, columns, chunk_size)
+        return
+    if source.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        file = pq.ParquetFile(source)
+        names = None if columns is None else [c for c in columns if c in file.schema_arrow.names]
+        for batch in file.iter_batches(batch_size=chunk_size, columns=names):
+            yield batch.to_pandas()
+    else:
+        usecols = None if columns is None else (lambda c: c in columns)
+        yield from pd.read_csv(source, usecols=usecols, chunksize=chunk_size)
+
+
+class PlayerAccumulator:
+    ## running per-player totals
+    ##      sums, dictionary of {output column: input column} of values to add up, e.g. {'Sh': 'Sh', 'xG': 'xG'}
+    ##      counts, dictionary of {output column: {input column: value or list of values}} counting the rows (e.g. events)
+    ##              that match every condition, e.g. {'LongCmp': {'type': 'Pass', 'long': True, 'outcome': 'Complete'}}
+    ##      minutes_column, the input column of minutes played (summed into '90s')
+    ##      start & end, (optional) first & last dates (inclusive) of the rows to include
+    ##      competitions, (optional) list of the competitions to include
+    ##      match_column, (optional) input column identifying matches. If given, a player's rows for a match that has
+    ##                    already been added for them are skipped by later updates (see update), so overlapping files can
+    ##                    safely be fed in again.
+    ##      key, the input columns identifying a player
+    ##      date_column, competition_column & pos_column, the input columns of the date, competition & position
+    ## input columns that aren't in a chunk are skipped (as are counts whose columns aren't all there), so match logs &
+    ## event data can be fed to the same accumulator.
+    def __init__(self, sums=None, counts=None, minutes_column='Min', start=None, end=None, competitions=None,
+                 match_column=None, key=('Player', 'Squad'), date_column='Date', competition_column='Comp',
+                 pos_column='Pos'):
+        self.sums = dict(sums or {})
+        self.counts = {name: dict(condition) for name, condition in (counts or {}).items()}
+        clash = [name for name in list(self.sums) + list(self.counts)
+                 if (name == '90s') or ((name in self.sums) and (name in self.counts))]
+        if len(clash) > 0:
+            raise ValueError("Output column(s) " + ', '.join(clash) + " appear more than once")
+        self.minutes_column = minutes_column
+        self.start = None if start is None else str(start)
+        self.end = None if end is None else str(end)
+        self.competitions = None if competitions is None else list(competitions)
+        self.match_column = match_column
+        self.key = list(key)
+        self.date_column = date_column
+        self.competition_column = competition_column
+        self.pos_column = pos_column
+        self.totals = None
+        self.positions = None
+        self.matches = {}
+
+    @property
+    def columns(self):
+        ## the input columns used
+        needed = self.key + [self.date_column, self.competition_column, self.pos_column, self.minutes_column]
+        needed += list(self.sums.values()) + [c for condition in self.counts.values() for c in condition]
+        if self.match_column is not None:
+            needed.append(self.match_column)
+        return list(dict.fromkeys(needed))
+
+    def _select(self, chunk):
+        ## the rows of chunk inside the date & competition windows
+        import pandas as pd
+        keep = pd.Series(True, index=chunk.index)
+        if ((self.start is not None) or (self.end is not None)) and (self.date_column in chunk):
+            dates = pd.to_datetime(chunk[self.date_column], errors='coerce')
+            if self.start is not None:
+                keep &= dates >= pd.Timestamp(self.start)
+            if self.end is not None:
+                keep &= dates <= pd.Timestamp(self.end)
+        if (self.competitions is not None) and (self.competition_column in chunk):
+            keep &= chunk[self.competition_column].isin(self.competitions)
+        return chunk[keep]
+
+    def _parts(self, chunk):
+        ## each output column's values for the rows of chunk (for the outputs whose input columns are there)
+        import numpy as np
+        import pandas as pd
+        parts = {}
+        if self.minutes_column in chunk:
+            parts['90s'] = pd.to_numeric(chunk[self.minutes_column], errors='coerce').to_numpy() / 90
+        for name, column in self.sums.items():
+            if column in chunk:
+                parts[name] = pd.to_numeric(chunk[column], errors='coerce').to_numpy()
+        for name, condition in self.counts.items():
+            if all(column in chunk for column in condition):
+                match = np.ones(chunk.shape[0], dtype=bool)
+                for column, value in condition.items():
+                    values = value if isinstance(value, (list, tuple, set)) else [value]
+                    match &= chunk[column].isin(values).to_numpy()
+                parts[name] = match.astype(np.int64)
+        return parts
+
+    def _accumulate(self, chunk, parts):
+        import pandas as pd
+        if len(parts) > 0:
+            keys = chunk[self.key].reset_index(drop=True)
+            totals = pd.concat([keys, pd.DataFrame(parts)], axis=1).groupby(self.key, sort=False).sum(min_count=0)
+            self.totals = totals if self.totals is None else self._merge(self.totals, totals)
+        if self.pos_column in chunk:
+            positions = chunk[self.key + [self.pos_column]].groupby(self.key + [self.pos_column], sort=False).size()
+            self.positions = positions if self.positions is None else self._merge(self.positions, positions)
+
+    @staticmethod
+    def _merge(old, new):
+        ## adds two sets of totals indexed by player (keeping integer columns as integers)
+        import pandas as pd
+        merged = pd.concat([old, new])
+        return merged.groupby(level=list(range(merged.index.nlevels)), sort=False).sum(min_count=0)
+
+    def add(self, chunk):
+        ## adds a data frame of rows to the totals (without checking for matches that have already been added)
+        chunk = self._select(chunk)
+        if chunk.shape[0] > 0:
+            self._accumulate(chunk, self._parts(chunk))
+
+    def update(self, source, chunk_size=100000):
+        ## adds everything in source (see read_chunks) to the totals. With match_column set, each output column skips the
+        ## (player, match) pairs it already includes from an earlier update (so e.g. match logs & then event data for the
+        ## same matches both count, and so do other players' rows for a match, but feeding in the same match logs twice
+        ## doesn't).
+        import numpy as np
+        new_matches = {}
+        for chunk in read_chunks(source, self.columns, chunk_size):
+            chunk = self._select(chunk)
+            if chunk.shape[0] == 0:
+                continue
+            parts = self._parts(chunk)
+            if (self.match_column is not None) and (self.match_column in chunk):
+                valid = chunk[self.match_column].notna().to_numpy()
+                pairs = list(zip(*[chunk[column].tolist() for column in self.key + [self.match_column]]))
+                unique_pairs = set(pair for pair, ok in zip(pairs, valid) if ok)
+                for name in parts:
+                    seen = self.matches.get(name, set())
+                    if len(seen) > 0:
+                        parts[name] = np.where([pair in seen for pair in pairs], 0, parts[name])
+                    new_matches.setdefault(name, set()).update(unique_pairs)
+            self._accumulate(chunk, parts)
+        for name, ids in new_matches.items():
+            self.matches.setdefault(name, set()).update(ids)
+
+    def table(self):
+        ## the totals as a data frame with Player, Squad, Pos (each player's most common position), '90s' and the sums &
+        ## counts, ready to be passed to bosko
+        import pandas as pd
+        columns = ['90s'] + list(self.sums) + list(self.counts)
+        if self.totals is None:
+            return pd.DataFrame(columns=self.key + ['Pos'] + columns)
+        out = self.totals.reindex(columns=columns).fillna(0)
+        for name in self.counts:
+            out[name] = out[name].astype('int64')
+        pos = pd.Series(index=out.index, dtype=object, name='Pos')
+        if self.positions is not None:
+            most_common = self.positions.sort_values(ascending=False, kind='stable').reset_index()
+            most_common = most_common.drop_duplicates(self.key).set_index(self.key)[self.pos_column]
+            pos = most_common.reindex(out.index).rename('Pos')
+        out.insert(0, 'Pos', pos)
+        return out.reset_index()
+
+    def save(self, path):
+        ## writes the accumulator (settings, totals & the (player, match) pairs added so far) to the directory path
+        import os
+        import json
+        import pickle
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'totals.pkl'), 'wb') as f:
+            pickle.dump({'totals': self.totals, 'positions': self.positions, 'matches': self.matches}, f)
+        with open(os.path.join(path, 'accumulator.json'), 'w') as f:
+            json.dump({'sums': self.sums, 'counts': self.counts, 'minutes_column': self.minutes_column,
+                       'start': self.start, 'end': self.end, 'competitions': self.competitions,
+                       'match_column': self.match_column, 'key': self.key, 'date_column': self.date_column,
+                       'competition_column': self.competition_column, 'pos_column': self.pos_column}, f)
+
+    @classmethod
+    def load(cls, path):
+        ## reads an accumulator written by PlayerAccumulator.save
+        import os
+        import json
+        import pickle
+        with open(os.path.join(path, 'accumulator.json')) as f:
+            acc = cls(**json.load(f))
+        with open(os.path.join(path, 'totals.pkl'), 'rb') as f:
+            state = pickle.load(f)
+        acc.totals = state['totals']
+        acc.positions = state['positions']
+        acc.matches = state['matches']
+        return acc
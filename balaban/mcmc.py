@@ -0,0 +1,484 @@
+## MCMC engine (engine='mcmc') for the models with no conjugate form: 'xSpA' (expected) & 'adj_pass'
+## written in plain NumPy/SciPy, so there's no PyMC3/Theano and no compile step. Each sweep updates
+##      every player-level parameter at once, with a vectorised random-walk Metropolis step per player (on the log-odds
+##      scale, with per-player step sizes tuned during the warm-up)
+##      each population-level parameter in turn, with a univariate slice sampler (on its unconstrained scale)
+## the models & priors are the same as the PyMC3 versions in balaban/templates.py. Several chains are run (in parallel
+## processes) and their split R-hat & effective sample sizes are recorded in the fit report.
+## chain states use the same names (and unconstrained scales) as the ADVI fits' (see ModelTemplate.get_state), so
+## either can warm-start the other.
+
+
+def _log_sigmoid(z):
+    ## log(sigmoid(z)) & log(1 - sigmoid(z)), computed stably
+    import numpy as np
+    return -np.logaddexp(0, -z), -np.logaddexp(0, z)
+
+
+def _beta_population_logp(log_ab, sums, n):
+    ## log density of n values from Beta(a, b), given sums = (sum of log values, sum of log(1 - values))
+    import numpy as np
+    from scipy.special import betaln
+    a, b = np.exp(log_ab)
+    return (a - 1) * sums[0] + (b - 1) * sums[1] - n * betaln(a, b)
+
+
+def _slice(logp, x, rng, w=1.0, max_steps=32, max_shrinks=100):
+    ## one univariate slice sampling update (stepping out, then shrinking) of the scalar x with log density logp
+    import numpy as np
+    log_fx = logp(x)
+    if not np.isfinite(log_fx):
+        return x
+    log_y = log_fx + np.log(rng.random())
+    lower = x - w * rng.random()
+    upper = lower + w
+    j = int(rng.random() * max_steps)
+    k = max_steps - 1 - j
+    while j > 0 and logp(lower) > log_y:
+        lower -= w
+        j -= 1
+    while k > 0 and logp(upper) > log_y:
+        upper += w
+        k -= 1
+    for _ in range(max_shrinks):
+        x_new = lower + rng.random() * (upper - lower)
+        if logp(x_new) > log_y:
+            return x_new
+        if x_new < x:
+            lower = x_new
+        else:
+            upper = x_new
+    return x
+
+
+def _metropolis(logp, z, step, rng):
+    ## one random-walk Metropolis update of every element of z (each independent of the others, given the rest of the
+    ## model). logp maps an array like z to the array of their log densities. Returns the new z & the acceptances.
+    import numpy as np
+    proposal = z + step * rng.standard_normal(z.shape)
+    accept = np.log(rng.random(z.shape)) < logp(proposal) - logp(z)
+    return np.where(accept, proposal, z), accept
+
+
+class _Chain:
+    ## a single chain. Subclasses set
+    ##      players, the names of the per-player variables (each a numpy array of shape (n,) in self.z)
+    ##      hypers, the names of the population-level variables (each a numpy array in self.x)
+    ## and implement
+    ##      player_logp(name, z), log density (up to a constant) of candidate values z of a per-player variable
+    ##      hyper_logp(name, i, x), log density (up to a constant) of the hyperparameters x (a dictionary like self.x),
+    ##                              keeping only the terms that involve x[name][i]
+    ##      refresh(), recomputes anything cached from the per-player variables (called after they're updated)
+    ##      output(), the player-level quantity of interest (shape (n,)) & the population-level parameters
+    players = ()
+    hypers = ()
+
+    def __init__(self, rng, init=None):
+        import numpy as np
+        self.rng = rng
+        self.step = {name: np.full(self.n, 0.5) for name in self.players}
+        self.accepted = {name: np.zeros(self.n) for name in self.players}
+        if init is not None:
+            ## start from a previous fit, overdispersed by its posterior spread
+            for name in self.players:
+                key = 'player:' + name
+                if key + ':mu' in init:
+                    std = np.asarray(init[key + ':std'], dtype=float)
+                    self.z[name] = np.asarray(init[key + ':mu'], dtype=float) + std * rng.standard_normal(self.n)
+                    self.step[name] = 2.4 * std
+            for name in self.hypers:
+                key = 'hyper:' + name
+                if (key + ':mu' in init) and (np.shape(init[key + ':mu']) == self.x[name].shape):
+                    std = np.asarray(init[key + ':std'], dtype=float)
+                    self.x[name] = (np.asarray(init[key + ':mu'], dtype=float)
+                                    + std * rng.standard_normal(self.x[name].shape))
+        self.refresh()
+
+    def refresh(self):
+        pass
+
+    def sweep(self):
+        for name in self.players:
+            self.z[name], accept = _metropolis(lambda z: self.player_logp(name, z), self.z[name], self.step[name],
+                                               self.rng)
+            self.accepted[name] += accept
+        self.refresh()
+        for name in self.hypers:
+            for i in range(self.x[name].shape[0]):
+                def logp(value):
+                    x = dict(self.x)
+                    x[name] = x[name].copy()
+                    x[name][i] = value
+                    return self.hyper_logp(name, i, x)
+                self.x[name][i] = _slice(logp, self.x[name][i], self.rng)
+
+    def adapt(self, n_sweeps, target=0.44):
+        ## scales each player's step size towards the target acceptance rate over the last n_sweeps sweeps
+        import numpy as np
+        for name in self.players:
+            self.step[name] *= np.exp(2 * (self.accepted[name] / n_sweeps - target))
+            self.accepted[name][:] = 0
+
+    def position(self):
+        return dict({'player:' + name: self.z[name] for name in self.players},
+                    **{'hyper:' + name: self.x[name] for name in self.hypers})
+
+
+class _ExpectedChain(_Chain):
+    ## the 'xSpA' model (see _expected_successes_per_action_template):
+    ##      v ~ HalfNormal(100) (shape 2), mu ~ Uniform(0, 1)
+    ##      lambda_i ~ Beta(mu * v[0], (1 - mu) * v[0])
+    ##      sp_i ~ Beta(lambda_i * k_i, (1 - lambda_i) * k_i), with k_i = attempts_i * (v[1] + 1) - 1
+    ## output is lambda & (v[0], v[1], mu)
+    players = ('lambdas_logodds__',)
+    hypers = ('v_log__', 'mu_interval__')
+
+    def __init__(self, data, rng, init=None):
+        import numpy as np
+        sp = np.clip(data['sp'], 1e-6, 1 - 1e-6)
+        self.attempts = data['attempts']
+        self.log_sp, self.log_1msp = np.log(sp), np.log1p(-sp)
+        self.n = sp.shape[0]
+        p = np.clip(sp, 0.01, 0.99)
+        mu = np.mean(p)
+        self.sp = sp
+        self.scale_step = 0.1
+        self.n_scale_moves = 2
+        self.scale_accepted = 0
+        self.z = {'lambdas_logodds__': np.log(p / (1 - p)) + 0.5 * rng.standard_normal(self.n)}
+        self.x = {'v_log__': np.log([10., 10.]) + 0.5 * rng.standard_normal(2),
+                  'mu_interval__': np.log([mu / (1 - mu)]) + 0.5 * rng.standard_normal(1)}
+        super().__init__(rng, init)
+
+    def _k(self, log_v1):
+        import numpy as np
+        return self.attempts * (np.exp(log_v1) + 1) - 1
+
+    def _obs_logp(self, lam, log_v1):
+        from scipy.special import betaln
+        k = self._k(log_v1)
+        a, b = lam * k, (1 - lam) * k
+        return (a - 1) * self.log_sp + (b - 1) * self.log_1msp - betaln(a, b)
+
+    def refresh(self):
+        import numpy as np
+        log_l, log_1ml = _log_sigmoid(self.z['lambdas_logodds__'])
+        self.lam = np.exp(log_l)
+        self.sums = (np.sum(log_l), np.sum(log_1ml))
+
+    def player_logp(self, name, z, log_v1=None):
+        import numpy as np
+        log_l, log_1ml = _log_sigmoid(z)
+        v0 = np.exp(self.x['v_log__'][0])
+        mu = np.exp(_log_sigmoid(self.x['mu_interval__'][0])[0])
+        log_v1 = self.x['v_log__'][1] if log_v1 is None else log_v1
+        ## population density times the jacobian of the log-odds transform, lambda * (1 - lambda)
+        return mu * v0 * log_l + (1 - mu) * v0 * log_1ml + self._obs_logp(np.exp(log_l), log_v1)
+
+    def _scale_logp(self, z, log_v1):
+        import numpy as np
+        return np.sum(self.player_logp(self.players[0], z, log_v1)) - np.exp(2 * log_v1) / (2 * 100 ** 2) + log_v1
+
+    def sweep(self):
+        ## v[1]'s conditional given the lambdas is very narrow (and vice versa), so on top of the one-at-a-time
+        ## updates, v[1] is also moved jointly with the lambdas. Their deviations from (roughly) their conditional
+        ## means are rescaled to match the new observation-level precision.
+        import numpy as np
+        super().sweep()
+        name = self.players[0]
+        v0 = np.exp(self.x['v_log__'][0])
+        mu = np.exp(_log_sigmoid(self.x['mu_interval__'][0])[0])
+
+        def centre(k):
+            p = (k * self.sp + v0 * mu) / (k + v0)
+            return np.log(p / (1 - p))
+
+        for _ in range(self.n_scale_moves):
+            z, log_v1 = self.z[name], self.x['v_log__'][1]
+            new_log_v1 = log_v1 + self.scale_step * self.rng.standard_normal()
+            k, new_k = self._k(log_v1), self._k(new_log_v1)
+            c = np.sqrt((k + v0) / (new_k + v0))
+            new_z = centre(new_k) + (z - centre(k)) * c
+            log_ratio = self._scale_logp(new_z, new_log_v1) - self._scale_logp(z, log_v1) + np.sum(np.log(c))
+            if np.log(self.rng.random()) < log_ratio:
+                self.z[name] = new_z
+                self.x['v_log__'][1] = new_log_v1
+                self.scale_accepted += 1
+        self.refresh()
+
+    def adapt(self, n_sweeps, target=0.44):
+        import numpy as np
+        super().adapt(n_sweeps, target)
+        self.scale_step *= np.exp(2 * (self.scale_accepted / (n_sweeps * self.n_scale_moves) - 0.3))
+        self.scale_accepted = 0
+
+    def hyper_logp(self, name, i, x):
+        import numpy as np
+        log_mu, log_1mmu = _log_sigmoid(x['mu_interval__'][0])
+        if name == 'v_log__':
+            out = -np.exp(2 * x['v_log__'][i]) / (2 * 100 ** 2) + x['v_log__'][i]
+            if i == 1:
+                return out + np.sum(self._obs_logp(self.lam, x['v_log__'][1]))
+        else:
+            out = log_mu + log_1mmu
+        log_ab = np.r_[log_mu, log_1mmu] + x['v_log__'][0]
+        return out + _beta_population_logp(log_ab, self.sums, self.n)
+
+    def output(self):
+        import numpy as np
+        mu = np.exp(_log_sigmoid(self.x['mu_interval__'])[0])
+        return self.lam, np.r_[np.exp(self.x['v_log__']), mu]
+
+
+class _AdjPassChain(_Chain):
+    ## the 'adj_pass' model (see _adj_pass_template):
+    ##      (a_s, b_s) & (a_l, b_l) each with the improper (a + b)^(-5/2) prior
+    ##      lambda_s_i ~ Beta(a_s, b_s), lambda_l_i ~ Beta(a_l, b_l)
+    ##      ShCmp_i ~ Binomial(ShAtt_i, lambda_s_i), LonCmp_i ~ Binomial(LonAtt_i, lambda_s_i * lambda_l_i)
+    ## output is the long-pass-tendency-weighted success probability (as in fit_adj_pass_model) & no hyperparameters
+    players = ('lambda_s_logodds__', 'lambda_l_logodds__')
+    hypers = ('ab_short_log__', 'ab_long_log__')
+
+    def __init__(self, data, rng, init=None):
+        import numpy as np
+        self.ShCmp, self.LonCmp = data['ShCmp'], data['LonCmp']
+        self.ShFail = np.clip(data['ShAtt'] - data['ShCmp'], 0, None)
+        self.LonFail = np.clip(data['LonAtt'] - data['LonCmp'], 0, None)
+        self.long_tendency = data['long_tendency']
+        self.n = self.ShCmp.shape[0]
+        p_s = np.clip((self.ShCmp + 0.5) / (self.ShCmp + self.ShFail + 1), 0.01, 0.99)
+        p_l = np.clip((self.LonCmp + 0.5) / (self.LonCmp + self.LonFail + 1) / p_s, 0.01, 0.99)
+        self.z = {'lambda_s_logodds__': np.log(p_s / (1 - p_s)) + 0.5 * rng.standard_normal(self.n),
+                  'lambda_l_logodds__': np.log(p_l / (1 - p_l)) + 0.5 * rng.standard_normal(self.n)}
+        self.x = {'ab_short_log__': np.log([1., 1.]) + 0.5 * rng.standard_normal(2),
+                  'ab_long_log__': np.log([1., 1.]) + 0.5 * rng.standard_normal(2)}
+        super().__init__(rng, init)
+
+    def refresh(self):
+        import numpy as np
+        self.logs = {name: _log_sigmoid(self.z[name]) for name in self.players}
+        self.sums = {name: (np.sum(self.logs[name][0]), np.sum(self.logs[name][1])) for name in self.players}
+
+    def player_logp(self, name, z):
+        import numpy as np
+        log_p, log_1mp = _log_sigmoid(z)
+        if name == 'lambda_s_logodds__':
+            a, b = np.exp(self.x['ab_short_log__'])
+            log_s, log_l = log_p, _log_sigmoid(self.z['lambda_l_logodds__'])[0]
+            out = a * log_p + b * log_1mp + self.ShCmp * log_p + self.ShFail * log_1mp
+        else:
+            a, b = np.exp(self.x['ab_long_log__'])
+            log_s, log_l = _log_sigmoid(self.z['lambda_s_logodds__'])[0], log_p
+            out = a * log_p + b * log_1mp
+        ## the long passes' likelihood, which involves both probabilities
+        return out + self.LonCmp * (log_s + log_l) + self.LonFail * np.log1p(-np.exp(log_s + log_l))
+
+    def hyper_logp(self, name, i, x):
+        import numpy as np
+        log_ab = x[name]
+        player = 'lambda_s_logodds__' if name == 'ab_short_log__' else 'lambda_l_logodds__'
+        return (-5 / 2 * np.log(np.sum(np.exp(log_ab))) + np.sum(log_ab)
+                + _beta_population_logp(log_ab, self.sums[player], self.n))
+
+    def output(self):
+        import numpy as np
+        s = np.exp(self.logs['lambda_s_logodds__'][0])
+        l = np.exp(self.logs['lambda_l_logodds__'][0])
+        return self.long_tendency * l + (1 - self.long_tendency) * s, np.empty(0)
+
+
+_CHAINS = {'expected': _ExpectedChain,
+           'adj_pass': _AdjPassChain}
+
+
+def run_chain(model_type, data, n_tune, n_draws, seed, init=None, adapt_every=50):
+    ## runs one chain: n_tune warm-up sweeps (tuning the step sizes), then n_draws sweeps that are kept
+    ## returns a dictionary containing:
+    ##      samples, a numpy array of shape (n_draws, N) of the player-level quantity of interest
+    ##      hyper, a numpy array of shape (n_draws, k) of the population-level parameters
+    ##      sums & sq_sums, sums over the kept sweeps of the chain's position (see _Chain.position) & its square
+    ##      acceptance, the mean acceptance rate of the per-player updates over the kept sweeps
+    import numpy as np
+    chain = _CHAINS[model_type](data, np.random.default_rng(seed), init)
+    for t in range(n_tune):
+        chain.sweep()
+        if (t + 1) % adapt_every == 0:
+            chain.adapt(adapt_every)
+    for name in chain.players:
+        chain.accepted[name][:] = 0
+    samples = np.empty((n_draws, chain.n))
+    hyper = None
+    sums = {key: np.zeros_like(value) for key, value in chain.position().items()}
+    sq_sums = {key: np.zeros_like(value) for key, value in chain.position().items()}
+    for t in range(n_draws):
+        chain.sweep()
+        sl, sb = chain.output()
+        if hyper is None:
+            hyper = np.empty((n_draws, sb.shape[0]))
+        samples[t] = sl
+        hyper[t] = sb
+        for key, value in chain.position().items():
+            sums[key] += value
+            sq_sums[key] += value ** 2
+    acceptance = np.mean([np.mean(chain.accepted[name]) for name in chain.players]) / max(n_draws, 1)
+    return dict(samples=samples, hyper=hyper, sums=sums, sq_sums=sq_sums, acceptance=float(acceptance))
+
+
+def _split_chains(draws):
+    ## draws has shape (chains, n, p). Returns the first & second halves of each chain as separate chains
+    import numpy as np
+    half = draws.shape[1] // 2
+    return np.concatenate([draws[:, :half], draws[:, draws.shape[1] - half:]], axis=0)
+
+
+def split_rhat(draws):
+    ## split R-hat of each of p quantities, given draws of shape (chains, n, p)
+    import numpy as np
+    x = _split_chains(draws)
+    n = x.shape[1]
+    within = np.mean(np.var(x, axis=1, ddof=1), axis=0)
+    between = n * np.var(np.mean(x, axis=1), axis=0, ddof=1)
+    var_plus = (n - 1) / n * within + between / n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(within > 0, np.sqrt(var_plus / within), 1.)
+
+
+def effective_sample_size(draws):
+    ## effective sample size of each of p quantities, given draws of shape (chains, n, p), from the chains' combined
+    ## autocorrelations (truncated with Geyer's initial monotone sequence), as in Stan
+    import numpy as np
+    x = _split_chains(draws)
+    m, n = x.shape[:2]
+    xc = x - np.mean(x, axis=1, keepdims=True)
+    f = np.fft.rfft(xc, n=2 * n, axis=1)
+    acov = np.fft.irfft(f * np.conj(f), n=2 * n, axis=1)[:, :n] / n
+    within = np.mean(acov[:, 0] * n / (n - 1), axis=0)
+    var_plus = within * (n - 1) / n + np.var(np.mean(x, axis=1), axis=0, ddof=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rho = 1 - (within - np.mean(acov, axis=0)) / var_plus
+    rho[0] = 1
+    n_pairs = n // 2
+    pairs = rho[:2 * n_pairs].reshape(n_pairs, 2, x.shape[2]).sum(axis=1)
+    pairs = np.where(np.cumprod(pairs > 0, axis=0).astype(bool), pairs, 0)
+    pairs = np.minimum.accumulate(pairs, axis=0)
+    tau = np.maximum(-1 + 2 * np.sum(pairs, axis=0), 1 / np.log10(m * n))
+    return np.where(var_plus > 0, m * n / tau, m * n)
+
+
+def _group_data(data, sel):
+    ## the per-player values of data (the arrays) for the players where sel is True
+    import numpy as np
+    return {name: (value[sel] if np.ndim(value) > 0 else value) for name, value in data.items()}
+
+
+def _group_state(state, sel, n_groups, g):
+    ## group g's part of a state dictionary (see ModelTemplate.get_state) for a fit with n_groups groups: the per-player
+    ## values of its players (where sel is True) & its share of each (flattened, group by group) population-level value.
+    ## the state's groups should already match the fit's (see balaban.utils.remap_groups); population-level values that
+    ## are missing (NaN) for group g are left out, so the chains start those from scratch.
+    import numpy as np
+    if state is None:
+        return None
+    out = {}
+    for name, value in state.items():
+        if name.startswith('player:'):
+            out[name] = np.asarray(value)[sel]
+        elif name.startswith('hyper:') and (np.size(value) % n_groups == 0):
+            value = np.asarray(value, dtype=float).reshape(n_groups, -1)[g]
+            if np.all(np.isfinite(value)):
+                out[name] = value
+    return out
+
+
+def fit_mcmc(model_type, data, n_samples=6000, n_chains=4, n_tune=1000, random_seed=None, init=None, n_jobs=None,
+             groups=None):
+    ## samples model_type ('expected' or 'adj_pass') given data, a dictionary of numpy arrays (see the _Chain classes)
+    ##      n_samples, the total number of draws kept (split evenly across the n_chains chains)
+    ##      n_tune, the number of warm-up sweeps per chain (discarded)
+    ##      init, (optional) state dictionary to start from (see ModelTemplate.get_state), e.g. from a previous fit
+    ##      n_jobs, number of processes to run the chains in. Defaults to 1, i.e. the chains run one after another in
+    ##              this process. With n_jobs > 1 the chains run in a pool of spawned processes, so a script calling
+    ##              this must guard its entry point with `if __name__ == '__main__':`. Inside a worker process (e.g.
+    ##              of bosko.add_models) the chains always run one after another.
+    ##      groups, (optional) integer array giving each player's group (from 0 to G - 1). Groups have their own
+    ##              population-level parameters, so they're independent given the data and each is sampled by its own
+    ##              n_chains chains (all run in the same pool of processes).
+    ## returns:
+    ##      samples & hyper, numpy arrays of shape (n_samples, N) and (n_samples, k) (or (n_samples, G, k) with groups),
+    ##                       chains concatenated
+    ##      state, the posterior means & standard deviations of the chains' positions, as a Posterior state dictionary
+    ##      report, a fit report dictionary (see balaban.posterior.make_report) with an extra 'mcmc' entry holding the
+    ##              number of chains, warm-up & kept sweeps, acceptance rate, and the split R-hat & effective sample
+    ##              sizes (max/min over everything, the players' max & 99th percentile R-hat, plus one per
+    ##              population-level parameter). 'converged' means every population-level R-hat and the players' 99th
+    ##              percentile R-hat are below 1.01.
+    import os
+    import time
+    import multiprocessing
+    import numpy as np
+    from concurrent.futures import ProcessPoolExecutor
+    from balaban.posterior import make_report
+    t0 = time.perf_counter()
+    n = next(value for value in data.values() if np.ndim(value) > 0).shape[0]
+    codes = np.zeros(n, dtype=np.int64) if groups is None else np.asarray(groups)
+    n_groups = int(np.max(codes)) + 1 if n > 0 else 1
+    n_draws = -(-n_samples // n_chains)
+    seeds = np.random.SeedSequence(random_seed).spawn(n_chains * n_groups)
+    if (n_jobs is None) or (multiprocessing.parent_process() is not None):
+        n_jobs = 1
+    n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+    n_jobs = max(1, min(n_jobs, n_chains * n_groups, os.cpu_count()))
+    args = []
+    for g in range(n_groups):
+        sel = codes == g
+        group_data = data if groups is None else _group_data(data, sel)
+        group_init = init if groups is None else _group_state(init, sel, n_groups, g)
+        args += [(model_type, group_data, n_tune, n_draws, seed, group_init)
+                 for seed in seeds[g * n_chains:(g + 1) * n_chains]]
+    if n_jobs == 1:
+        runs = [run_chain(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context('spawn')) as pool:
+            runs = list(pool.map(run_chain, *zip(*args)))
+    t1 = time.perf_counter()
+
+    total = n_draws * n_chains
+    samples = np.empty((min(total, n_samples), n))
+    hyper = []
+    rhat, ess, rhat_hyper, ess_hyper = [], [], [], []
+    state = {}
+    for g in range(n_groups):
+        sel = codes == g
+        chains = runs[g * n_chains:(g + 1) * n_chains]
+        group_samples = np.stack([c['samples'] for c in chains])
+        group_hyper = np.stack([c['hyper'] for c in chains])
+        rhat.append(split_rhat(group_samples))
+        ess.append(effective_sample_size(group_samples))
+        rhat_hyper.append(split_rhat(group_hyper))
+        ess_hyper.append(effective_sample_size(group_hyper))
+        samples[:, sel] = group_samples.reshape(total, -1)[:n_samples]
+        hyper.append(group_hyper.reshape(total, -1)[:n_samples])
+        for key in chains[0]['sums']:
+            mean = sum(c['sums'][key] for c in chains) / total
+            std = np.sqrt(np.maximum(sum(c['sq_sums'][key] for c in chains) / total - mean ** 2, 1e-12))
+            if key.startswith('player:'):
+                for suffix, value in ((':mu', mean), (':std', std)):
+                    state.setdefault(key + suffix, np.zeros(n))[sel] = value
+            else:
+                state[key + ':mu'] = np.r_[state.get(key + ':mu', []), mean]
+                state[key + ':std'] = np.r_[state.get(key + ':std', []), std]
+    rhat, ess = np.concatenate(rhat), np.concatenate(ess)
+    rhat_hyper, ess_hyper = np.concatenate(rhat_hyper), np.concatenate(ess_hyper)
+    ## with hundreds of players, a few of them will have R-hat above 1.01 by chance even when the chains have mixed,
+    ## so the players are judged on a high quantile of their R-hats rather than the worst one
+    rhat_player_max = float(np.max(rhat)) if rhat.size > 0 else 1.0
+    rhat_player_q99 = float(np.quantile(rhat, 0.99)) if rhat.size > 0 else 1.0
+    converged = bool(np.all(rhat_hyper < 1.01) and (rhat_player_q99 < 1.01))
+    report = make_report(n_tune + n_draws, converged, [], fit=t1 - t0, diagnostics=time.perf_counter() - t1)
+    report['mcmc'] = dict(chains=n_chains, tune=n_tune, draws=n_draws,
+                          acceptance=float(np.mean([c['acceptance'] for c in runs])),
+                          rhat_max=float(np.max(np.r_[rhat, rhat_hyper])), rhat_player_max=rhat_player_max,
+                          rhat_player_q99=rhat_player_q99, ess_min=float(np.min(np.r_[ess, ess_hyper])),
+                          rhat_hyper=[float(r) for r in rhat_hyper], ess_hyper=[float(e) for e in ess_hyper])
+    hyper = hyper[0] if groups is None else np.stack(hyper, axis=1)
+    return samples, hyper, state, report
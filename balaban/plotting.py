@@ -0,0 +1,156 @@
+## radar plots of players' percentile histograms, shared by bosko.make_plot and the batch renderer bosko.render_all
+## the figure for a given set of models is built once (RadarTemplate) and each player is drawn into it by updating
+## the artists in place: one PolyCollection of annular sectors (with per-face alpha) for all the metrics' shading,
+## plus the text artists for the titles and medians. Only matplotlib's Agg canvas is needed to render to file.
+
+_FONTS = {}
+
+
+def get_fonts(use_pretty_font=True):
+    ## font properties for the title, subtitle, labels & medians, loaded once per process
+    import matplotlib.font_manager as fm
+    if use_pretty_font not in _FONTS:
+        fname = None
+        if use_pretty_font:
+            try:
+                from importlib.resources import files
+                fname = str(files('balaban') / 'JosefinSans-Regular.ttf')
+                fm.FontProperties(fname=fname, size=10).get_name()
+            except Exception:
+                fname = None
+        _FONTS[use_pretty_font] = {key: fm.FontProperties(fname=fname, size=size)
+                                   for key, size in (('title', 10), ('subtitle', 9), ('labels', 8), ('medians', 7))}
+    return _FONTS[use_pretty_font]
+
+
+def _sector(theta0, theta1, r0, r1, n_arc=16):
+    ## vertices (theta, r) of the annular sector between angles theta0 & theta1 and radii r0 & r1
+    import numpy as np
+    arc = np.linspace(theta0, theta1, n_arc)
+    return np.r_[np.c_[arc, np.full(n_arc, r0)], np.c_[arc[::-1], np.full(n_arc, r1)]]
+
+
+def radar_data(models, player_index):
+    ## the data drawn for one player: a list (one entry per model) of (hist_counts, hist_edges, quantiles)
+    from balaban.utils import obtain_player_quantiles
+    out = []
+    for model in models:
+        h, p90 = obtain_player_quantiles(model, player_index)
+        out.append((h[0], h[1], p90))
+    return out
+
+
+class RadarTemplate:
+    ## a radar plot figure for a fixed list of model labels, redrawn for each player with draw
+    ##      labels, the model names shown around the radar
+    ##      use_pretty_font, whether to use the packaged Josefin Sans font
+    ##      dpi, figure resolution
+    ##      fig, (optional) the figure to draw in (e.g. one from pyplot); by default a new figure on an Agg canvas
+    def __init__(self, labels, use_pretty_font=True, dpi=125, fig=None):
+        import numpy as np
+        from matplotlib.collections import PolyCollection
+        from matplotlib.colors import to_rgba
+        if fig is None:
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            fig = Figure(dpi=dpi)
+            FigureCanvasAgg(fig)
+        fonts = get_fonts(use_pretty_font)
+        self.fig = fig
+        self.n_bars = n_bars = len(labels)
+        self.ax = ax = fig.add_subplot(111, projection='polar')
+        width = 2 * np.pi / n_bars
+        theta = np.pi / 2 + np.arange(n_bars) * width
+        self.theta = theta
+        self.width = width
+        self.colour = np.array(to_rgba('seagreen'))
+
+        ## white background bars with seagreen edges, then the shading, which is replaced for each player
+        ax.add_collection(PolyCollection([_sector(t - width / 2, t + width / 2, 0, 1) for t in theta],
+                                         facecolors='white', edgecolors='seagreen', linewidths=0.2))
+        self.shading = PolyCollection([], linewidths=0)
+        ax.add_collection(self.shading)
+        ax.set_ylim(0, 1.05)
+
+        ax.axis('off')
+        for quantile in [0.25, 0.5, 0.75]:
+            ax.plot(np.linspace(0, 2 * np.pi, 200), quantile * np.ones(200), c='gray',
+                    alpha=0.2 + 0.3 * (quantile == 0.5), ls='--')
+        ax.plot(np.linspace(0, 2 * np.pi, 200), np.ones(200), c='gray', alpha=0.5)
+
+        self.title = fig.suptitle('', y=1.04, fontsize=10, fontproperties=fonts['title'])
+        self.subtitle = ax.set_title('', fontsize=9, y=1.1, fontproperties=fonts['subtitle'])
+        rotations = np.rad2deg(theta) - 90 - 180 * ((theta > np.pi) & (theta < 2 * np.pi))
+        self.medians = []
+        for idx in range(n_bars):
+            ax.text(theta[idx], 1.2, labels[idx],
+                    ha='center',
+                    va='center',
+                    rotation=rotations[idx],
+                    rotation_mode="anchor",
+                    fontsize=8,
+                    fontproperties=fonts['labels'], )
+            self.medians.append(ax.text(theta[idx], 1.075, '',
+                                        ha='center',
+                                        va='center',
+                                        rotation=rotations[idx],
+                                        rotation_mode="anchor",
+                                        fontsize=9,
+                                        fontproperties=fonts['medians'],
+                                        color='firebrick'))
+
+    def draw(self, title, subtitle, data):
+        ## draws one player into the figure
+        ##      title & subtitle, the figure's title & subtitle text
+        ##      data, a list of (hist_counts, hist_edges, quantiles), one per model (see radar_data)
+        import numpy as np
+        verts = []
+        colours = []
+        for j, (counts, edges, p90) in enumerate(data):
+            t = self.theta[j]
+            top = np.max(counts)
+            for i in range(1, 25):
+                verts.append(_sector(t - self.width / 2, t + self.width / 2, edges[i - 1], edges[i]))
+                colours.append(np.r_[self.colour[:3], counts[i] / top if top > 0 else 0])
+            self.medians[j].set_text(f'{p90[1]:.3}' + ' (' + f'{p90[0]:.3}' + ', ' + f'{p90[2]:.3}' + ')')
+        self.shading.set_verts(verts)
+        self.shading.set_facecolors(colours)
+        self.title.set_text(title)
+        self.subtitle.set_text(subtitle)
+
+    def save(self, path, fmt='png'):
+        self.fig.savefig(path, format=fmt, bbox_inches='tight')
+
+
+def render_chunk(labels, jobs, fmt='png', use_pretty_font=True, dpi=125):
+    ## renders a list of jobs, each a tuple (path, title, subtitle, data), reusing a single figure
+    ## this is what each render_all worker process runs
+    template = RadarTemplate(labels, use_pretty_font=use_pretty_font, dpi=dpi)
+    for path, title, subtitle, data in jobs:
+        template.draw(title, subtitle, data)
+        template.save(path, fmt)
+    return [job[0] for job in jobs]
+
+
+_TEMPLATES = {}
+
+
+def render_bytes(labels, title, subtitle, data, fmt='png', use_pretty_font=True, dpi=125, max_templates=8):
+    ## renders one radar plot (see RadarTemplate.draw) and returns the file's contents. The figure for each set of labels
+    ## is kept (up to max_templates of them) and reused, so this is what each balaban.serve render worker runs
+    import io
+    key = (tuple(labels), use_pretty_font, dpi)
+    if key not in _TEMPLATES:
+        if len(_TEMPLATES) >= max_templates:
+            del _TEMPLATES[next(iter(_TEMPLATES))]
+        _TEMPLATES[key] = RadarTemplate(labels, use_pretty_font=use_pretty_font, dpi=dpi)
+    template = _TEMPLATES[key]
+    template.draw(title, subtitle, data)
+    buffer = io.BytesIO()
+    template.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def file_name(player, squad, fmt):
+    import re
+    return re.sub(r'[^\w\-]+', '_', str(player) + '_' + str(squad)).strip('_') + '.' + fmt
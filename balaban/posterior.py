@@ -0,0 +1,147 @@
+class Posterior:
+    ## container for the posterior samples of a fitted model (this replaces the old [sl, sb, kk, model_type] list)
+    ##      samples, a numpy array of shape (n_samples, N) containing posterior samples of the player-level quantity
+    ##               of interest (N is the number of players included in the model)
+    ##      hyper, a numpy array of shape (n_samples, k) containing posterior samples of the population-level parameters
+    ##             (k is 0 for models that don't have any, e.g. 'xSp90' and 'adj_pass'), or of shape (n_samples, G, k)
+    ##             for models fitted with groups (one set per group)
+    ##      mask, boolean of shape (num_players,) indicating which players in the data frame are included in the model
+    ##      model_type, character string indicating the model type
+    ##      state, (optional) dictionary of numpy arrays describing the fit, used to warm-start refits on new data.
+    ##             Keys are 'player:<name>' for per-player values (one per included player) & 'hyper:<name>' otherwise.
+    ##      report, (optional) fit report dictionary (see make_report)
+    ##      groups, (optional) integer array of shape (N,) giving the group of each included player, for models fitted with
+    ##              separate population-level parameters per group (see estimate_model), & group_labels, their labels
+    ## samples are stored as dtype (float32 by default), keeping every thin-th draw. If memmap_path is given, the sample
+    ## matrix is written to that .npy file and memory-mapped read-only rather than held in RAM.
+    ## model[0], model[1], model[2] & model[3] still work so that code written for the old list keeps working.
+    __slots__ = ('samples', 'hyper', 'mask', 'model_type', 'memmap_path', 'state', 'report', 'cache', 'groups',
+                 'group_labels')
+
+    def __init__(self, samples, hyper, mask, model_type, dtype='float32', thin=1, memmap_path=None, state=None,
+                 report=None, groups=None, group_labels=None):
+        import numpy as np
+        samples = np.asarray(samples)[::thin]
+        hyper = np.asarray(hyper, dtype=dtype)
+        if hyper.size == 0:
+            hyper = np.empty((samples.shape[0], 0), dtype=dtype)
+        else:
+            hyper = hyper[::thin]
+        if memmap_path is not None:
+            out = np.lib.format.open_memmap(memmap_path, mode='w+', dtype=dtype, shape=samples.shape)
+            out[:] = samples
+            out.flush()
+            del out
+            samples = np.load(memmap_path, mmap_mode='r')
+        else:
+            samples = samples.astype(dtype, copy=False)
+        self.samples = samples
+        self.hyper = hyper
+        self.mask = np.asarray(mask, dtype=bool)
+        self.model_type = model_type
+        self.memmap_path = memmap_path
+        self.state = {} if state is None else state
+        self.report = {} if report is None else report
+        self.cache = {}
+        self.groups = None if groups is None else np.asarray(groups, dtype=np.int64)
+        self.group_labels = None if group_labels is None else [str(label) for label in group_labels]
+
+    def __getstate__(self):
+        ## memory-mapped samples are pickled by path (so that e.g. worker processes don't copy them around),
+        ## and the cache is dropped
+        state = {slot: getattr(self, slot) for slot in self.__slots__ if slot != 'cache'}
+        if self.memmap_path is not None:
+            state['samples'] = None
+        return state
+
+    def __setstate__(self, state):
+        import numpy as np
+        self.groups = None
+        self.group_labels = None
+        for slot, value in state.items():
+            setattr(self, slot, value)
+        if self.memmap_path is not None:
+            self.samples = np.load(self.memmap_path, mmap_mode='r')
+        self.cache = {}
+
+    def save(self, directory):
+        ## writes the posterior to directory as .npy files (samples.npy, hyper.npy, mask.npy & groups.npy, for models
+        ## fitted with groups) plus meta.json
+        import os
+        import json
+        import numpy as np
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'samples.npy'), self.samples)
+        np.save(os.path.join(directory, 'hyper.npy'), self.hyper)
+        np.save(os.path.join(directory, 'mask.npy'), self.mask)
+        np.savez(os.path.join(directory, 'state.npz'), **self.state)
+        if self.groups is not None:
+            np.save(os.path.join(directory, 'groups.npy'), self.groups)
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump({'model_type': self.model_type, 'report': self.report, 'group_labels': self.group_labels}, f)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        ## reads a posterior written by Posterior.save. If mmap is True the samples are memory-mapped rather than read
+        import os
+        import json
+        import numpy as np
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        samples_path = os.path.join(directory, 'samples.npy')
+        model = cls.__new__(cls)
+        model.samples = np.load(samples_path, mmap_mode='r' if mmap else None)
+        model.hyper = np.load(os.path.join(directory, 'hyper.npy'))
+        model.mask = np.load(os.path.join(directory, 'mask.npy'))
+        state_path = os.path.join(directory, 'state.npz')
+        if os.path.isfile(state_path):
+            with np.load(state_path) as state:
+                model.state = dict(state)
+        else:
+            model.state = {}
+        groups_path = os.path.join(directory, 'groups.npy')
+        model.groups = np.load(groups_path) if os.path.isfile(groups_path) else None
+        model.group_labels = meta.get('group_labels')
+        model.model_type = meta['model_type']
+        model.report = meta.get('report', {})
+        model.memmap_path = samples_path if mmap else None
+        model.cache = {}
+        return model
+
+    def __getitem__(self, item):
+        return (self.samples, self.hyper, self.mask, self.model_type)[item]
+
+    def __len__(self):
+        return 4
+
+    def __iter__(self):
+        return iter((self.samples, self.hyper, self.mask, self.model_type))
+
+    def __repr__(self):
+        return 'Posterior(model_type=%r, n_samples=%d, n_players=%d, dtype=%s%s)' % (
+            self.model_type, self.samples.shape[0], self.samples.shape[1], self.samples.dtype,
+            ', memmap_path=%r' % self.memmap_path if self.memmap_path is not None else '')
+
+    @property
+    def n_samples(self):
+        return self.samples.shape[0]
+
+    @property
+    def nbytes(self):
+        ## in-memory footprint of the samples (memory-mapped samples are counted as 0)
+        return ((0 if self.memmap_path is not None else self.samples.nbytes) + self.hyper.nbytes + self.mask.nbytes
+                + (0 if self.groups is None else self.groups.nbytes))
+
+
+def make_report(iterations, converged, elbo_trace, **timings):
+    ## the fit report attached to each Posterior (Posterior.report)
+    ##      iterations, the number of optimisation iterations used
+    ##      converged, whether the convergence criteria were met before the iteration limit (None if not checked)
+    ##      elbo, a summary of the ELBO trace (first, last, max & the block means themselves), if there is one
+    ##      timings, wall-clock seconds spent in each stage (compile, fit, sample, postprocess & later percentiles)
+    elbo_trace = [float(e) for e in elbo_trace]
+    elbo = None
+    if len(elbo_trace) > 0:
+        elbo = dict(first=elbo_trace[0], last=elbo_trace[-1], max=max(elbo_trace), trace=elbo_trace)
+    return dict(iterations=int(iterations), converged=converged, elbo=elbo,
+                timings={stage: float(t) for stage, t in timings.items()})
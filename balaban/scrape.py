@@ -0,0 +1,388 @@
+## fetching & parsing of fbref's league tables, in two separate layers
+##      fetchers get a page's HTML given its URL: HTTPFetcher (plain HTTP), SeleniumFetcher (headless Chrome) or
+##      DirectoryFetcher (a local directory of saved pages, e.g. for working offline or testing the parser)
+##      fetch_pages fetches a list of URLs with bounded concurrency, through an (optional) on-disk PageCache that
+##      only re-downloads pages which are stale and have actually changed (checked with ETag/Last-Modified)
+##      parse_stats_table turns the div_stats_<category> table in a page into a typed data frame, following an explicit
+##      per-category schema (using only the standard library's HTML parser)
+## scrape_top_five_leagues puts these together.
+
+LEAGUES = {'epl': ('9', 'Premier-League'),
+           'laliga': ('12', 'La-Liga'),
+           'bundesliga': ('20', 'Bundesliga'),
+           'ligue1': ('13', 'Ligue-1'),
+           'seriea': ('11', 'Serie-A')}
+
+CATEGORIES = ['passing', 'shooting', 'misc', 'possession', 'defense', 'gca', 'passing_types']
+
+## the key identifying a player across each league's tables
+KEY = ['Player', 'Squad']
+
+## each category's table is parsed according to its schema:
+##      text, columns kept as strings (found by name)
+##      numeric, other columns kept as numbers (found by name)
+##      stats, position of the first stats column. Every column from there up to (but not including) the last one,
+##             which just links to the players' match logs, is a number.
+## the player details ('Pos', '90s', etc.) are only kept from the 'passing' table.
+SCHEMAS = {'passing': dict(text=['Player', 'Pos', 'Squad'], numeric=['90s'], stats=8)}
+SCHEMAS.update({category: dict(text=['Player', 'Squad'], numeric=[], stats=8) for category in CATEGORIES[1:]})
+
+
+class Page:
+    ## a fetched page
+    ##      status, the HTTP status code (304 means not modified since the given ETag/Last-Modified)
+    ##      text, the HTML (None if status is 304)
+    ##      etag & last_modified, the corresponding response headers, if any
+    __slots__ = ('status', 'text', 'etag', 'last_modified')
+
+    def __init__(self, status, text, etag=None, last_modified=None):
+        self.status = status
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class HTTPFetcher:
+    ## fetches pages over plain HTTP(S) with urllib, making conditional requests when given an ETag/Last-Modified
+    def __init__(self, headers=None, timeout=30):
+        self.headers = {'User-Agent': 'Mozilla/5.0 (compatible; balaban)'} if headers is None else headers
+        self.timeout = timeout
+
+    def fetch(self, url, etag=None, last_modified=None):
+        import urllib.request
+        import urllib.error
+        headers = dict(self.headers)
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if last_modified is not None:
+            headers['If-Modified-Since'] = last_modified
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=self.timeout) as r:
+                charset = r.headers.get_content_charset() or 'utf-8'
+                return Page(r.status, r.read().decode(charset, errors='replace'), r.headers.get('ETag'),
+                            r.headers.get('Last-Modified'))
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return Page(304, None, etag, last_modified)
+            raise
+
+    def close(self):
+        pass
+
+
+class SeleniumFetcher:
+    ## fetches pages with headless Chrome (the page source after any scripts have run)
+    ## each thread gets its own browser, so fetch_pages' max_workers is also the number of browsers
+    def __init__(self, path_to_chromedriver):
+        import threading
+        self.path_to_chromedriver = path_to_chromedriver
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._browsers = []
+
+    def _browser(self):
+        if getattr(self._local, 'browser', None) is None:
+            from selenium import webdriver
+            chrome_options = webdriver.ChromeOptions()
+            chrome_options.add_argument('--headless')
+            chrome_options.add_argument('--no-sandbox')
+            chrome_options.add_argument('--disable-dev-shm-usage')
+            self._local.browser = webdriver.Chrome(self.path_to_chromedriver, chrome_options=chrome_options)
+            with self._lock:
+                self._browsers.append(self._local.browser)
+        return self._local.browser
+
+    def fetch(self, url, etag=None, last_modified=None):
+        browser = self._browser()
+        browser.get(url)
+        return Page(200, browser.page_source)
+
+    def close(self):
+        with self._lock:
+            for browser in self._browsers:
+                browser.quit()
+            self._browsers = []
+
+
+class DirectoryFetcher:
+    ## reads pages from a directory of saved HTML files, named as in page_file_name (see save_pages)
+    def __init__(self, directory):
+        self.directory = directory
+
+    def fetch(self, url, etag=None, last_modified=None):
+        import os
+        with open(os.path.join(self.directory, page_file_name(url)), encoding='utf-8') as f:
+            return Page(200, f.read())
+
+    def close(self):
+        pass
+
+
+def page_file_name(url):
+    ## file name for a saved page, e.g. 'en_comps_9_passing_Premier-League-Stats.html'
+    import re
+    from urllib.parse import urlparse
+    return re.sub(r'[^\w\-]+', '_', urlparse(url).path).strip('_') + '.html'
+
+
+def save_pages(pages, directory):
+    ## saves a dictionary of {url: HTML} (as returned by fetch_pages) to directory, for use with DirectoryFetcher
+    import os
+    os.makedirs(directory, exist_ok=True)
+    for url, text in pages.items():
+        with open(os.path.join(directory, page_file_name(url)), 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+class PageCache:
+    ## on-disk cache of fetched pages, keyed by URL
+    ##      directory, where the cache lives
+    ##      max_age, age in seconds for which a cached page is used without checking for a newer version. Older pages
+    ##               are re-requested conditionally (with their ETag/Last-Modified), so unchanged pages aren't
+    ##               downloaded again (with fetchers that support it, i.e. HTTPFetcher)
+    def __init__(self, directory, max_age=6 * 60 * 60):
+        import os
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_age = max_age
+
+    def _paths(self, url):
+        import os
+        import hashlib
+        key = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.directory, key + '.html'), os.path.join(self.directory, key + '.json')
+
+    def get(self, url):
+        ## returns (HTML, meta) for url, or (None, None) if it isn't cached. meta is a dictionary containing
+        ## 'url', 'etag', 'last_modified' & 'fetched' (the time it was last fetched or confirmed unchanged)
+        import os
+        import json
+        html_path, meta_path = self._paths(url)
+        if not (os.path.isfile(html_path) and os.path.isfile(meta_path)):
+            return None, None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        with open(html_path, encoding='utf-8') as f:
+            return f.read(), meta
+
+    def is_fresh(self, meta):
+        import time
+        return (meta is not None) and (time.time() - meta['fetched'] < self.max_age)
+
+    def put(self, url, page):
+        ## stores a fetched page. A 304 (not modified) page just marks the cached copy as fresh again.
+        import os
+        import json
+        import time
+        html_path, meta_path = self._paths(url)
+        if page.status != 304:
+            with open(html_path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(page.text)
+            os.replace(html_path + '.tmp', html_path)
+        meta = dict(url=url, etag=page.etag, last_modified=page.last_modified, fetched=time.time())
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+
+def fetch_pages(urls, fetcher, cache=None, max_workers=4):
+    ## fetches every URL in urls with fetcher, using at most max_workers concurrent requests
+    ## if cache (a PageCache) is given, fresh cached pages are used as they are, stale ones are re-requested
+    ## conditionally and only changed pages are downloaded
+    ## returns a dictionary of {url: HTML}
+    from concurrent.futures import ThreadPoolExecutor
+
+    def get(url):
+        if cache is None:
+            return fetcher.fetch(url).text
+        text, meta = cache.get(url)
+        if cache.is_fresh(meta):
+            return text
+        if text is None:
+            page = fetcher.fetch(url)
+        else:
+            page = fetcher.fetch(url, etag=meta['etag'], last_modified=meta['last_modified'])
+        cache.put(url, page)
+        return text if page.status == 304 else page.text
+
+    urls = list(dict.fromkeys(urls))
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        return dict(zip(urls, pool.map(get, urls)))
+
+
+def stats_table_html(html, category):
+    ## extracts the HTML of the table inside <div id="div_stats_<category>"> from a page. fbref ships some of its
+    ## tables inside HTML comments (uncommented by a script in the browser), so comment markers are ignored.
+    import re
+    html = html.replace('<!--', '').replace('-->', '')
+    match = re.search(r'<div[^>]*\bid\s*=\s*["\']div_stats_' + re.escape(category) + r'["\']', html)
+    if match is None:
+        raise ValueError("No div_stats_" + category + " table found")
+    start = html.find('<table', match.end())
+    end = html.find('</table>', start)
+    if (start < 0) or (end < 0):
+        raise ValueError("No div_stats_" + category + " table found")
+    return html[start:end + len('</table>')]
+
+
+class _TableParser:
+    ## collects the header rows (with colspans expanded) & body rows of an HTML table as lists of cell text
+    def __init__(self):
+        from html.parser import HTMLParser
+        outer = self
+
+        class Parser(HTMLParser):
+            def handle_starttag(self, tag, attrs):
+                outer.start(tag, dict(attrs))
+
+            def handle_endtag(self, tag):
+                outer.end(tag)
+
+            def handle_data(self, data):
+                if outer.cell is not None:
+                    outer.cell.append(data)
+
+        self.parser = Parser(convert_charrefs=True)
+        self.header, self.body = [], []
+        self.section = None
+        self.row = None
+        self.cell = None
+        self.colspan = 1
+
+    def start(self, tag, attrs):
+        if tag in ('thead', 'tbody', 'tfoot'):
+            self.section = tag
+        elif tag == 'tr':
+            ## fbref repeats its header rows inside the body, marked with a 'thead' (or 'spacer') class
+            classes = (attrs.get('class') or '').split()
+            self.row = [] if ('thead' not in classes) and ('spacer' not in classes) else None
+            if (self.row is None) and (self.section == 'thead'):
+                self.row = []
+        elif tag in ('th', 'td') and (self.row is not None):
+            self.cell = []
+            self.colspan = int(attrs.get('colspan') or 1)
+
+    def end(self, tag):
+        if tag in ('th', 'td') and (self.cell is not None):
+            self.row.extend([''.join(self.cell).strip()] * (self.colspan if self.section == 'thead' else 1))
+            self.cell = None
+        elif tag == 'tr' and (self.row is not None):
+            (self.header if self.section == 'thead' else self.body).append(self.row)
+            self.row = None
+        elif tag in ('thead', 'tbody', 'tfoot'):
+            self.section = None
+
+    def feed(self, html):
+        self.parser.feed(html)
+        self.parser.close()
+        return self.header, self.body
+
+
+def read_table(table_html):
+    ## parses an HTML table into its column names & rows (lists of strings). With two header rows (fbref's grouped
+    ## columns), names are '<group>: <name>', or just '<name>' for columns not in a group.
+    header, body = _TableParser().feed(table_html)
+    if len(header) == 0:
+        header, body = body[:1], body[1:]
+    names = header[-1]
+    if len(header) > 1:
+        groups = header[-2] + [''] * (len(names) - len(header[-2]))
+        names = [(group + ': ' if group else '') + name for group, name in zip(groups, names)]
+    body = [row for row in body if len(row) == len(names)]
+    return names, body
+
+
+def to_numeric(values):
+    ## parses an array of fbref's cell strings (e.g. '1,234', '56.7', '' or None) into float64, with NaN for blanks
+    import numpy as np
+    import pandas as pd
+    values = pd.Series(np.asarray(values, dtype=object), dtype=object).str.replace(',', '', regex=False)
+    return pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64)
+
+
+def parse_stats_table(html, category):
+    ## parses the div_stats_<category> table of a page (see stats_table_html) into a data frame following the
+    ## category's schema (see SCHEMAS), indexed by the player key (Player, Squad). Column names are '<group>: <name>'
+    ## (or just '<name>' for ungrouped columns).
+    import numpy as np
+    import pandas as pd
+    schema = SCHEMAS[category]
+    names, rows = read_table(stats_table_html(html, category))
+    values = np.array(rows, dtype=object).reshape(len(rows), len(names))
+    values = values[values[:, names.index('Player')] != 'Player']
+    columns = {}
+    for name in schema['text']:
+        columns[name] = values[:, names.index(name)].astype(str)
+    for name in schema['numeric']:
+        columns[name] = to_numeric(values[:, names.index(name)])
+    for i in range(schema['stats'], len(names) - 1):
+        if names[i] not in columns:
+            columns[names[i]] = to_numeric(values[:, i])
+    return pd.DataFrame(columns).set_index(KEY)
+
+
+def league_url(league_name, category):
+    num, name = LEAGUES[league_name]
+    return 'https://fbref.com/en/comps/' + num + '/' + category + '/' + name + '-Stats'
+
+
+def _check_league_names(league_names):
+    import numpy as np
+    league_codes = list(LEAGUES)
+    league_names = list(league_names) if (type(league_names) is np.ndarray) or (
+            type(league_names) is tuple) else league_names
+    league_names = [league_names] if type(league_names) is str else league_names
+
+    try:
+        league_matches = np.isin(league_codes, league_names)
+    except:
+        raise ValueError(
+            "league_names should be a list of characters. Available options are 'epl', 'laliga', 'bundesliga',  "
+            "'ligue1', 'seriea'")
+
+    if np.sum(league_matches) == 0:
+        raise ValueError(
+            "league_names should be a list of characters. Available options are 'epl', 'laliga', 'bundesliga',  "
+            "'ligue1', 'seriea'")
+    elif np.sum(league_matches) != len(league_names):
+        raise ValueError(
+            "league_names contains strings that weren't matched. Available options are 'epl', 'laliga', 'bundesliga', "
+            " 'ligue1', 'seriea'")
+    return [code for code in league_codes if code in league_names]
+
+
+def scrape_top_five_leagues(path_to_chromedriver=None, league_names=['epl', 'laliga', 'bundesliga', 'ligue1', 'seriea'],
+                            fetcher=None, cache_dir=None, max_age=6 * 60 * 60, max_workers=4):
+    ## scrapes fbref's player tables for the given leagues into a single data frame
+    ##      path_to_chromedriver, (optional) fetch with headless Chrome via selenium (as before)
+    ##      fetcher, (optional) any fetcher (see above). If neither this nor path_to_chromedriver is given, pages are
+    ##               fetched over plain HTTP
+    ##      cache_dir, (optional) directory for a PageCache, so that repeated scrapes only download changed pages
+    ##      max_age, how long (in seconds) cached pages are used without checking for changes
+    ##      max_workers, the maximum number of pages fetched at once
+    import pandas as pd
+    league_names = _check_league_names(league_names)
+    if fetcher is None:
+        fetcher = HTTPFetcher() if path_to_chromedriver is None else SeleniumFetcher(path_to_chromedriver)
+    cache = PageCache(cache_dir, max_age) if cache_dir is not None else None
+    urls = [league_url(league, category) for league in league_names for category in CATEGORIES]
+    try:
+        pages = fetch_pages(urls, fetcher, cache, max_workers)
+    finally:
+        fetcher.close()
+
+    ## each league's tables are joined once, on the player key, and then the leagues are stacked once
+    league_dfs = []
+    for league in league_names:
+        tables = [parse_stats_table(pages[league_url(league, category)], category) for category in CATEGORIES]
+        tables = [table[~table.index.duplicated()] for table in tables]
+        league_df = pd.concat(tables, axis=1, sort=False).reset_index()
+        league_df.insert(0, 'League', LEAGUES[league][1])
+        league_dfs.append(league_df)
+    all_players_df = pd.concat(league_dfs, ignore_index=True)
+    ## stats that appear in more than one category's table are kept once
+    all_players_df = all_players_df.loc[:, ~all_players_df.columns.duplicated()]
+    first = ['League', 'Player', 'Pos', 'Squad']
+    all_players_df = all_players_df[first + [c for c in all_players_df.columns if c not in first]]
+    all_players_df.index = all_players_df['Player']
+    return all_players_df
@@ -0,0 +1,270 @@
+## a small local HTTP service for radar plots and posterior summaries of a saved bosko object (see bosko.save)
+## usage: python -m balaban.serve --store path/to/bosko [--host 127.0.0.1] [--port 8000] [--workers 1] [--cache-size 1024]
+## the bosko object is loaded (memory-mapped) once, and every model's player_quantile_table is computed up front, so
+## requests only look things up. Endpoints (players are identified by their row in the data frame, as returned by search):
+##      GET /models, the model names
+##      GET /players?q=<text>&limit=<n>, players whose name contains text (ignoring case & accents), most minutes first
+##      GET /players/<id>, a player's credible intervals & percentile histograms on each model, as JSON
+##      GET /players/<id>/radar.png (or .svg), a player's radar plot
+## /players/<id> & the radar plots take an optional models=<name>,<name>,... to pick the models (by default, all of them),
+## and the radar plots an optional subtitle=<text>. Responses are kept in an LRU cache, and radar plots are rendered in a
+## pool of worker processes so that a slow render doesn't hold up other requests.
+
+
+class LRUCache:
+    ## dictionary-like cache keeping the max_items most recently used entries
+    def __init__(self, max_items=1024):
+        from collections import OrderedDict
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key not in self.items:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_items:
+            self.items.popitem(last=False)
+
+
+def _normalise(text):
+    ## lower case, without accents, for search
+    import unicodedata
+    return ''.join(c for c in unicodedata.normalize('NFKD', str(text)) if not unicodedata.combining(c)).lower()
+
+
+class RadarService:
+    ## the request handlers, for a bosko object bos
+    ##      cache_size, the number of responses to keep in the LRU cache
+    ##      workers, the number of render worker processes
+    ##      use_pretty_font & dpi, as for bosko.make_plot
+    def __init__(self, bos, cache_size=1024, workers=1, use_pretty_font=True, dpi=125):
+        import numpy as np
+        from balaban.utils import player_quantile_table
+        self.bos = bos
+        self.cache = LRUCache(cache_size)
+        self.workers = workers
+        self.use_pretty_font = use_pretty_font
+        self.dpi = dpi
+        self.pool = None
+        self.rendering = {}
+        for model in bos.models:
+            player_quantile_table(model)
+        self.names = [_normalise(player) for player in bos.df['Player']]
+        self.minutes = np.asarray(bos.df['Minutes'], dtype=float)
+
+    def start(self):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        from balaban.balaban import _init_render_worker
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_init_render_worker)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    def _player(self, player_id):
+        try:
+            pl = int(player_id)
+        except ValueError:
+            raise KeyError('Unknown player ' + player_id)
+        if (pl < 0) or (pl >= self.bos.df.shape[0]):
+            raise KeyError('Unknown player ' + player_id)
+        return pl
+
+    def _models(self, query):
+        if 'models' not in query:
+            return tuple(self.bos.labels)
+        names = tuple(name for name in query['models'].split(',') if name)
+        missing = [name for name in names if name not in self.bos.labels]
+        if (len(names) == 0) or (len(missing) > 0):
+            raise KeyError('Unknown model(s) ' + ', '.join(missing))
+        return names
+
+    def _info(self, pl):
+        df = self.bos.df
+        return {'id': int(pl), 'player': str(df['Player'].iloc[pl]), 'squad': str(df['Squad'].iloc[pl]),
+                'pos': str(df['Pos'].iloc[pl]), 'minutes': float(self.minutes[pl])}
+
+    def search(self, query):
+        import json
+        import numpy as np
+        text = _normalise(query.get('q', ''))
+        limit = int(query.get('limit', 20))
+        matches = np.array([i for i, name in enumerate(self.names) if text in name], dtype=np.int64)
+        matches = matches[np.argsort(-self.minutes[matches], kind='stable')][:limit]
+        return json.dumps([self._info(pl) for pl in matches]).encode()
+
+    def summary(self, pl, names):
+        import json
+        import numpy as np
+        key = ('summary', pl, names)
+        body = self.cache.get(key)
+        if body is None:
+            out = dict(self._info(pl), models={})
+            for name in names:
+                model = self.bos.get_model(name)
+                table = model.cache['quantile_table']
+                col = np.cumsum(model.mask)[pl] - 1
+                if not model.mask[pl]:
+                    out['models'][name] = None
+                    continue
+                out['models'][name] = {'lower': float(table['quantiles'][col, 0]),
+                                       'median': float(table['quantiles'][col, 1]),
+                                       'upper': float(table['quantiles'][col, 2]),
+                                       'percentile_median': float(table['percentile_median'][col]),
+                                       'hist_counts': table['hist_counts'][col].tolist(),
+                                       'hist_edges': table['hist_edges'][col].tolist()}
+            body = json.dumps(out).encode()
+            self.cache.put(key, body)
+        return body
+
+    async def radar(self, pl, names, fmt, subtitle):
+        ## renders in the worker pool. Concurrent requests for the same plot share one render.
+        import asyncio
+        from balaban.plotting import radar_data, render_bytes
+        key = ('radar', pl, names, fmt, subtitle)
+        body = self.cache.get(key)
+        if body is not None:
+            return body
+        if key not in self.rendering:
+            models = [self.bos.get_model(name) for name in names]
+            title, subtitle_text = self.bos._plot_titles(pl, subtitle)
+            self.rendering[key] = asyncio.get_running_loop().run_in_executor(
+                self.pool, render_bytes, list(names), title, subtitle_text, radar_data(models, pl), fmt,
+                self.use_pretty_font, self.dpi)
+        try:
+            body = await asyncio.shield(self.rendering[key])
+        finally:
+            self.rendering.pop(key, None)
+        self.cache.put(key, body)
+        return body
+
+    async def route(self, method, target):
+        ## returns (status, content type, body)
+        import json
+        from urllib.parse import urlsplit, parse_qsl, unquote
+        if method not in ('GET', 'HEAD'):
+            return 405, 'application/json', json.dumps({'error': 'Only GET is supported'}).encode()
+        url = urlsplit(target)
+        query = dict(parse_qsl(url.query))
+        parts = [unquote(part) for part in url.path.split('/') if part]
+        try:
+            if parts == ['models']:
+                return 200, 'application/json', json.dumps(self.bos.labels).encode()
+            if parts == ['players']:
+                return 200, 'application/json', self.search(query)
+            if (len(parts) == 2) and (parts[0] == 'players'):
+                return 200, 'application/json', self.summary(self._player(parts[1]), self._models(query))
+            if (len(parts) == 3) and (parts[0] == 'players') and (parts[2] in ('radar.png', 'radar.svg')):
+                fmt = parts[2].split('.')[1]
+                body = await self.radar(self._player(parts[1]), self._models(query), fmt, query.get('subtitle', ''))
+                return 200, 'image/png' if fmt == 'png' else 'image/svg+xml', body
+        except KeyError as e:
+            return 404, 'application/json', json.dumps({'error': e.args[0]}).encode()
+        except ValueError as e:
+            return 400, 'application/json', json.dumps({'error': str(e)}).encode()
+        return 404, 'application/json', json.dumps({'error': 'Not found'}).encode()
+
+    async def handle(self, reader, writer):
+        ## one (HTTP/1.1 keep-alive) connection
+        import asyncio
+        import json
+        reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                   500: 'Internal Server Error'}
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    method, target, version = line.decode('latin-1').split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                if int(headers.get('content-length', 0) or 0) > 0:
+                    await reader.readexactly(int(headers['content-length']))
+                connection = headers.get('connection', '').lower()
+                keep_alive = (connection == 'keep-alive') or ((version == 'HTTP/1.1') and (connection != 'close'))
+                try:
+                    status, content_type, body = await self.route(method, target)
+                except Exception as e:
+                    status, content_type, body = 500, 'application/json', json.dumps({'error': repr(e)}).encode()
+                head = ('HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n'
+                        % (status, reasons[status], content_type, len(body), 'keep-alive' if keep_alive else 'close'))
+                writer.write(head.encode('latin-1') + (body if method != 'HEAD' else b''))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8000, ready=None):
+        ## runs the server until cancelled. ready is an (optional) function called with the server's port once it's up
+        import asyncio
+        self.start()
+        try:
+            server = await asyncio.start_server(self.handle, host, port)
+            if ready is not None:
+                ready(server.sockets[0].getsockname()[1])
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.close()
+
+
+def main(argv=None):
+    import argparse
+    import asyncio
+    import signal
+    from balaban.balaban import bosko
+    parser = argparse.ArgumentParser(prog='python -m balaban.serve',
+                                     description='Serve radar plots & posterior summaries of a saved bosko object')
+    parser.add_argument('--store', required=True, help='directory written by bosko.save')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1, help='number of render worker processes')
+    parser.add_argument('--cache-size', type=int, default=1024, help='number of responses to cache')
+    parser.add_argument('--dpi', type=int, default=125)
+    parser.add_argument('--plain-font', action='store_true', help="use matplotlib's default font")
+    args = parser.parse_args(argv)
+
+    service = RadarService(bosko.load(args.store), cache_size=args.cache_size, workers=args.workers,
+                           use_pretty_font=not args.plain_font, dpi=args.dpi)
+
+    async def run():
+        ## SIGTERM stops the server the same way Ctrl+C does, so that serve shuts down the render pool on the way out
+        ## rather than leaving its workers behind
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except NotImplementedError:
+            pass
+        await service.serve(args.host, args.port,
+                            ready=lambda port: print('Serving on http://%s:%d' % (args.host, port), flush=True))
+
+    try:
+        asyncio.run(run())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+if __name__ == '__main__':
+    main()
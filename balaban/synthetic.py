@@ -0,0 +1,110 @@
+## synthetic leagues with known 'true' player rates, for benchmarking the fitters and checking their calibration
+## (see benchmarks/bench_models.py). Each player's true rates are drawn from the same population distributions the
+## models assume, and the season totals are then simulated from those rates, so the truth is known for every model type:
+##      'count', shots per 90 (Sh over Minutes)
+##      'success_rate', overall pass completion % (Cmp over Att)
+##      'xSpA', xG per shot (xG over Sh)
+##      'xSp90', xG per 90 (the xSpA model times the count model)
+##      'adj_pass', length-adjusted pass completion (['LongCmp', 'Cmp'] over ['LongAtt', 'Att'])
+
+## population distributions used by synthetic_league (any of these can be overridden via its population argument)
+##      minutes, the beta(a, b) distribution of the fraction of max_90s each player has played
+##      shots, the gamma (mean, shape) of true shots per 90
+##      passes, the gamma (mean, shape) of pass attempts per 90
+##      long_share, the beta(a, b) distribution of the fraction of each player's passes that are long
+##      short_cmp, the beta(a, b) distribution of the true short pass completion rate
+##      long_cmp, the beta(a, b) distribution of the true long pass completion rate, relative to the short one
+##      xg, the (mean, population sample size, per-shot sample size) of xG per shot, i.e. mu, v[0] & v[1] of the xSpA model
+POPULATION = dict(minutes=(0.8, 1.2),
+                  shots=(1.2, 1.5),
+                  passes=(40., 4.),
+                  long_share=(3., 17.),
+                  short_cmp=(20., 2.5),
+                  long_cmp=(6., 3.),
+                  xg=(0.1, 30., 10.))
+
+## add_model arguments (a, b) for each model type, given a synthetic league
+MODELS = {'count': ('Sh', 'Minutes'),
+          'success_rate': ('Cmp', 'Att'),
+          'xSpA': ('xG', 'Sh'),
+          'adj_pass': (['LongCmp', 'Cmp'], ['LongAtt', 'Att'])}
+
+
+def synthetic_league(n_players=1000, random_seed=None, n_squads=20, max_90s=38, population=None):
+    ## simulates a season's league table
+    ##      n_players, the number of players
+    ##      random_seed, seed for numpy's random generator
+    ##      n_squads, the number of squads players are spread across
+    ##      max_90s, the most 90s anyone can have played
+    ##      population, (optional) dictionary overriding any of the entries in POPULATION
+    ## returns:
+    ##      df, a data frame in the same format as the scraped league tables (Player, Squad, Pos, 90s, plus the columns in MODELS)
+    ##      truth, a data frame (with the same index) of each player's true rates: shots_per90, pass_pct, xg_per_shot,
+    ##             xg_per90, short_cmp, long_cmp & long_share
+    import numpy as np
+    import pandas as pd
+    pop = dict(POPULATION, **(population or {}))
+    rng = np.random.default_rng(random_seed)
+    n = n_players
+
+    nineties = np.round(max_90s * rng.beta(*pop['minutes'], size=n), 1)
+    shots_per90 = rng.gamma(pop['shots'][1], pop['shots'][0] / pop['shots'][1], size=n)
+    passes_per90 = rng.gamma(pop['passes'][1], pop['passes'][0] / pop['passes'][1], size=n)
+    long_share = rng.beta(*pop['long_share'], size=n)
+    short_cmp = rng.beta(*pop['short_cmp'], size=n)
+    long_cmp = rng.beta(*pop['long_cmp'], size=n)
+    mu, v0, v1 = pop['xg']
+    xg_per_shot = rng.beta(mu * v0, (1 - mu) * v0, size=n)
+
+    shots = rng.poisson(shots_per90 * nineties)
+    ## the average xG of a player's shots: each shot's xG has mean xg_per_shot & sample size v1, so their average is
+    ## (to the first two moments) beta with sample size shots * (v1 + 1) - 1, as in the xSpA model
+    k = np.maximum(shots * (v1 + 1) - 1, 1e-8)
+    xg = np.where(shots > 0, rng.beta(xg_per_shot * k, (1 - xg_per_shot) * k) * shots, 0.)
+    attempts = rng.poisson(passes_per90 * nineties)
+    long_attempts = rng.binomial(attempts, long_share)
+    long_completed = rng.binomial(long_attempts, short_cmp * long_cmp)
+    completed = rng.binomial(attempts - long_attempts, short_cmp) + long_completed
+
+    df = pd.DataFrame({'Player': np.array(['Player %d' % i for i in range(n)], dtype=object),
+                       'Squad': np.array(['Squad %d' % (i % n_squads) for i in range(n)], dtype=object),
+                       'Pos': rng.choice(np.array(['DF', 'MF', 'FW'], dtype=object), size=n),
+                       '90s': nineties,
+                       'Sh': shots,
+                       'xG': xg,
+                       'Cmp': completed,
+                       'Att': attempts,
+                       'LongCmp': long_completed,
+                       'LongAtt': long_attempts})
+    truth = pd.DataFrame({'shots_per90': shots_per90,
+                          'pass_pct': 100 * ((1 - long_share) * short_cmp + long_share * short_cmp * long_cmp),
+                          'xg_per_shot': xg_per_shot,
+                          'xg_per90': shots_per90 * xg_per_shot,
+                          'short_cmp': short_cmp,
+                          'long_cmp': long_cmp,
+                          'long_share': long_share}, index=df.index)
+    return df, truth
+
+
+def true_values(df, truth, model):
+    ## the true values of the quantity a fitted model estimates, for the players included in it (in the model's order)
+    ##      df & truth, as returned by synthetic_league
+    ##      model, a Posterior fitted on df (with the arguments in MODELS)
+    import numpy as np
+    mask = model.mask
+    if model.model_type == 'count':
+        return truth['shots_per90'].to_numpy()[mask]
+    elif model.model_type == 'success':
+        return truth['pass_pct'].to_numpy()[mask]
+    elif model.model_type == 'expected':
+        return truth['xg_per_shot'].to_numpy()[mask]
+    elif model.model_type == 'expected_per90':
+        return truth['xg_per90'].to_numpy()[mask]
+    elif model.model_type == 'adj_pass':
+        ## the model reports completion at the average long pass tendency of the players included in it
+        tendency = np.mean(df['LongAtt'].to_numpy()[mask] / df['Att'].to_numpy()[mask])
+        return (tendency * truth['long_cmp'].to_numpy()[mask]
+                + (1 - tendency) * truth['short_cmp'].to_numpy()[mask])
+    else:
+        raise ValueError(
+            "Invalid model type. Must be one of 'count', 'success', 'expected', 'expected_per90' or 'adj_pass'")
@@ -0,0 +1,288 @@
+## compiled PyMC3 model templates, shared by every fit of the same model type in a process
+## each template is built for a padded number of players, with the data held in pm.Data containers and the likelihood
+## masked so that padding players contribute nothing. Refitting on new data (another league, position or matchweek)
+## then only swaps the data in and resets the optimiser, rather than rebuilding and recompiling the graph.
+## padding players are given a fixed Gamma(1, 1) or Beta(1, 1) prior rather than the population distribution (see _pad),
+## so they're independent of the population-level parameters and the fit for the real players is unaffected.
+## the population-level parameters are indexed by a 'group' container (each player's group, from 0 to n_groups - 1), so
+## that several groups of players (e.g. league & position slices) can be fitted at once, each with its own population.
+## ungrouped fits use a single group.
+
+_TEMPLATES = {}
+
+
+def _pad(mask, value):
+    ## value for real players (mask 1) & 1 for padding players (mask 0), e.g. for the parameters of the player-level
+    ## priors, so that padding players don't depend on (or inform) the population-level parameters of any group
+    return mask * value + (1 - mask)
+
+
+def padded_size(n, min_size=64):
+    ## templates are built for sizes that are powers of two, so at most twice the work of an unpadded model
+    size = min_size
+    while size < n:
+        size *= 2
+    return size
+
+
+def _counts_template(size, n_groups=1):
+    import numpy as np
+    import pymc3 as pm
+    with pm.Model() as model:
+        counts = pm.Data('counts', np.zeros(size))
+        mins_played = pm.Data('mins_played', np.ones(size))
+        group = pm.Data('group', np.zeros(size, dtype='int32'))
+        mask = pm.Data('mask', np.zeros(size))
+        beta = pm.HalfNormal('beta', sigma=100, shape=n_groups)
+        mu = pm.HalfFlat('mu', shape=n_groups)
+        lambdas = pm.Gamma('lambdas', alpha=_pad(mask, mu[group] * beta[group]), beta=_pad(mask, beta[group]),
+                           shape=size)
+        lambda_tilde = lambdas * mins_played
+        pm.Potential('y', (mask * pm.Poisson.dist(lambda_tilde).logp(counts)).sum())
+    return model
+
+
+def _successes_template(size, n_groups=1):
+    import numpy as np
+    import pymc3 as pm
+    import theano.tensor as tt
+
+    def logp_ab(value):
+        ''' prior density'''
+        return tt.sum(tt.log(tt.pow(tt.sum(value, axis=1), -5 / 2)))
+
+    with pm.Model() as model:
+        successes = pm.Data('successes', np.zeros(size))
+        attempts = pm.Data('attempts', np.zeros(size))
+        group = pm.Data('group', np.zeros(size, dtype='int32'))
+        mask = pm.Data('mask', np.zeros(size))
+        # Uninformative prior for alpha and beta
+        ab = pm.HalfFlat('ab',
+                         shape=(n_groups, 2),
+                         testval=np.ones((n_groups, 2)))
+        pm.Potential('p(a, b)', logp_ab(ab))
+
+        lambdas = pm.Beta('lambdas', alpha=_pad(mask, ab[group, 0]), beta=_pad(mask, ab[group, 1]), shape=size)
+
+        pm.Potential('y', (mask * pm.Binomial.dist(p=lambdas, n=attempts).logp(successes)).sum())
+    return model
+
+
+def _expected_successes_per_action_template(size, n_groups=1):
+    import numpy as np
+    import pymc3 as pm
+    with pm.Model() as model:
+        sp = pm.Data('sp', np.full(size, 0.5))
+        attempts = pm.Data('attempts', np.ones(size))
+        group = pm.Data('group', np.zeros(size, dtype='int32'))
+        mask = pm.Data('mask', np.zeros(size))
+        v = pm.HalfNormal('v', shape=(n_groups, 2), sigma=100)
+        mu = pm.Uniform('mu', shape=n_groups)
+        lambdas = pm.Beta('lambdas', alpha=_pad(mask, mu[group] * v[group, 0]),
+                          beta=_pad(mask, (1 - mu[group]) * v[group, 0]), shape=size)
+        y = pm.Beta.dist(alpha=lambdas * (attempts * (v[group, 1] + 1) - 1),
+                         beta=(1 - lambdas) * (attempts * (v[group, 1] + 1) - 1))
+        pm.Potential('y', (mask * y.logp(sp)).sum())
+    return model
+
+
+def _adj_pass_template(size, n_groups=1):
+    import numpy as np
+    import pymc3 as pm
+    import theano.tensor as tt
+
+    def logp_ab(value):
+        ''' prior density'''
+        return tt.sum(tt.log(tt.pow(tt.sum(value, axis=1), -5 / 2)))
+
+    with pm.Model() as model:
+        ShCmp = pm.Data('ShCmp', np.zeros(size))
+        ShAtt = pm.Data('ShAtt', np.zeros(size))
+        LonCmp = pm.Data('LonCmp', np.zeros(size))
+        LonAtt = pm.Data('LonAtt', np.zeros(size))
+        group = pm.Data('group', np.zeros(size, dtype='int32'))
+        mask = pm.Data('mask', np.zeros(size))
+        # Uninformative prior for alpha and beta
+        ab_short = pm.HalfFlat('ab_short',
+                               shape=(n_groups, 2),
+                               testval=np.ones((n_groups, 2)))
+        ab_long = pm.HalfFlat('ab_long',
+                              shape=(n_groups, 2),
+                              testval=np.ones((n_groups, 2)))
+        pm.Potential('p(a_s, b_s)', logp_ab(ab_short))
+        pm.Potential('p(a_l, b_l)', logp_ab(ab_long))
+
+        lambda_short = pm.Beta('lambda_s', alpha=_pad(mask, ab_short[group, 0]), beta=_pad(mask, ab_short[group, 1]),
+                               shape=size)
+        lambda_long = pm.Beta('lambda_l', alpha=_pad(mask, ab_long[group, 0]), beta=_pad(mask, ab_long[group, 1]),
+                              shape=size)
+
+        y_short = pm.Binomial.dist(p=lambda_short, n=ShAtt).logp(ShCmp)
+        y_long = pm.Binomial.dist(p=lambda_short * lambda_long, n=LonAtt).logp(LonCmp)
+        pm.Potential('y', (mask * (y_short + y_long)).sum())
+    return model
+
+
+_BUILDERS = {'count': _counts_template,
+             'success': _successes_template,
+             'expected': _expected_successes_per_action_template,
+             'adj_pass': _adj_pass_template}
+
+
+class ModelTemplate:
+    ## a PyMC3 model plus its compiled ADVI step function
+    ##      model, the pm.Model (with pm.Data containers for its data and a 'mask' container)
+    ##      approx, the mean-field approximation that the step function updates
+    ##      step, compiled theano function performing one ADVI step and returning the loss (negative ELBO)
+    def __init__(self, model):
+        import pymc3 as pm
+        import theano
+        self.model = model
+        with model:
+            inference = pm.ADVI()
+        self.approx = inference.approx
+        updates = inference.objective.updates()
+        self.step = theano.function([], updates.loss, updates=updates)
+        ## the variational parameters and the optimiser's accumulators, and their starting values
+        self.initial_state = [(var, var.get_value(borrow=False)) for var in updates.keys()]
+        self.size = model['mask'].get_value().shape[0]
+
+    def reset(self):
+        for var, value in self.initial_state:
+            var.set_value(value)
+
+    def set_data(self, data):
+        ## data is a dictionary of numpy arrays (one value per player), each padded here to the template's size
+        ## players without a 'group' in data are put in the first group
+        import numpy as np
+        import pymc3 as pm
+        n = next(iter(data.values())).shape[0]
+        data = dict({'group': np.zeros(n)}, **data)
+        padded = {}
+        for name, value in data.items():
+            pad = self.model[name].get_value()
+            padded[name] = np.r_[np.asarray(value, dtype=pad.dtype), pad[n:]]
+        padded['mask'] = np.r_[np.ones(n), np.zeros(self.size - n)].astype(self.model['mask'].dtype)
+        pm.set_data(padded, model=self.model)
+
+    def _player_level(self, name):
+        return self.approx.groups[0].ordering.by_name[name].shp == (self.size,)
+
+    def get_state(self, n_players):
+        ## the current means & standard deviations of the (mean-field) approximation, in the unconstrained space, as a
+        ## Posterior state dictionary (per-player values are trimmed to the first n_players)
+        import numpy as np
+        group = self.approx.groups[0]
+        mu = group.params_dict['mu'].get_value()
+        std = np.log1p(np.exp(group.params_dict['rho'].get_value()))
+        state = {}
+        for name, varmap in group.ordering.by_name.items():
+            if self._player_level(name):
+                state['player:' + name + ':mu'] = mu[varmap.slc][:n_players]
+                state['player:' + name + ':std'] = std[varmap.slc][:n_players]
+            else:
+                state['hyper:' + name + ':mu'] = mu[varmap.slc]
+                state['hyper:' + name + ':std'] = std[varmap.slc]
+        return state
+
+    def set_state(self, state):
+        ## sets the approximation's means & standard deviations from a state dictionary (see get_state). Per-player
+        ## values may be shorter than the template, in which case the remaining (padding) players are left alone.
+        ## NaN values (e.g. for groups that weren't in the previous fit, see balaban.utils.remap_groups) are left alone
+        ## too, as are values beyond the end of a variable.
+        import numpy as np
+        group = self.approx.groups[0]
+        mu = group.params_dict['mu'].get_value()
+        rho = group.params_dict['rho'].get_value()
+        for name, varmap in group.ordering.by_name.items():
+            prefix = ('player:' if self._player_level(name) else 'hyper:') + name
+            if prefix + ':mu' not in state:
+                continue
+            value_mu = np.ravel(state[prefix + ':mu']).astype(float)
+            value_std = np.ravel(state[prefix + ':std']).astype(float)
+            idx = np.arange(varmap.slc.start, varmap.slc.stop)[:value_mu.shape[0]]
+            value_mu, value_std = value_mu[:idx.shape[0]], value_std[:idx.shape[0]]
+            keep = np.isfinite(value_mu) & np.isfinite(value_std)
+            mu[idx[keep]] = value_mu[keep]
+            rho[idx[keep]] = np.log(np.expm1(value_std[keep]))
+        group.params_dict['mu'].set_value(mu)
+        group.params_dict['rho'].set_value(rho)
+
+    def fit(self, data, n=30000, init=None, tol=None, param_tol=None, check_every=100):
+        ## fits the model to data
+        ##      n, the maximum number of iterations
+        ##      init, (optional) state dictionary to start from (see get_state), e.g. from a previous fit
+        ##      tol, (optional) relative tolerance on the loss (negative ELBO). Convergence requires the mean loss over
+        ##           the last check_every iterations to change by less than tol relative to the previous check_every
+        ##      param_tol, (optional) relative tolerance on the variational parameters. Convergence requires the means of
+        ##           the approximation to change by less than param_tol (relative, max over parameters) over check_every
+        ## if either tolerance is given, the fit stops as soon as all of the given criteria are met
+        ## returns:
+        ##      approx, the approximation
+        ##      info, a dictionary containing the number of iterations used, whether the fit converged & elbo_trace,
+        ##            the mean ELBO over each block of check_every iterations
+        import numpy as np
+        self.reset()
+        self.set_data(data)
+        if init is not None:
+            self.set_state(init)
+        mu = self.approx.groups[0].params_dict['mu']
+        losses = np.zeros(check_every)
+        elbo_trace = []
+        previous_params = mu.get_value()
+        converged = False
+        i = 0
+        for i in range(n):
+            losses[i % check_every] = self.step()
+            if (i + 1) % check_every == 0:
+                elbo_trace.append(-np.mean(losses))
+                if (tol is None) and (param_tol is None):
+                    continue
+                converged = len(elbo_trace) > 1
+                if converged and (tol is not None):
+                    converged = bool(np.abs(elbo_trace[-2] - elbo_trace[-1]) <= tol * np.abs(elbo_trace[-1]))
+                if converged and (param_tol is not None):
+                    params = mu.get_value()
+                    change = np.max(np.abs(params - previous_params) / (np.abs(previous_params) + 1e-8))
+                    converged = bool(change <= param_tol)
+                if param_tol is not None:
+                    previous_params = mu.get_value()
+                if converged:
+                    break
+        if (tol is None) and (param_tol is None):
+            converged = None
+        info = dict(iterations=i + 1, converged=converged, elbo_trace=elbo_trace)
+        return self.approx, info
+
+
+def get_template(model_type, n_players, n_groups=1):
+    ## returns the template for model_type that can hold n_players in n_groups groups, building and compiling it the
+    ## first time
+    ## (always bigger than n_groups, so that per-player & per-group variables can be told apart by their shapes)
+    key = (model_type, padded_size(max(n_players, n_groups + 1)), n_groups)
+    if key not in _TEMPLATES:
+        _TEMPLATES[key] = ModelTemplate(_BUILDERS[model_type](key[1], n_groups))
+    return _TEMPLATES[key]
+
+
+def fit_template(model_type, data, n=30000, init=None, tol=None, param_tol=None, n_groups=1):
+    ## fits a model of type model_type ('count', 'success', 'expected' or 'adj_pass') to data, a dictionary of numpy
+    ## arrays named as in the corresponding template (n, init, tol & param_tol are as in ModelTemplate.fit)
+    ## n_groups is the number of groups of players with their own population-level parameters, in which case data
+    ## should include 'group', each player's group (from 0 to n_groups - 1)
+    ## returns:
+    ##      approx, the approximation. The player-level variables in its samples have the template's padded size,
+    ##              so only the first N columns (N players in data) are meaningful.
+    ##      state, the fitted state dictionary (see ModelTemplate.get_state), for warm-starting later fits
+    ##      report, a fit report dictionary (see balaban.posterior.make_report) covering the compile & fit stages
+    import time
+    from balaban.posterior import make_report
+    n_players = next(iter(data.values())).shape[0]
+    t0 = time.perf_counter()
+    template = get_template(model_type, n_players, n_groups)
+    t1 = time.perf_counter()
+    approx, info = template.fit(data, n, init=init, tol=tol, param_tol=param_tol)
+    t2 = time.perf_counter()
+    report = make_report(info['iterations'], info['converged'], info['elbo_trace'], compile=t1 - t0, fit=t2 - t1)
+    return approx, template.get_state(n_players), report
+
@@ -1,130 +1,331 @@
-def fit_counts_model(counts, mins_played):
+def fit_counts_model(counts, mins_played, n_samples=6000, thin=1, dtype='float32', memmap_path=None,
+                     init=None, max_iter=30000, tol=None, param_tol=None, groups=None):
     ## estimates a hierarchical poisson model for count data
     ## takes as input:
     ##      counts, a numpy array of shape (num_players,) containing the total numbers of actions completed (across all games)
     ##      mins_played, a numpy array of shape (num_players,) containing the total number of minutes each player was observed for
-    ## returns:
-    ##      sl, a numpy array of shape (6000,N) containing 6000 posterior samples of actions per 90 (N is the number of players in the
+    ## returns a Posterior (see balaban/posterior.py) containing:
+    ##      sl, a numpy array of shape (n_samples,N) containing n_samples posterior samples of actions per 90 (N is the number of players in the
     ##      original data frame who have actually played minutes)
-    ##      sb, a numpy array of shape (6000,2) containing 6000 posterior samples of the population-level gamma shape parameter &
+    ##      sb, a numpy array of shape (n_samples,2) containing n_samples posterior samples of the population-level gamma shape parameter &
     ##                                          the population-level mean
     ##      kk, boolean indicating which players have actually played minutes
+    ## groups is an (optional) array of group labels, one per player, in which case each group gets its own
+    ## population-level parameters (see estimate_model) and sb has shape (n_samples,G,2)
+    ## the model itself is defined in balaban/templates.py (_counts_template)
+    import time
     import numpy as np
-    import pymc3 as pm
+    from balaban.posterior import Posterior
+    from balaban.templates import fit_template
     kk = (mins_played > 0) & np.isfinite(counts)
     mins_played = mins_played[kk]
     counts = counts[kk]
     N = counts.shape[0]
+    init = select_players(init, kk)
+    codes, labels = encode_groups(groups, kk)
+    init = remap_groups(init, labels)
 
-    with pm.Model() as model:
-        beta = pm.HalfNormal('beta', sigma=100)
-        mu = pm.HalfFlat('mu')
-        lambdas = pm.Gamma('lambdas', alpha=mu * beta, beta=beta, shape=N)
-        lambda_tilde = lambdas * mins_played
-        y = pm.Poisson('y', lambda_tilde, observed=counts)
-        approx = pm.fit(n=30000)
-    sl = approx.sample(6000)['lambdas'] * 90
-    sb = np.c_[approx.sample(6000)['beta'], approx.sample(6000)['mu']]
-    return [sl, sb, kk, 'count']
+    approx, state, report = fit_template('count', dict(counts=counts, mins_played=mins_played, group=codes), n=max_iter,
+                                         init=init, tol=tol, param_tol=param_tol, n_groups=len(labels))
+    t0 = time.perf_counter()
+    trace = approx.sample(n_samples)
+    sl = trace['lambdas'][:, :N] * 90
+    sb = np.stack([trace['beta'], trace['mu']], axis=-1)
+    sb = sb if groups is not None else sb[:, 0]
+    t1 = time.perf_counter()
+    out = Posterior(sl, sb, kk, 'count', dtype=dtype, thin=thin, memmap_path=memmap_path, state=state,
+                    report=report, **group_fields(groups, codes, labels))
+    out.report['timings'].update(sample=t1 - t0, postprocess=time.perf_counter() - t1)
+    return out
 
 
-def fit_successes_model(successes, attempts):
+def fit_successes_model(successes, attempts, n_samples=6000, thin=1, dtype='float32', memmap_path=None,
+                        init=None, max_iter=30000, tol=None, param_tol=None, groups=None):
     ## estimates a hierarchical binomial model for success rate data
     ## takes as input:
     ##      successes, a numpy array of shape (num_players,) containing the total numbers of successful actions (across all games)
     ##      attempts, a numpy array of shape (num_players,) containing the total numbers of attempted actions (across all games)
-    ## returns:
-    ##      sl, a numpy array of shape (6000,N) containing 6000 posterior samples of success probabilites (N is the number of players in the
+    ## returns a Posterior (see balaban/posterior.py) containing:
+    ##      sl, a numpy array of shape (n_samples,N) containing n_samples posterior samples of success probabilites (N is the number of players in the
     ##      original data frame who have actually attempted a pass)
-    ##      sb, a numpy array of shape (6000,2) containing 6000 posterior samples of the population-level beta parameters
+    ##      sb, a numpy array of shape (n_samples,2) containing n_samples posterior samples of the population-level beta parameters
     ##      kk, boolean indicating which players have actually attempted a pass
+    ## groups is as in fit_counts_model (sb then has shape (n_samples,G,2))
+    ## the model itself is defined in balaban/templates.py (_successes_template)
+    import time
     import numpy as np
-    import pymc3 as pm
-    import pymc3.distributions.transforms as tr
-    import theano.tensor as tt
+    from balaban.posterior import Posterior
+    from balaban.templates import fit_template
     kk = (attempts > 0) & np.isfinite(successes)
     attempts = attempts[kk]
     successes = successes[kk]
     N = attempts.shape[0]
+    init = select_players(init, kk)
+    codes, labels = encode_groups(groups, kk)
+    init = remap_groups(init, labels)
+
+    approx, state, report = fit_template('success', dict(successes=successes, attempts=attempts, group=codes), n=max_iter,
+                                         init=init, tol=tol, param_tol=param_tol, n_groups=len(labels))
+    t0 = time.perf_counter()
+    trace = approx.sample(n_samples)
+    sl = trace['lambdas'][:, :N] * 100
+    sb = trace['ab'] if groups is not None else trace['ab'][:, 0]
+    t1 = time.perf_counter()
+    out = Posterior(sl, sb, kk, 'success', dtype=dtype, thin=thin, memmap_path=memmap_path, state=state,
+                    report=report, **group_fields(groups, codes, labels))
+    out.report['timings'].update(sample=t1 - t0, postprocess=time.perf_counter() - t1)
+    return out
+
+
+def _laplace_draws(neg_log_post, theta_hat, n_samples, rng, eps=1e-4):
+    ## draws from a normal approximation to a (low-dimensional) posterior, centred at its mode theta_hat
+    ## with covariance given by the inverse of a central-difference estimate of the Hessian of neg_log_post
+    import numpy as np
+    d = theta_hat.shape[0]
+    hess = np.zeros((d, d))
+    for i in range(d):
+        for j in range(d):
+            e_i = np.eye(d)[i] * eps
+            e_j = np.eye(d)[j] * eps
+            hess[i, j] = (neg_log_post(theta_hat + e_i + e_j) - neg_log_post(theta_hat + e_i - e_j)
+                          - neg_log_post(theta_hat - e_i + e_j) + neg_log_post(theta_hat - e_i - e_j)) / (4 * eps ** 2)
+    try:
+        cov = np.linalg.inv(hess)
+        np.linalg.cholesky(cov)
+    except np.linalg.LinAlgError:
+        ## flat or badly conditioned marginal likelihood -- fall back to the point estimate
+        cov = np.eye(d) * 1e-8
+    return rng.multivariate_normal(theta_hat, cov, size=n_samples)
 
-    def logp_ab(value):
-        ''' prior density'''
-        return tt.log(tt.pow(tt.sum(value), -5 / 2))
 
-    with pm.Model() as model:
-        # Uninformative prior for alpha and beta
-        ab = pm.HalfFlat('ab',
-                         shape=2,
-                         testval=np.asarray([1., 1.]))
-        pm.Potential('p(a, b)', logp_ab(ab))
+def fit_counts_model_conjugate(counts, mins_played, random_seed=None, n_samples=6000, thin=1, dtype='float32', memmap_path=None,
+                               init=None, groups=None):
+    ## empirical Bayes version of fit_counts_model. No PyMC3/Theano involved.
+    ## the population-level parameters (beta, mu) are estimated by maximising the negative binomial marginal likelihood
+    ## (with the same priors as fit_counts_model), and their uncertainty is approximated by a Laplace approximation
+    ## on the log scale. Player-level rates are then drawn directly from their conjugate gamma posteriors:
+    ##      lambda_i | y_i, beta, mu ~ Gamma(mu * beta + y_i, beta + mins_i)
+    ## with groups, each group's (beta, mu) are estimated from its own players, and then every player is drawn at once
+    ## takes and returns the same things as fit_counts_model
+    import time
+    import numpy as np
+    from scipy.optimize import minimize
+    from balaban.posterior import Posterior, make_report
+    from scipy.special import gammaln
+    rng = np.random.default_rng(random_seed)
+    kk = (mins_played > 0) & np.isfinite(counts)
+    mins_played = mins_played[kk]
+    counts = counts[kk]
+    codes, labels = encode_groups(groups, kk)
+    init = remap_groups(init, labels)
 
-        lambdas = pm.Beta('lambdas', alpha=ab[0], beta=ab[1], shape=N)
+    def neg_log_post(theta, counts, mins_played):
+        ## theta = (log mu, log beta)
+        mu, beta = np.exp(theta)
+        shape = mu * beta
+        log_lik = np.sum(gammaln(counts + shape) - gammaln(shape)
+                         - shape * np.log1p(mins_played / beta)
+                         + counts * (np.log(mins_played) - np.log(beta + mins_played)))
+        log_prior = -beta ** 2 / (2 * 100 ** 2)
+        return -(log_lik + log_prior + np.sum(theta))
 
-        p = pm.Binomial('y', p=lambdas, observed=successes, n=attempts)
-        approx = pm.fit(n=30000)
-    sl = approx.sample(6000)['lambdas'] * 100
-    sb = approx.sample(6000)['ab']
-    return [sl, sb, kk, 'success']
+    t0 = time.perf_counter()
+    theta_hat = np.zeros((len(labels), 2))
+    theta = np.zeros((n_samples, len(labels), 2))
+    iterations, converged = 0, True
+    for g in range(len(labels)):
+        sel = codes == g
+        group_init = group_hyper(init, 'hyper:theta:mu', len(labels), g, 2)
+        mu_init = max(np.sum(counts[sel]) / np.sum(mins_played[sel]), 1e-8)
+        theta_init = np.log([mu_init, 1 / mu_init]) if group_init is None else group_init
+        result = minimize(neg_log_post, theta_init, args=(counts[sel], mins_played[sel]), method='Nelder-Mead',
+                          options={'xatol': 1e-6, 'fatol': 1e-8, 'maxiter': 5000})
+        theta_hat[g] = result.x
+        theta[:, g] = _laplace_draws(lambda x: neg_log_post(x, counts[sel], mins_played[sel]), result.x, n_samples, rng)
+        iterations, converged = iterations + result.nit, converged and bool(result.success)
+    report = make_report(iterations, converged, [], fit=time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    mu, beta = np.exp(theta[..., 0]), np.exp(theta[..., 1])
+    sl = rng.gamma(shape=(mu * beta)[:, codes] + counts, scale=1 / (beta[:, codes] + mins_played)) * 90
+    sb = np.stack([beta, mu], axis=-1)
+    sb = sb if groups is not None else sb[:, 0]
+    state = {'hyper:theta:mu': theta_hat.ravel()}
+    t1 = time.perf_counter()
+    out = Posterior(sl, sb, kk, 'count', dtype=dtype, thin=thin, memmap_path=memmap_path, state=state,
+                    report=report, **group_fields(groups, codes, labels))
+    out.report['timings'].update(sample=t1 - t0, postprocess=time.perf_counter() - t1)
+    return out
 
 
-def fit_expected_successes_per_action_model(xS, attempts):
+def fit_successes_model_conjugate(successes, attempts, random_seed=None, n_samples=6000, thin=1, dtype='float32', memmap_path=None,
+                                  init=None, groups=None):
+    ## empirical Bayes version of fit_successes_model. No PyMC3/Theano involved.
+    ## the population-level beta parameters (a, b) are estimated by maximising the beta-binomial marginal likelihood
+    ## (with the same (a + b)^(-5/2) prior as fit_successes_model), and their uncertainty is approximated by a
+    ## Laplace approximation on the log scale. Player-level success probabilities are then drawn directly from their
+    ## conjugate beta posteriors:
+    ##      lambda_i | y_i, a, b ~ Beta(a + y_i, b + n_i - y_i)
+    ## with groups, each group's (a, b) are estimated from its own players, and then every player is drawn at once
+    ## takes and returns the same things as fit_successes_model
+    import time
+    import numpy as np
+    from scipy.optimize import minimize
+    from balaban.posterior import Posterior, make_report
+    from scipy.special import betaln
+    rng = np.random.default_rng(random_seed)
+    kk = (attempts > 0) & np.isfinite(successes)
+    attempts = attempts[kk]
+    successes = successes[kk]
+    failures = np.clip(attempts - successes, 0, None)
+    codes, labels = encode_groups(groups, kk)
+    init = remap_groups(init, labels)
+
+    def neg_log_post(theta, successes, failures):
+        ## theta = (log a, log b)
+        a, b = np.exp(theta)
+        log_lik = np.sum(betaln(successes + a, failures + b) - betaln(a, b))
+        log_prior = -5 / 2 * np.log(a + b)
+        return -(log_lik + log_prior + np.sum(theta))
+
+    t0 = time.perf_counter()
+    theta_hat = np.zeros((len(labels), 2))
+    theta = np.zeros((n_samples, len(labels), 2))
+    iterations, converged = 0, True
+    for g in range(len(labels)):
+        sel = codes == g
+        group_init = group_hyper(init, 'hyper:theta:mu', len(labels), g, 2)
+        p_init = np.clip(np.sum(successes[sel]) / np.sum(attempts[sel]), 0.01, 0.99)
+        theta_init = np.log([10 * p_init, 10 * (1 - p_init)]) if group_init is None else group_init
+        result = minimize(neg_log_post, theta_init, args=(successes[sel], failures[sel]), method='Nelder-Mead',
+                          options={'xatol': 1e-6, 'fatol': 1e-8, 'maxiter': 5000})
+        theta_hat[g] = result.x
+        theta[:, g] = _laplace_draws(lambda x: neg_log_post(x, successes[sel], failures[sel]), result.x, n_samples,
+                                     rng)
+        iterations, converged = iterations + result.nit, converged and bool(result.success)
+    report = make_report(iterations, converged, [], fit=time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    ab = np.exp(theta)
+    sl = rng.beta(ab[:, codes, 0] + successes, ab[:, codes, 1] + failures) * 100
+    sb = ab if groups is not None else ab[:, 0]
+    state = {'hyper:theta:mu': theta_hat.ravel()}
+    t1 = time.perf_counter()
+    out = Posterior(sl, sb, kk, 'success', dtype=dtype, thin=thin, memmap_path=memmap_path, state=state,
+                    report=report, **group_fields(groups, codes, labels))
+    out.report['timings'].update(sample=t1 - t0, postprocess=time.perf_counter() - t1)
+    return out
+
+
+def fit_expected_successes_per_action_model(xS, attempts, n_samples=6000, thin=1, dtype='float32', memmap_path=None,
+                                            init=None, max_iter=30000, tol=None, param_tol=None, groups=None):
     ## estimates a hierarchical binomial model for success rate data
     ## takes as input:
     ##      sp, a numpy array of shape (num_players,) containing the expected successes per action for each player (e.g. xG per shot, xA per KP)
     ##      attempts, a numpy array of shape (num_players,) containing the total numbers of attempted actions for each player (e.g. shots, key passes)
-    ## returns:
-    ##      sl, a numpy array of shape (6000,N) containing 6000 posterior samples of success probabilites (N is the number of players in the
+    ## returns a Posterior (see balaban/posterior.py) containing:
+    ##      sl, a numpy array of shape (n_samples,N) containing n_samples posterior samples of success probabilites (N is the number of players in the
     ##      original data frame who have registered non-zero expected succcesses)
-    ##      sb, a numpy array of shape (6000,3) containing 6000 posterior samples of: the population-level & observation-level beta 'sample size'
+    ##      sb, a numpy array of shape (n_samples,3) containing n_samples posterior samples of: the population-level & observation-level beta 'sample size'
     ##              parameters and the population-level mean
     ##      kk, boolean indicating which players have actually registered non-zero expected successes
+    ## groups is as in fit_counts_model (sb then has shape (n_samples,G,3))
+    ## the model itself is defined in balaban/templates.py (_expected_successes_per_action_template)
+    import time
     import numpy as np
-    import pymc3 as pm
+    from balaban.posterior import Posterior
+    from balaban.templates import fit_template
     kk = (attempts > 0) & (xS > 0)
     sp = xS[kk] / attempts[kk]
     attempts = attempts[kk]
     N = attempts.shape[0]
+    init = select_players(init, kk)
+    codes, labels = encode_groups(groups, kk)
+    init = remap_groups(init, labels)
 
-    with pm.Model() as model:
-        v = pm.HalfNormal('v', shape=2, sigma=100)
-        mu = pm.Uniform('mu')
-        lambdas = pm.Beta('lambdas', alpha=mu * v[0], beta=(1 - mu) * v[0], shape=N)
-        y = pm.Beta('y',
-                    alpha=lambdas * (attempts * (v[1] + 1) - 1),
-                    beta=(1 - lambdas) * (attempts * (v[1] + 1) - 1),
-                    observed=sp)
-        approx = pm.fit(n=30000)
-    sl = approx.sample(6000)['lambdas']
-    sb = np.c_[approx.sample(6000)['v'], approx.sample(6000)['mu']]
-    return [sl, sb, kk, 'expected']
-
-
-def fit_expected_successes_per90_model(xSuccess_model, attempts_model):
+    approx, state, report = fit_template('expected', dict(sp=sp, attempts=attempts, group=codes), n=max_iter, init=init,
+                                         tol=tol, param_tol=param_tol, n_groups=len(labels))
+    t0 = time.perf_counter()
+    trace = approx.sample(n_samples)
+    sl = trace['lambdas'][:, :N]
+    sb = np.concatenate([trace['v'], trace['mu'][..., None]], axis=-1)
+    sb = sb if groups is not None else sb[:, 0]
+    t1 = time.perf_counter()
+    out = Posterior(sl, sb, kk, 'expected', dtype=dtype, thin=thin, memmap_path=memmap_path, state=state,
+                    report=report, **group_fields(groups, codes, labels))
+    out.report['timings'].update(sample=t1 - t0, postprocess=time.perf_counter() - t1)
+    return out
+
+
+def fit_expected_successes_per_action_model_mcmc(xS, attempts, random_seed=None, n_samples=6000, thin=1, dtype='float32',
+                                                 memmap_path=None, init=None, n_chains=4, n_tune=1000, chain_jobs=1,
+                                                 groups=None):
+    ## MCMC version of fit_expected_successes_per_action_model. No PyMC3/Theano involved.
+    ## samples the same model with n_chains NumPy chains (see balaban/mcmc.py), each run for n_tune warm-up sweeps
+    ## before keeping its share of the n_samples draws. The chains' R-hat & effective sample sizes are in the report.
+    ## chain_jobs is the number of processes to run the chains in (see fit_mcmc's n_jobs)
+    ## takes and returns the same things as fit_expected_successes_per_action_model
+    import time
+    from balaban.posterior import Posterior
+    from balaban.mcmc import fit_mcmc
+    kk = (attempts > 0) & (xS > 0)
+    sp = xS[kk] / attempts[kk]
+    attempts = attempts[kk]
+    init = select_players(init, kk)
+    codes, labels = encode_groups(groups, kk)
+    init = remap_groups(init, labels)
+
+    sl, sb, state, report = fit_mcmc('expected', dict(sp=sp, attempts=attempts), n_samples=n_samples,
+                                     n_chains=n_chains, n_tune=n_tune, random_seed=random_seed, init=init,
+                                     n_jobs=chain_jobs, groups=None if groups is None else codes)
+    t1 = time.perf_counter()
+    out = Posterior(sl, sb, kk, 'expected', dtype=dtype, thin=thin, memmap_path=memmap_path, state=state,
+                    report=report, **group_fields(groups, codes, labels))
+    out.report['timings'].update(postprocess=time.perf_counter() - t1)
+    return out
+
+
+def fit_expected_successes_per90_model(xSuccess_model, attempts_model, dtype='float32', memmap_path=None, groups=None):
     ## the inputs are two models which should have been returned by:
     ##    fit_expected_successes_per_action_model (first argument)
     ##    fit_counts_model (second argument)
     ## the input models should estimate
     ##    the number of actions attempted per 90 (e.g. shots or key passes) -- fit on count data
     ##    the probability per action that they lead to the corresponding desired outcome (e.g. goal or assist) -- fit on xG/xA data
-    kk = (xSuccess_model[2] & attempts_model[2])
-    sl = (attempts_model[0][:, kk[attempts_model[2]]] * xSuccess_model[0][:, kk[xSuccess_model[2]]])
-    return [sl, [], kk, 'expected_per90']
+    ## groups is an (optional) array of group labels, one per player, used for the population distribution (see
+    ## population_sketch). By default the groups of whichever input model was fitted with groups are used.
+    import numpy as np
+    from balaban.posterior import Posterior
+    ## the two models are paired draw-by-draw, so only the first min(n_samples) draws of each are used
+    kk = (xSuccess_model.mask & attempts_model.mask)
+    n_samples = min(xSuccess_model.n_samples, attempts_model.n_samples)
+    sl = (attempts_model.samples[:n_samples, kk[attempts_model.mask]]
+          * xSuccess_model.samples[:n_samples, kk[xSuccess_model.mask]])
+    draws = xSuccess_model.report.get('draws', []) + attempts_model.report.get('draws', [])
+    for parent in (xSuccess_model, attempts_model):
+        if (groups is None) and (parent.groups is not None):
+            groups = np.full(kk.shape[0], None, dtype=object)
+            groups[parent.mask] = np.array(parent.group_labels, dtype=object)[parent.groups]
+    codes, labels = encode_groups(groups, kk)
+    return Posterior(sl, [], kk, 'expected_per90', dtype=dtype, memmap_path=memmap_path, report=dict(draws=draws),
+                     **group_fields(groups, codes, labels))
 
 
-def fit_adj_pass_model(successes, attempts):
+def fit_adj_pass_model(successes, attempts, n_samples=6000, thin=1, dtype='float32', memmap_path=None,
+                       init=None, max_iter=30000, tol=None, param_tol=None, groups=None):
     ## inputs are two lists in the form:
     ##       successes = [successful long passes, total successful passes]
     ##       attempts = [attempted long passes, total attempted passes]
-    ## returns:
-    ##      sl, a numpy array of shape (6000,N) containing 6000 posterior samples of success probabilites (N is the number of players in the
+    ## returns a Posterior (see balaban/posterior.py) containing:
+    ##      sl, a numpy array of shape (n_samples,N) containing n_samples posterior samples of success probabilites (N is the number of players in the
     ##      original data frame who have registered non-zero expected succcesses)
     ##      sb, an empty list
     ##      kk, boolean indicating which players have actually registered non-zero expected successes
     ##      'adj_pass', character string indicating the model type.
+    ## groups is as in fit_counts_model. Each group's average long pass tendency is then its own players' average.
+    ## the model itself is defined in balaban/templates.py (_adj_pass_template)
+    import time
     import numpy as np
-    import pymc3 as pm
-    import pymc3.distributions.transforms as tr
-    import theano.tensor as tt
+    from balaban.posterior import Posterior
+    from balaban.templates import fit_template
     LonCmp = successes[0]
     TotCmp = successes[1]
     LonAtt = attempts[0]
@@ -136,104 +337,568 @@ def fit_adj_pass_model(successes, attempts):
     TotAtt = TotAtt[kk]
     ShCmp = TotCmp - LonCmp
     ShAtt = TotAtt - LonAtt
-    average_long_tendency = np.mean(LonAtt / TotAtt)
     N = np.sum(kk)
+    init = select_players(init, kk)
+    codes, labels = encode_groups(groups, kk)
+    init = remap_groups(init, labels)
+    average_long_tendency = group_means(LonAtt / TotAtt, codes, len(labels))[codes]
 
-    def logp_ab(value):
-        ''' prior density'''
-        return tt.log(tt.pow(tt.sum(value), -5 / 2))
-
-    with pm.Model() as model:
-        # Uninformative prior for alpha and beta
-        ab_short = pm.HalfFlat('ab_short',
-                               shape=2,
-                               testval=np.asarray([1., 1.]))
-        ab_long = pm.HalfFlat('ab_long',
-                              shape=2,
-                              testval=np.asarray([1., 1.]))
-        pm.Potential('p(a_s, b_s)', logp_ab(ab_short))
-        pm.Potential('p(a_l, b_l)', logp_ab(ab_long))
-
-        lambda_short = pm.Beta('lambda_s', alpha=ab_short[0], beta=ab_short[1], shape=N)
-        lambda_long = pm.Beta('lambda_l', alpha=ab_long[0], beta=ab_long[1], shape=N)
-
-        y_short = pm.Binomial('y_s', p=lambda_short, observed=ShCmp, n=ShAtt)
-        y_long = pm.Binomial('y_l', p=lambda_short * lambda_long, observed=LonCmp, n=LonAtt)
-        approx = pm.fit(n=30000)
-    s_sh = approx.sample(6000)['lambda_s']
-    s_lo = approx.sample(6000)['lambda_l']
+    approx, state, report = fit_template('adj_pass', dict(ShCmp=ShCmp, ShAtt=ShAtt, LonCmp=LonCmp, LonAtt=LonAtt,
+                                                          group=codes),
+                                         n=max_iter, init=init, tol=tol, param_tol=param_tol, n_groups=len(labels))
+    t0 = time.perf_counter()
+    trace = approx.sample(n_samples)
+    s_sh = trace['lambda_s'][:, :N]
+    s_lo = trace['lambda_l'][:, :N]
     sl = average_long_tendency * s_lo + (1 - average_long_tendency) * s_sh
-    return [sl, [], kk, 'adj_pass']
+    t1 = time.perf_counter()
+    out = Posterior(sl, [], kk, 'adj_pass', dtype=dtype, thin=thin, memmap_path=memmap_path, state=state,
+                    report=report, **group_fields(groups, codes, labels))
+    out.report['timings'].update(sample=t1 - t0, postprocess=time.perf_counter() - t1)
+    return out
+
+
+def fit_adj_pass_model_mcmc(successes, attempts, random_seed=None, n_samples=6000, thin=1, dtype='float32',
+                            memmap_path=None, init=None, n_chains=4, n_tune=1000, chain_jobs=1, groups=None):
+    ## MCMC version of fit_adj_pass_model. No PyMC3/Theano involved.
+    ## samples the same model with n_chains NumPy chains (see balaban/mcmc.py), each run for n_tune warm-up sweeps
+    ## before keeping its share of the n_samples draws. The chains' R-hat & effective sample sizes are in the report.
+    ## chain_jobs is the number of processes to run the chains in (see fit_mcmc's n_jobs)
+    ## takes and returns the same things as fit_adj_pass_model
+    import time
+    import numpy as np
+    from balaban.posterior import Posterior
+    from balaban.mcmc import fit_mcmc
+    LonCmp = successes[0]
+    TotCmp = successes[1]
+    LonAtt = attempts[0]
+    TotAtt = attempts[1]
+    kk = (LonCmp > 0) & np.isfinite(LonAtt)
+    LonCmp = LonCmp[kk]
+    LonAtt = LonAtt[kk]
+    TotCmp = TotCmp[kk]
+    TotAtt = TotAtt[kk]
+    ShCmp = TotCmp - LonCmp
+    ShAtt = TotAtt - LonAtt
+    init = select_players(init, kk)
+    codes, labels = encode_groups(groups, kk)
+    init = remap_groups(init, labels)
+    average_long_tendency = group_means(LonAtt / TotAtt, codes, len(labels))
+    average_long_tendency = average_long_tendency[0] if groups is None else average_long_tendency[codes]
+
+    data = dict(ShCmp=ShCmp, ShAtt=ShAtt, LonCmp=LonCmp, LonAtt=LonAtt, long_tendency=average_long_tendency)
+    sl, _, state, report = fit_mcmc('adj_pass', data, n_samples=n_samples, n_chains=n_chains, n_tune=n_tune,
+                                    random_seed=random_seed, init=init, n_jobs=chain_jobs,
+                                    groups=None if groups is None else codes)
+    t1 = time.perf_counter()
+    out = Posterior(sl, [], kk, 'adj_pass', dtype=dtype, thin=thin, memmap_path=memmap_path, state=state,
+                    report=report, **group_fields(groups, codes, labels))
+    out.report['timings'].update(postprocess=time.perf_counter() - t1)
+    return out
 
 
-def estimate_model(a, b, model_type):
+def estimate_model(a, b, model_type, engine='advi', n_samples=6000, thin=1, dtype='float32', memmap_path=None,
+                   init=None, max_iter=30000, tol=None, param_tol=None, n_chains=4, n_tune=1000, chain_jobs=1,
+                   groups=None):
+    ## engine selects the inference method:
+    ##      'advi' fits the full hierarchical model with PyMC3's ADVI (all model types)
+    ##      'conjugate' uses the closed-form empirical Bayes fitters ('count' and 'success_rate' only)
+    ##      'mcmc' samples the full hierarchical model with NumPy MCMC ('xSpA' and 'adj_pass' only), running n_chains
+    ##             chains with n_tune warm-up sweeps each, one after another unless chain_jobs > 1 (see fit_mcmc)
+    ## n_samples, thin, dtype & memmap_path control how the posterior samples are drawn and stored (see Posterior)
+    ## init is an (optional) Posterior state to start from (see warm_start_state), e.g. from a fit on last week's data,
+    ## with per-player values for every player in a & b
+    ## max_iter, tol & param_tol control when ADVI stops: after max_iter iterations, or as soon as the ELBO (tol) and/or
+    ## the variational parameters (param_tol) have converged to the given relative tolerances
+    ## the time spent in each stage, along with the convergence details, is recorded in the Posterior's report, along with
+    ## an identifier for its draws (report['draws']). 'xSp90' models list their parents' identifiers, since their samples
+    ## are computed draw-by-draw from those (see shared_draws)
+    ## groups is an (optional) array of group labels, one per player in a & b (e.g. league & position), to fit every group
+    ## at once with its own population-level parameters. Each player's percentile ranks are then relative to their own
+    ## group's population (see population_percentiles). 'xSp90' models use their parents' groups unless groups is given.
+    if engine not in ('advi', 'conjugate', 'mcmc'):
+        raise ValueError("Invalid engine. engine should be one of 'advi', 'conjugate' or 'mcmc'")
+    if (engine == 'conjugate') and (model_type not in ('count', 'success_rate', 'xSp90')):
+        raise ValueError("engine='conjugate' is only available for 'count' and 'success_rate' models")
+    if (engine == 'mcmc') and (model_type not in ('xSpA', 'adj_pass', 'xSp90')):
+        raise ValueError("engine='mcmc' is only available for 'xSpA' and 'adj_pass' models")
+    import time
+    import uuid
+    import numpy as np
+    t0 = time.perf_counter()
+    sampling = dict(n_samples=n_samples, thin=thin, dtype=dtype, memmap_path=memmap_path, init=init, groups=groups)
+    advi = dict(sampling, max_iter=max_iter, tol=tol, param_tol=param_tol)
+    mcmc = dict(sampling, n_chains=n_chains, n_tune=n_tune, chain_jobs=chain_jobs)
     if model_type == 'count':
-        out = fit_counts_model(a, b)
+        if engine == 'conjugate':
+            out = fit_counts_model_conjugate(a, b, **sampling)
+        else:
+            out = fit_counts_model(a, b, **advi)
     elif model_type == 'success_rate':
-        out = fit_successes_model(a, b)
+        if engine == 'conjugate':
+            out = fit_successes_model_conjugate(a, b, **sampling)
+        else:
+            out = fit_successes_model(a, b, **advi)
     elif model_type == 'xSpA':
-        out = fit_expected_successes_per_action_model(a, b)
+        if engine == 'mcmc':
+            out = fit_expected_successes_per_action_model_mcmc(a, b, **mcmc)
+        else:
+            out = fit_expected_successes_per_action_model(a, b, **advi)
     elif model_type == 'adj_pass':
         try:
-            out = fit_adj_pass_model(a, b)
+            if engine == 'mcmc':
+                out = fit_adj_pass_model_mcmc(a, b, **mcmc)
+            else:
+                out = fit_adj_pass_model(a, b, **advi)
         except ValueError:
             print(
                 "Check inputs. The inputs should be two lists of the form [successful long passes, total successful passes] & [attempted long passes, total attempted passes]")
     elif model_type == 'xSp90':
         try:
-            out = fit_expected_successes_per90_model(a, b)
+            out = fit_expected_successes_per90_model(a, b, dtype=dtype, memmap_path=memmap_path, groups=groups)
         except ValueError:
             print(
                 "Check inputs. The inputs should be two pre-estimated models. The first argument should be a list returned by a 'counts' model. The second argument should be a list returned by an 'xSpA' model.")
     else:
         raise ValueError("Invalid model_type. model_type should be one of 'count', 'success_rate', 'xSpA', or 'xSp90'")
+    out.report.setdefault('timings', {})['total'] = time.perf_counter() - t0
+    out.report.update(model_type=model_type, engine=engine if model_type != 'xSp90' else None)
+    if (out.group_labels is not None) and (len(out.state) > 0):
+        ## so that refits can match each group's population-level values up by label (see remap_groups)
+        out.state['group_labels'] = np.array(out.group_labels)
+    out.report.setdefault('draws', [uuid.uuid4().hex])
     return out
 
 
-def obtain_player_quantiles(model, player_index):
-    model_type = model[3]
+def select_players(state, kk):
+    ## subsets the per-player values of a state dictionary (see Posterior.state) to the players where kk is True
+    if state is None:
+        return None
+    return {name: (value[kk] if name.startswith('player:') else value) for name, value in state.items()}
+
+
+def encode_groups(groups, kk):
+    ## the groups of the players where kk is True, given groups, an array of group labels with one per player
+    ## returns:
+    ##      codes, a numpy array of shape (N,) containing each of those players' group (from 0 to G - 1)
+    ##      labels, the list of the G group labels (in sorted order). If groups is None, every player is in one group
     import numpy as np
-    
-    pind = np.arange(np.shape(model[2])[0])[model[2]]
-    pind = np.where(pind == player_index)[0]
-    if pind.shape[0] == 0: 
-        return (np.zeros(25), np.linspace(0,1,26)), np.zeros(3)
+    if groups is None:
+        return np.zeros(np.sum(kk), dtype=np.int64), [None]
+    labels, codes = np.unique(np.asarray(groups)[kk].astype(str), return_inverse=True)
+    return codes.astype(np.int64), labels.tolist()
+
+
+def group_fields(groups, codes, labels):
+    ## Posterior keyword arguments recording the groups (see encode_groups) of a model fitted with groups
+    if groups is None:
+        return {}
+    return dict(groups=codes, group_labels=labels)
+
 
+def group_means(x, codes, n_groups):
+    ## the mean of x over each group's players
+    import numpy as np
+    return np.bincount(codes, weights=x, minlength=n_groups) / np.bincount(codes, minlength=n_groups)
+
+
+def group_hyper(state, name, n_groups, g, k):
+    ## group g's value of the (flattened, group by group) population-level state entry name, which has k values per
+    ## group, or None if state doesn't have one for each of the n_groups groups (or has none for group g, see
+    ## remap_groups)
+    import numpy as np
+    if (state is None) or (name not in state):
+        return None
+    value = np.ravel(state[name])
+    if value.shape[0] != n_groups * k:
+        return None
+    value = value.reshape(n_groups, k)[g]
+    return value if np.all(np.isfinite(value)) else None
+
+
+def remap_groups(state, labels):
+    ## lines the population-level values of a state dictionary (see Posterior.state) up with a new fit's groups, given
+    ## labels, the new fit's group labels (see encode_groups). Grouped states record their groups' labels (under
+    ## 'group_labels'), and each group's values are moved to the position of the same label in labels. Groups that
+    ## weren't in the old fit get NaN values (& so start from scratch), and old groups that are gone are dropped.
+    ## population-level values are dropped altogether when going between grouped & ungrouped fits.
+    import numpy as np
+    if state is None:
+        return None
+    new = None if labels == [None] else [str(label) for label in labels]
+    old = state.get('group_labels')
+    old = None if old is None else [str(label) for label in np.ravel(old)]
+    out = {name: value for name, value in state.items() if name.startswith('player:')}
+    for name, value in state.items():
+        if not name.startswith('hyper:'):
+            continue
+        if (old is None) and (new is None):
+            out[name] = value
+        elif (old is not None) and (new is not None) and (np.size(value) % len(old) == 0):
+            value = np.asarray(value, dtype=float).reshape(len(old), -1)
+            remapped = np.full((len(new), value.shape[1]), np.nan)
+            for i, label in enumerate(new):
+                if label in old:
+                    remapped[i] = value[old.index(label)]
+            out[name] = remapped.ravel()
+    if new is not None:
+        out['group_labels'] = np.array(new)
+    return out
+
+
+def warm_start_state(state, old_keys, new_keys):
+    ## maps the state of a previous fit (see Posterior.state) onto a new set of players, for warm-starting a refit
+    ## takes as input:
+    ##      state, the Posterior.state dictionary of the previous fit
+    ##      old_keys, a list of player identifiers (e.g. (Player, Squad) tuples) for the players in the previous fit
+    ##      new_keys, a list of player identifiers for the players in the new fit
+    ## returns:
+    ##      a state dictionary for the new players. Players who weren't in the previous fit start from the population
+    ##      level: the mean of the previous players' means, with a standard deviation covering their spread.
+    import numpy as np
+    index = {key: i for i, key in enumerate(old_keys)}
+    pos = np.array([index.get(key, -1) for key in new_keys], dtype=np.int64)
+    found = pos >= 0
+    out = {}
+    for name, value in state.items():
+        if not name.startswith('player:'):
+            out[name] = value
+        elif name.endswith(':mu'):
+            out[name] = np.where(found, value[pos], np.mean(value))
+        else:
+            means = state[name[:-len(':std')] + ':mu']
+            out[name] = np.where(found, value[pos], np.sqrt(np.mean(value ** 2) + np.var(means)))
+    return out
+
+
+def population_parameters(model, columns=None):
+    ## the posterior means of a model's population-level parameters, as a numpy array of shape (k,) or, for models fitted
+    ## with groups, of shape (n_cols, k) containing those of each player's group
+    ##      columns, (optional) positions (among the players included in the model) of the players. Defaults to all.
+    import numpy as np
+    means = np.mean(model.hyper, axis=0)
+    if model.groups is None:
+        return means
+    return means[model.groups if columns is None else model.groups[columns]]
+
+
+def population_percentiles(model, samples, columns=None):
+    ## pushes player-level samples through the population-level cdf to get percentile ranks
+    ## takes as input:
+    ##      model, a Posterior
+    ##      samples, a numpy array of shape (n_samples, n_cols) of player-level samples from model
+    ##      columns, (optional) positions (among the players included in the model) of the players in samples' columns.
+    ##               Defaults to all of them, in order. Models fitted with groups use each player's group's population.
+    ## returns:
+    ##      a numpy array of the same shape containing the corresponding percentile ranks (between 0 and 1)
+    import numpy as np
+    model_type = model.model_type
+    ## (the regularised incomplete gamma/beta functions are the gamma/beta cdfs, minus the overhead of scipy.stats)
+    if model_type == 'count':
+        from scipy.special import gammainc
+        hyper = population_parameters(model, columns)
+        return gammainc(hyper[..., 1] * hyper[..., 0], samples * hyper[..., 0] / 90)
+    elif model_type == 'success':
+        from scipy.special import betainc
+        hyper = population_parameters(model, columns)
+        return betainc(hyper[..., 0], hyper[..., 1], np.clip(samples / 100, 0, 1))
+    elif model_type == 'expected':
+        from scipy.special import betainc
+        hyper = population_parameters(model, columns)
+        return betainc(hyper[..., 2] * hyper[..., 0], (1 - hyper[..., 2]) * hyper[..., 0], np.clip(samples, 0, 1))
+    elif (model_type == 'expected_per90') | (model_type == 'adj_pass'):
+        ## no parametric population distribution, so use the pooled samples of all players via a cached quantile sketch
+        if model.groups is None:
+            sketch, levels = population_sketch(model)
+            return np.interp(samples, sketch, levels)
+        groups = model.groups if columns is None else model.groups[columns]
+        out = np.empty(np.shape(samples))
+        for g in np.unique(groups):
+            sketch, levels = population_sketch(model, g)
+            out[:, groups == g] = np.interp(samples[:, groups == g], sketch, levels)
+        return out
+    else:
+        raise ValueError(
+            "Invalid model type. Must be one of 'count', 'success', 'expected', 'expected_per90' or 'adj_pass'")
+
+
+def population_quantile(model, level, columns=None):
+    ## the inverse of population_percentiles: the value of the metric at percentile rank level (between 0 and 1), so that
+    ## a sample's percentile rank is above level exactly when the sample is above this value
+    ## for models fitted with groups, this is a numpy array with the value for each player in columns (as in
+    ## population_percentiles)
+    import numpy as np
+    model_type = model.model_type
+    level = np.clip(level, 0, 1)
     if model_type == 'count':
-        from scipy.stats import gamma
-        percentile_hist = np.histogram(
-            gamma.cdf(model[0][:, pind],
-                      a=np.mean(model[1][:, 1]) * np.mean(model[1][:, 0]),
-                      scale=90 / np.mean(model[1][:, 0])),
-            bins=25)
-        per90_quantiles = np.quantile(model[0][:, pind], [0.125, 0.5, 0.875])
+        from scipy.special import gammaincinv
+        hyper = population_parameters(model, columns)
+        return gammaincinv(hyper[..., 1] * hyper[..., 0], level) * 90 / hyper[..., 0]
     elif model_type == 'success':
-        from scipy.stats import beta
-        percentile_hist = np.histogram(
-            beta.cdf(model[0][:, pind] / 100,
-                     a=np.mean(model[1][:, 0]),
-                     b=np.mean(model[1][:, 1])),
-            bins=25)
-        per90_quantiles = np.quantile(model[0][:, pind], [0.05, 0.5, 0.95])
+        from scipy.special import betaincinv
+        hyper = population_parameters(model, columns)
+        return betaincinv(hyper[..., 0], hyper[..., 1], level) * 100
     elif model_type == 'expected':
-        from scipy.stats import beta
-        percentile_hist = np.histogram(
-            beta.cdf(model[0][:, pind],
-                     a=np.mean(model[1][:, 2]) * np.mean(model[1][:, 0]),
-                     b=(1 - np.mean(model[1][:, 2])) * np.mean(model[1][:, 0])),
-            bins=25)
-        per90_quantiles = np.quantile(model[0][:, pind], [0.05, 0.5, 0.95])
+        from scipy.special import betaincinv
+        hyper = population_parameters(model, columns)
+        return betaincinv(hyper[..., 2] * hyper[..., 0], (1 - hyper[..., 2]) * hyper[..., 0], level)
     elif (model_type == 'expected_per90') | (model_type == 'adj_pass'):
-        samps_flat = np.random.choice(model[0].flatten(), size=5000)  ## downsample to make cdf quicker to compute
-        sorted_samps = np.sort(samps_flat)
-        ecdf = lambda x: np.sum(sorted_samps[:, None] < x, axis=0) / len(sorted_samps)
-        percentile_hist = np.histogram(
-            ecdf(model[0][:, pind].T),
-            bins=25)
-        per90_quantiles = np.quantile(model[0][:, pind], [0.05, 0.5, 0.95])
+        if model.groups is None:
+            sketch, levels = population_sketch(model)
+            return np.interp(level, levels, sketch)
+        groups = model.groups if columns is None else model.groups[columns]
+        out = np.empty(groups.shape[0])
+        for g in np.unique(groups):
+            sketch, levels = population_sketch(model, g)
+            out[groups == g] = np.interp(level, levels, sketch)
+        return out
     else:
-        print("Invalid model type. Must be one of 'count', 'success', 'expected', 'expected_per90' or 'adj_pass'")
-    return percentile_hist, per90_quantiles
+        raise ValueError(
+            "Invalid model type. Must be one of 'count', 'success', 'expected', 'expected_per90' or 'adj_pass'")
+
+
+def population_sketch(model, group=None, n_points=2001, chunk_size=256):
+    ## quantile sketch of the pooled samples of every player in a model (i.e. the empirical population distribution), or
+    ## of every player in group (for models fitted with groups)
+    ## each chunk of columns is summarised by n_points quantiles, and the chunk summaries are then merged into a single
+    ## set of n_points quantiles, so memory use doesn't grow with the number of samples/players
+    ## the result is cached on the model (model.cache['population_sketch'], or ('population_sketch', group))
+    ## returns:
+    ##      sketch, a numpy array of shape (n_points,) containing the pooled sample quantiles
+    ##      levels, a numpy array of shape (n_points,) containing the corresponding probabilities
+    import numpy as np
+    key = 'population_sketch' if group is None else ('population_sketch', int(group))
+    if key in model.cache:
+        return model.cache[key]
+    levels = np.linspace(0, 1, n_points)
+    columns = np.arange(model.samples.shape[1]) if group is None else np.where(model.groups == group)[0]
+    n = columns.shape[0]
+    values = []
+    weights = []
+    for start in range(0, n, chunk_size):
+        cols = columns[start:start + chunk_size]
+        chunk = np.sort(np.asarray(model.samples[:, cols]), axis=None)
+        values.append(np.interp(levels * (chunk.shape[0] - 1), np.arange(chunk.shape[0]), chunk))
+        weights.append(np.full(n_points, chunk.shape[0] / n_points))
+    values = np.concatenate(values)
+    weights = np.concatenate(weights)
+    order = np.argsort(values, kind='stable')
+    values = values[order]
+    cum_weights = np.cumsum(weights[order])
+    cum_weights = (cum_weights - cum_weights[0]) / (cum_weights[-1] - cum_weights[0])
+    sketch = np.interp(levels, cum_weights, values)
+    model.cache[key] = (sketch, levels)
+    return model.cache[key]
+
+
+def column_histograms(x, bins=25):
+    ## equivalent to calling np.histogram(x[:, j], bins=bins) for every column j of x, in one pass
+    ## returns:
+    ##      counts, a numpy array of shape (n_cols, bins)
+    ##      edges, a numpy array of shape (n_cols, bins + 1)
+    import numpy as np
+    n_cols = x.shape[1]
+    lo = np.min(x, axis=0).astype(float)
+    hi = np.max(x, axis=0).astype(float)
+    flat = lo == hi
+    lo[flat] -= 0.5
+    hi[flat] += 0.5
+    idx = np.floor((x - lo) / (hi - lo) * bins).astype(np.int64)
+    np.clip(idx, 0, bins - 1, out=idx)
+    idx += np.arange(n_cols) * bins
+    counts = np.bincount(idx.ravel(), minlength=n_cols * bins).reshape(n_cols, bins)
+    edges = lo[:, None] + (hi - lo)[:, None] * np.linspace(0, 1, bins + 1)
+    return counts, edges
+
+
+def player_quantile_table(model, chunk_size=256):
+    ## percentile histograms and credible intervals for every player in a model, computed in vectorised column chunks
+    ## the result is cached on the model (model.cache['quantile_table']), so it's only computed once per fit
+    ## returns a dictionary containing:
+    ##      hist_counts, a numpy array of shape (N, 25) containing the percentile histogram counts for each player
+    ##      hist_edges, a numpy array of shape (N, 26) containing the corresponding bin edges
+    ##      percentile_median, a numpy array of shape (N,) containing each player's median percentile rank
+    ##      quantiles, a numpy array of shape (N, 3) containing the lower, median & upper credible interval values
+    ##      mean, a numpy array of shape (N,) containing each player's posterior mean
+    ##      exceedance, a numpy array of shape (N, 101) containing each player's probability that their percentile rank
+    ##                  is above 0, 0.01, ..., 1 (see exceedance_probability)
+    ## (N is the number of players included in the model, in the order given by model.mask)
+    import time
+    import numpy as np
+    if 'quantile_table' in model.cache:
+        return model.cache['quantile_table']
+    t0 = time.perf_counter()
+    n = model.samples.shape[1]
+    qs = [0.125, 0.5, 0.875] if model.model_type == 'count' else [0.05, 0.5, 0.95]
+    hist_counts = np.zeros((n, 25), dtype=np.int64)
+    hist_edges = np.zeros((n, 26))
+    percentile_median = np.zeros(n)
+    quantiles = np.zeros((n, 3))
+    mean = np.zeros(n)
+    exceedance = np.zeros((n, 101), dtype=np.float32)
+    for start in range(0, n, chunk_size):
+        cols = slice(start, min(start + chunk_size, n))
+        samples = np.asarray(model.samples[:, cols])
+        percentiles = population_percentiles(model, samples, np.arange(n)[cols])
+        hist_counts[cols], hist_edges[cols] = column_histograms(percentiles)
+        percentile_median[cols] = np.median(percentiles, axis=0)
+        quantiles[cols] = np.quantile(samples, qs, axis=0).T
+        mean[cols] = np.mean(samples, axis=0)
+        ## counts of draws in each percentile hundredth, summed from the top down
+        idx = np.clip((percentiles * 100).astype(np.int64), 0, 100) + np.arange(percentiles.shape[1]) * 101
+        counts = np.bincount(idx.ravel(), minlength=101 * percentiles.shape[1]).reshape(-1, 101)
+        exceedance[cols] = np.cumsum(counts[:, ::-1], axis=1)[:, ::-1] / percentiles.shape[0]
+    model.report.setdefault('timings', {})['percentiles'] = time.perf_counter() - t0
+    model.cache['quantile_table'] = dict(hist_counts=hist_counts,
+                                         hist_edges=hist_edges,
+                                         percentile_median=percentile_median,
+                                         quantiles=quantiles,
+                                         mean=mean,
+                                         exceedance=exceedance)
+    return model.cache['quantile_table']
+
+
+def exceedance_probability(table, threshold):
+    ## each player's probability that their percentile rank is above threshold (between 0 and 1), from a
+    ## player_quantile_table (interpolated between its hundredths)
+    import numpy as np
+    position = np.clip(threshold, 0, 1) * 100
+    lo = int(min(np.floor(position), 99))
+    frac = position - lo
+    return (1 - frac) * table['exceedance'][:, lo] + frac * table['exceedance'][:, lo + 1]
+
+
+def shared_draws(models):
+    ## groups the models whose samples were computed from the same posterior draws (see estimate_model), so that their
+    ## joint probabilities can be computed draw-by-draw. Returns a list of lists of positions in models.
+    groups = []
+    for i, model in enumerate(models):
+        draws = set(model.report.get('draws', []))
+        linked = [group for group in groups if group[1] & draws]
+        merged = ([j for group in linked for j in group[0]] + [i], draws.union(*[group[1] for group in linked]))
+        groups = [group for group in groups if not any(group is g for g in linked)] + [merged]
+    return [sorted(group[0]) for group in groups]
+
+
+def joint_exceedance(models, thresholds, rows, chunk_size=256):
+    ## the probability that a player's percentile ranks on every model are above the corresponding thresholds, for models
+    ## whose samples share draws (see shared_draws), computed from their first min(n_samples) draws
+    ##      rows, the players' (positional) rows in the data frame the models were fitted on
+    ## players who aren't included in one of the models get 0
+    ## returns the joint probabilities, of shape (len(rows),), and each model's own probability from the same draws, of
+    ## shape (len(models), len(rows)), so the joint probability is never above any of them
+    import numpy as np
+    n_samples = min(model.n_samples for model in models)
+    rows = np.asarray(rows, dtype=np.int64)
+    out = np.zeros(rows.shape[0])
+    marginals = np.zeros((len(models), rows.shape[0]))
+    for start in range(0, rows.shape[0], chunk_size):
+        r = rows[start:start + chunk_size]
+        hit = np.ones((n_samples, r.shape[0]), dtype=bool)
+        for j, (model, threshold) in enumerate(zip(models, thresholds)):
+            included = model.mask[r]
+            cols = np.cumsum(model.mask)[r[included]] - 1
+            ## each threshold on the percentile rank is turned into a threshold on the samples themselves
+            value = population_quantile(model, threshold, cols)
+            above = np.asarray(model.samples[:n_samples, cols]) > value
+            marginals[j, start + np.where(included)[0]] = np.mean(above, axis=0)
+            hit[:, ~included] = False
+            hit[:, included] &= above
+        out[start:start + r.shape[0]] = np.mean(hit, axis=0)
+    return out, marginals
+
+
+def player_rank_table(model, bins=25, top_k=(1, 5, 10), chunk_elements=2 ** 22):
+    ## each player's posterior rank among all the players in a model (1 is the highest value), from the rank of every
+    ## player in every posterior draw. Unlike population_percentiles, this accounts for the uncertainty in everyone else's
+    ## values rather than comparing against the population distribution at its mean parameters.
+    ## the draws are ranked a chunk at a time (about chunk_elements values per chunk) and only running totals are kept, so
+    ## memory use doesn't grow with the number of samples. bins=N (the number of players) gives the exact rank distribution.
+    ## for models fitted with groups, players are ranked among the players in their own group
+    ## the result is cached on the model (model.cache['rank_table']) for the given bins & top_k
+    ## returns a dictionary containing:
+    ##      hist_counts, a numpy array of shape (N, bins) containing the counts of draws in which each player's percentile
+    ##                   rank (the fraction of the other players ranked below them) fell in each of the bins equal-width
+    ##                   bins between 0 & 1
+    ##      rank_mean & rank_sd, numpy arrays of shape (N,) containing the mean & standard deviation of each player's rank
+    ##      percentile_mean, a numpy array of shape (N,) containing each player's mean percentile rank
+    ##      percentile_quantiles, a numpy array of shape (N, 3) containing the 5%, 50% & 95% quantiles of each player's
+    ##                            percentile rank (interpolated within the histogram bins)
+    ##      top_k, the tuple of k's, & p_top, a numpy array of shape (len(top_k), N) containing each player's probability
+    ##             of being in the top k
+    ## (N is the number of players included in the model, in the order given by model.mask)
+    import time
+    import numpy as np
+    top_k = tuple(sorted(set(int(k) for k in top_k)))
+    table = model.cache.get('rank_table')
+    if (table is not None) and (table['bins'] == bins) and (table['top_k'] == top_k):
+        return table
+    t0 = time.perf_counter()
+    n_samples, n = model.samples.shape
+    chunk_size = max(1, chunk_elements // max(n, 1))
+    positions = np.arange(n)
+    members = [positions] if model.groups is None else [np.where(model.groups == g)[0] for g in np.unique(model.groups)]
+    sizes = np.zeros(n)
+    for m in members:
+        sizes[m] = m.shape[0]
+    below = np.empty((min(chunk_size, n_samples), n), dtype=np.int64)
+    hist_counts = np.zeros((n, bins), dtype=np.int64)
+    p_top = np.zeros((len(top_k), n))
+    below_sum = np.zeros(n)
+    below_sq = np.zeros(n)
+    for start in range(0, n_samples, chunk_size):
+        x = np.asarray(model.samples[start:start + chunk_size])
+        for m in members:
+            size = m.shape[0]
+            b = below[:x.shape[0], :size]
+            ## b[d, i] is the number of players (in the group) ranked below the group's i-th player in draw d
+            b[np.arange(x.shape[0])[:, None], np.argsort(x if len(members) == 1 else x[:, m], axis=1)] = np.arange(size)
+            hist_counts[m] += np.bincount((b * bins // size + np.arange(size) * bins).ravel(),
+                                          minlength=size * bins).reshape(size, bins)
+            for j, k in enumerate(top_k):
+                p_top[j, m] += np.sum(b >= size - k, axis=0)
+            below_sum[m] += np.sum(b, axis=0)
+            below_sq[m] += np.sum(b.astype(float) ** 2, axis=0)
+    below_mean = below_sum / n_samples
+    cum = np.cumsum(hist_counts, axis=1) / n_samples
+    percentile_quantiles = np.zeros((n, 3))
+    for j, q in enumerate([0.05, 0.5, 0.95]):
+        idx = np.minimum(np.sum(cum < q, axis=1), bins - 1)
+        prev = np.where(idx > 0, cum[positions, idx - 1], 0)
+        frac = (q - prev) / np.maximum(hist_counts[positions, idx] / n_samples, 1e-12)
+        percentile_quantiles[:, j] = (idx + np.clip(frac, 0, 1)) / bins
+    model.report.setdefault('timings', {})['ranks'] = time.perf_counter() - t0
+    model.cache['rank_table'] = dict(bins=bins,
+                                     top_k=top_k,
+                                     hist_counts=hist_counts,
+                                     rank_mean=sizes - below_mean,
+                                     rank_sd=np.sqrt(np.maximum(below_sq / n_samples - below_mean ** 2, 0)),
+                                     percentile_mean=below_mean / np.maximum(sizes - 1, 1),
+                                     percentile_quantiles=percentile_quantiles,
+                                     p_top=p_top / n_samples)
+    return model.cache['rank_table']
+
+
+def obtain_player_quantiles(model, player_index):
+    ## percentile histogram and credible interval for a single player
+    ## player_index is the player's (positional) row in the data frame the model was fitted on
+    ## uses the cached player_quantile_table if it has already been computed
+    import numpy as np
+
+    pind = np.arange(np.shape(model.mask)[0])[model.mask]
+    pind = np.where(pind == player_index)[0]
+    if pind.shape[0] == 0:
+        return (np.zeros(25), np.linspace(0, 1, 26)), np.zeros(3)
+
+    if 'quantile_table' in model.cache:
+        table = model.cache['quantile_table']
+        return (table['hist_counts'][pind[0]], table['hist_edges'][pind[0]]), table['quantiles'][pind[0]]
+
+    samples = np.asarray(model.samples[:, pind])
+    counts, edges = column_histograms(population_percentiles(model, samples, pind))
+    qs = [0.125, 0.5, 0.875] if model.model_type == 'count' else [0.05, 0.5, 0.95]
+    per90_quantiles = np.quantile(samples[:, 0], qs)
+    return (counts[0], edges[0]), per90_quantiles
 
 
 def get_col_dtype(col):
@@ -0,0 +1,113 @@
+## import-time benchmark & guard for the inference-free paths
+## each scenario runs in a fresh interpreter, which reports how long it took and which modules it imported:
+##      import, import balaban
+##      bosko, construct a bosko object from a data frame
+##      load, load a saved bosko object (conjugate models) and build its table of results
+##      plot, as load, then render one radar plot to a PNG
+## none of these should import an inference backend or scraping dependency (pymc3, theano, arviz or selenium).
+## usage: python benchmarks/bench_import.py [--repeat 5] [--max-seconds 5] [--json results.json]
+## prints JSON results, and exits with status 1 if a scenario imports a forbidden module or is slower than
+## --max-seconds (best of --repeat runs).
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+FORBIDDEN = ['pymc3', 'theano', 'arviz', 'selenium']
+
+SETUP = '''
+import numpy as np
+import pandas as pd
+from balaban import bosko
+rng = np.random.default_rng(0)
+n = 300
+df = pd.DataFrame({'Player': ['Player %d' % i for i in range(n)], 'Squad': ['Team %d' % (i % 20) for i in range(n)],
+                   'Pos': 'MF', '90s': rng.uniform(1, 30, n)})
+df['Sh'] = rng.poisson(df['90s'] * 2)
+df['Att'] = rng.poisson(df['90s'] * 40) + 1
+df['Cmp'] = rng.binomial(df['Att'], 0.8)
+bos = bosko(df, 'Benchmark League')
+bos.add_model('Sh', 'Minutes', 'count', 'Shots', engine='conjugate')
+bos.add_model('Cmp', 'Att', 'success_rate', 'Pass%', engine='conjugate')
+bos.save(STORE)
+'''
+
+SCENARIOS = {
+    'import': '''
+import balaban
+''',
+    'bosko': '''
+import pandas as pd
+from balaban import bosko
+bos = bosko(pd.DataFrame({'Player': ['a', 'b'], 'Squad': ['x', 'y'], 'Pos': ['MF', 'DF'], '90s': [1., 2.]}), 'x')
+''',
+    'load': '''
+from balaban import bosko
+bos = bosko.load(STORE)
+bos.player_quantiles()
+''',
+    'plot': '''
+from balaban import bosko
+bos = bosko.load(STORE)
+bos.render_all(OUT, 'Benchmark', players=['Player 0'])
+''',
+}
+
+RUNNER = '''
+import sys
+import time
+import json
+STORE, OUT = {store!r}, {out!r}
+t0 = time.perf_counter()
+exec(compile({code!r}, '<scenario>', 'exec'))
+seconds = time.perf_counter() - t0
+print(json.dumps(dict(seconds=seconds, modules=sorted(sys.modules))))
+'''
+
+
+def run(code, store, out):
+    ## runs code in a fresh interpreter (with matplotlib's Agg backend) & returns its timing & loaded modules
+    env = dict(os.environ, MPLBACKEND='Agg')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH', '')
+    result = subprocess.run([sys.executable, '-c', RUNNER.format(store=store, out=out, code=code)],
+                            capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import-time benchmark for the inference-free paths of balaban')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, default=None)
+    parser.add_argument('--json', default=None, help='also write the results to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store, out = os.path.join(tmp, 'store'), os.path.join(tmp, 'plots')
+        run(SETUP, store, out)
+        results = {}
+        for name, code in SCENARIOS.items():
+            runs = [run(code, store, out) for _ in range(args.repeat)]
+            modules = runs[0]['modules']
+            results[name] = dict(seconds=min(r['seconds'] for r in runs),
+                                 seconds_all=[r['seconds'] for r in runs],
+                                 n_modules=len(modules),
+                                 heavy=[m for m in ('numpy', 'scipy', 'pandas', 'matplotlib') if m in modules],
+                                 forbidden=[m for m in FORBIDDEN if m in modules])
+
+    failed = [name for name, r in results.items()
+              if r['forbidden'] or ((args.max_seconds is not None) and (r['seconds'] > args.max_seconds))]
+    output = dict(python=sys.version.split()[0], results=results, failed=failed)
+    print(json.dumps(output, indent=2))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(output, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
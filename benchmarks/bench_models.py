@@ -0,0 +1,196 @@
+## speed & calibration benchmark for the fitters, on synthetic leagues with known true rates (see balaban/synthetic.py)
+## every (number of players, model type, engine) case runs in a fresh interpreter, which reports:
+##      fit_seconds, wall-clock time of the fit (plus the fit report's own timings)
+##      peak_rss_mb, the process's peak resident memory, & fit_rss_mb, how much of that was added by the fit
+##      latency_ms, median times of obtain_player_quantiles for one player (before & after the quantile table has been
+##                  cached), of building the quantile table for every player, and of make_plot (drawn on an Agg canvas)
+##      accuracy, checked against the truth for every player included in the model:
+##          coverage_90, the fraction of true values inside the 90% credible intervals (should be about 0.9)
+##          width_90, the mean width of those intervals
+##          pit_max_dev, the largest deviation of the histogram (10 bins) of the truth's posterior quantiles from uniform
+##          percentile_coverage_90, percentile_mae & percentile_pit_max_dev, the same for the percentile ranks, where a
+##              player's true percentile is their true value's rank among the included players
+## 'xSp90' cases fit their parents (a count model and an xSpA model, with the case's engine, or 'conjugate' for the count
+## model under 'mcmc') first; their timings & memory are for the xSp90 step only.
+## ADVI cases need PyMC3; cases that can't run are reported with an error rather than stopping the benchmark.
+## usage: python benchmarks/bench_models.py [--n 200 1000 5000 20000] [--engines conjugate mcmc] [--json results.json]
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ENGINES = {'count': ['advi', 'conjugate'],
+           'success_rate': ['advi', 'conjugate'],
+           'xSpA': ['advi', 'mcmc'],
+           'xSp90': ['advi', 'mcmc'],
+           'adj_pass': ['advi', 'mcmc']}
+
+
+def peak_rss_mb():
+    import resource
+    scale = 1024 ** 2 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def median_ms(f, args_list):
+    import numpy as np
+    times = []
+    for args in args_list:
+        t0 = time.perf_counter()
+        f(*args)
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times) * 1000)
+
+
+def pit_max_dev(pit, bins=10):
+    ## largest deviation of the histogram of pit values (which should be uniform) from uniform
+    import numpy as np
+    counts = np.bincount(np.clip((pit * bins).astype(int), 0, bins - 1), minlength=bins)
+    return float(np.max(np.abs(counts / pit.shape[0] - 1 / bins)))
+
+
+def accuracy(model, truth_values, chunk_size=256):
+    ## interval coverage and calibration of a model's samples & percentiles against the truth, in column chunks
+    import numpy as np
+    from scipy.stats import rankdata
+    from balaban.utils import population_percentiles
+    n = model.samples.shape[1]
+    true_percentiles = (rankdata(truth_values) - 0.5) / n
+    inside, width, pit = np.zeros(n, dtype=bool), np.zeros(n), np.zeros(n)
+    p_inside, p_error, p_pit = np.zeros(n, dtype=bool), np.zeros(n), np.zeros(n)
+    for start in range(0, n, chunk_size):
+        cols = slice(start, min(start + chunk_size, n))
+        samples = np.asarray(model.samples[:, cols], dtype=float)
+        lo, hi = np.quantile(samples, [0.05, 0.95], axis=0)
+        inside[cols] = (lo <= truth_values[cols]) & (truth_values[cols] <= hi)
+        width[cols] = hi - lo
+        pit[cols] = np.mean(samples < truth_values[cols], axis=0)
+        percentiles = population_percentiles(model, samples)
+        lo, med, hi = np.quantile(percentiles, [0.05, 0.5, 0.95], axis=0)
+        p_inside[cols] = (lo <= true_percentiles[cols]) & (true_percentiles[cols] <= hi)
+        p_error[cols] = np.abs(med - true_percentiles[cols])
+        p_pit[cols] = np.mean(percentiles < true_percentiles[cols], axis=0)
+    return dict(coverage_90=float(np.mean(inside)),
+                width_90=float(np.mean(width)),
+                pit_max_dev=pit_max_dev(pit),
+                percentile_coverage_90=float(np.mean(p_inside)),
+                percentile_mae=float(np.mean(p_error)),
+                percentile_pit_max_dev=pit_max_dev(p_pit))
+
+
+def run_case(case):
+    ## runs one case in this process & returns its results (see the top of this file)
+    import numpy as np
+    import matplotlib.pyplot as plt
+    from balaban import bosko
+    from balaban.synthetic import synthetic_league, true_values, MODELS
+    from balaban.utils import obtain_player_quantiles, player_quantile_table
+    df, truth = synthetic_league(case['n_players'], random_seed=case['seed'])
+    bos = bosko(df, 'Synthetic League')
+    model_type, engine = case['model_type'], case['engine']
+    settings = dict(n_samples=case['n_samples'], n_chains=case['n_chains'], n_tune=case['n_tune'])
+    if model_type == 'xSp90':
+        bos.add_model(*MODELS['count'], 'count', 'count', engine='advi' if engine == 'advi' else 'conjugate',
+                      **settings)
+        bos.add_model(*MODELS['xSpA'], 'xSpA', 'xSpA', engine=engine, **settings)
+        args = ('xSpA', 'count', 'xSp90', model_type)
+    else:
+        args = (*MODELS[model_type], model_type, model_type)
+    rss0 = peak_rss_mb()
+    t0 = time.perf_counter()
+    bos.add_model(*args, engine=engine, **settings)
+    fit_seconds = time.perf_counter() - t0
+    model = bos.get_model(model_type)
+    rss1 = peak_rss_mb()
+
+    ## latencies, for up to n_players_latency of the included players
+    rows = np.where(model.mask)[0][:case['n_players_latency']]
+    latency = dict(quantiles_uncached=median_ms(obtain_player_quantiles, [(model, pl) for pl in rows]))
+    t0 = time.perf_counter()
+    player_quantile_table(model)
+    latency['quantile_table'] = (time.perf_counter() - t0) * 1000
+    latency['quantiles_cached'] = median_ms(obtain_player_quantiles, [(model, pl) for pl in rows])
+
+    def plot(player):
+        bos.make_plot(player, 'Benchmark', model_names=[model_type], use_pretty_font=False)
+        plt.gcf().canvas.draw()
+        plt.close('all')
+
+    plot(df['Player'].iloc[rows[0]])
+    latency['make_plot'] = median_ms(plot, [(df['Player'].iloc[pl],) for pl in rows])
+
+    report = model.report
+    return dict(case,
+                n_included=int(np.sum(model.mask)),
+                fit_seconds=fit_seconds,
+                timings=report.get('timings', {}),
+                converged=report.get('converged'),
+                rhat_max=(report.get('mcmc') or {}).get('rhat_max'),
+                rhat_player_q99=(report.get('mcmc') or {}).get('rhat_player_q99'),
+                ess_min=(report.get('mcmc') or {}).get('ess_min'),
+                peak_rss_mb=rss1,
+                fit_rss_mb=rss1 - rss0,
+                latency_ms=latency,
+                accuracy=accuracy(model, true_values(df, truth, model)))
+
+
+def spawn_case(case, timeout=None):
+    ## runs one case in a fresh interpreter (with matplotlib's Agg backend); failures are reported as an error
+    env = dict(os.environ, MPLBACKEND='Agg')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH', '')
+    try:
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), '--case', json.dumps(case)],
+                                capture_output=True, text=True, env=env, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return dict(case, error='timed out after %s seconds' % timeout)
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        return dict(case, error=lines[-1] if lines else 'exit status %d' % result.returncode)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Speed & calibration benchmark for the balaban fitters')
+    parser.add_argument('--n', type=int, nargs='+', default=[200, 1000, 5000, 20000], help='numbers of players')
+    parser.add_argument('--model-types', nargs='+', default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument('--engines', nargs='+', default=['advi', 'conjugate', 'mcmc'])
+    parser.add_argument('--n-samples', type=int, default=6000)
+    parser.add_argument('--n-chains', type=int, default=4)
+    parser.add_argument('--n-tune', type=int, default=1000)
+    parser.add_argument('--n-players-latency', type=int, default=5, help='players to time the latencies over')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=None, help='seconds allowed per case')
+    parser.add_argument('--json', default=None, help='also write the results to this file')
+    parser.add_argument('--case', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case is not None:
+        print(json.dumps(run_case(json.loads(args.case))))
+        return
+
+    import platform
+    import numpy as np
+    results = []
+    for n_players in args.n:
+        for model_type in args.model_types:
+            for engine in ENGINES[model_type]:
+                if engine not in args.engines:
+                    continue
+                case = dict(n_players=n_players, model_type=model_type, engine=engine, seed=args.seed,
+                            n_samples=args.n_samples, n_chains=args.n_chains, n_tune=args.n_tune,
+                            n_players_latency=args.n_players_latency)
+                results.append(spawn_case(case, args.timeout))
+                print(json.dumps(results[-1]), file=sys.stderr)
+    output = dict(python=platform.python_version(), numpy=np.__version__, machine=platform.machine(),
+                  cpu_count=os.cpu_count(), results=results)
+    print(json.dumps(output, indent=2))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(output, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
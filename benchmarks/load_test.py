@@ -0,0 +1,141 @@
+## load test for balaban.serve
+## usage: python benchmarks/load_test.py [--host 127.0.0.1] [--port 8000] [--concurrency 16] [--requests 2000]
+##                                       [--mix radar.png=1 summary=4 search=2] [--players 50] [--json results.json]
+## opens --concurrency keep-alive connections to a running server and sends --requests requests between them, spread over
+## the endpoints in the proportions given by --mix (for --players players taken from a search). Prints JSON with the
+## requests per second, and the p50/p99/max latencies (in milliseconds), overall and per endpoint, plus any errors.
+## alternatively, --store path/to/bosko starts a server for that saved bosko object first (and stops it afterwards).
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+from urllib.parse import quote
+
+
+async def request(reader, writer, host, path):
+    ## sends one GET on a keep-alive connection & returns (status, body)
+    writer.write(('GET %s HTTP/1.1\r\nHost: %s\r\nConnection: keep-alive\r\n\r\n' % (path, host)).encode('latin-1'))
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def run(host, port, paths, concurrency):
+    ## sends every (endpoint, path) in paths over concurrency connections; returns [(endpoint, seconds, status)]
+    queue = asyncio.Queue()
+    for item in paths:
+        queue.put_nowait(item)
+    results = []
+
+    async def client():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            while not queue.empty():
+                endpoint, path = queue.get_nowait()
+                t0 = time.perf_counter()
+                status, _ = await request(reader, writer, host, path)
+                results.append((endpoint, time.perf_counter() - t0, status))
+        finally:
+            writer.close()
+
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return results
+
+
+def summarise(latencies):
+    import numpy as np
+    latencies = np.array(latencies) * 1000
+    return dict(n=int(latencies.shape[0]), p50_ms=float(np.percentile(latencies, 50)),
+                p99_ms=float(np.percentile(latencies, 99)), max_ms=float(np.max(latencies)))
+
+
+def start_server(store, port):
+    ## starts python -m balaban.serve on store & waits until it's listening
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, MPLBACKEND='Agg')
+    env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH', '')
+    process = subprocess.Popen([sys.executable, '-m', 'balaban.serve', '--store', store, '--port', str(port)],
+                               stdout=subprocess.PIPE, env=env, text=True)
+    line = process.stdout.readline()
+    if not line.startswith('Serving'):
+        process.kill()
+        raise RuntimeError('The server failed to start')
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test for balaban.serve')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--store', default=None, help='start a server for this saved bosko object')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--mix', nargs='+', default=['radar.png=1', 'summary=4', 'search=2'],
+                        help='endpoint=weight, for endpoints radar.png, radar.svg, summary & search')
+    parser.add_argument('--players', type=int, default=50, help='number of players to request')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default=None, help='also write the results to this file')
+    args = parser.parse_args()
+
+    server = start_server(args.store, args.port) if args.store is not None else None
+    try:
+        async def players():
+            reader, writer = await asyncio.open_connection(args.host, args.port)
+            _, body = await request(reader, writer, args.host, '/players?limit=%d' % args.players)
+            writer.close()
+            return json.loads(body)
+
+        found = asyncio.run(players())
+        rng = random.Random(args.seed)
+        mix = [(item.split('=')[0], float(item.split('=')[1])) for item in args.mix]
+        paths = []
+        for _ in range(args.requests):
+            endpoint = rng.choices([m[0] for m in mix], weights=[m[1] for m in mix])[0]
+            player = rng.choice(found)
+            if endpoint == 'search':
+                paths.append((endpoint, '/players?q=%s&limit=10' % quote(player['player'].split()[-1][:3])))
+            elif endpoint == 'summary':
+                paths.append((endpoint, '/players/%d' % player['id']))
+            else:
+                paths.append((endpoint, '/players/%d/%s' % (player['id'], endpoint)))
+
+        t0 = time.perf_counter()
+        results = asyncio.run(run(args.host, args.port, paths, args.concurrency))
+        seconds = time.perf_counter() - t0
+    finally:
+        if server is not None:
+            ## SIGINT lets the server shut down its render workers before it exits
+            server.send_signal(signal.SIGINT)
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
+
+    output = dict(requests=len(results), concurrency=args.concurrency, seconds=seconds,
+                  requests_per_second=len(results) / seconds,
+                  errors=sum(status != 200 for _, _, status in results),
+                  latency=summarise([t for _, t, _ in results]),
+                  endpoints={name: summarise([t for e, t, _ in results if e == name])
+                             for name in sorted(set(e for e, _, _ in results))})
+    print(json.dumps(output, indent=2))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(output, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,7 +13,10 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/anenglishgoat/balaban",
     packages=setuptools.find_packages(),
-    install_requires=['importlib.resources', 'numpy', 'pymc3', 'pandas', 'matplotlib','selenium'],
+    install_requires=['importlib.resources', 'numpy', 'scipy', 'pymc3', 'pandas', 'matplotlib'],
+    extras_require={'dataset': ['pyarrow'],
+                    'scrape': ['selenium'],
+                    'all': ['pyarrow', 'selenium']},
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
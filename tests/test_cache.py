@@ -0,0 +1,28 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from balaban.balaban import bosko
+from balaban.synthetic import synthetic_league
+
+
+@pytest.mark.parametrize('memmap', [False, True])
+def test_evicting_entries_keeps_loaded_models(tmp_path, memmap):
+    df, _ = synthetic_league(100, random_seed=0)
+    memmap_dir = str(tmp_path / 'memmap') if memmap else None
+    first = bosko(df, 'test', cache=str(tmp_path / 'cache'))
+    first.add_model('Sh', 'Minutes', 'count', 'Shots', engine='conjugate', n_samples=100)
+    expected = np.array(first.get_model('Shots').samples)
+
+    bos = bosko(df, 'test', cache=str(tmp_path / 'cache'), memmap_dir=memmap_dir)
+    bos.add_model('Sh', 'Minutes', 'count', 'Shots', engine='conjugate', n_samples=100)
+    model = bos.get_model('Shots')
+    if memmap:
+        assert os.path.dirname(model.memmap_path) == os.path.abspath(memmap_dir)
+    else:
+        assert model.memmap_path is None
+    assert len(bos.cache.clear()) == 1
+    assert np.array_equal(model.samples, expected)
+    assert np.array_equal(pickle.loads(pickle.dumps(model)).samples, expected)
@@ -0,0 +1,29 @@
+import pytest
+
+from balaban.balaban import bosko
+from balaban.synthetic import synthetic_league
+
+pytest.importorskip('pyarrow')
+from balaban.dataset import DatasetSource, save_dataset  # noqa: E402
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'feather'])
+def test_numeric_season_round_trip(tmp_path, fmt):
+    df, _ = synthetic_league(50, random_seed=0)
+    df['League'] = 'EPL'
+    save_dataset(df, str(tmp_path), season='2021', fmt=fmt)
+    save_dataset(df.iloc[:10], str(tmp_path), season=2022, fmt=fmt)
+    source = DatasetSource(str(tmp_path), filters={'Season': '2021'})
+    base = source.read_base()
+    assert base.shape[0] == 50
+    assert list(base['Season'].unique()) == ['2021']
+    assert DatasetSource(str(tmp_path), filters={'Season': ['2021', '2022']}).read_base().shape[0] == 60
+
+
+def test_bosko_reads_numeric_season(tmp_path):
+    df, _ = synthetic_league(50, random_seed=0)
+    df['League'] = 'EPL'
+    save_dataset(df, str(tmp_path), season='2021')
+    bos = bosko(str(tmp_path), 'test', dataset_filter={'Season': '2021'})
+    bos.add_model('Sh', 'Minutes', 'count', 'Shots', engine='conjugate', n_samples=100)
+    assert bos.df.shape[0] == 50
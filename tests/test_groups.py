@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from balaban.balaban import bosko
+from balaban.synthetic import synthetic_league
+from balaban.utils import fit_counts_model_conjugate, remap_groups
+
+
+def leagues(names, n_players=150):
+    frames = []
+    for i, name in enumerate(names):
+        df, _ = synthetic_league(n_players, random_seed=i)
+        df['League'] = name
+        df['Player'] = name + ' ' + df['Player']
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+def group_thetas(model):
+    theta = model.state['hyper:theta:mu'].reshape(len(model.group_labels), 2)
+    return dict(zip(model.group_labels, theta))
+
+
+def test_remap_groups_by_label():
+    state = {'player:x:mu': np.arange(3.), 'hyper:theta:mu': np.array([1., 2., 3., 4.]),
+             'group_labels': np.array(['A', 'B'])}
+    out = remap_groups(state, ['B', 'C'])
+    assert np.array_equal(out['player:x:mu'], np.arange(3.))
+    assert np.array_equal(out['hyper:theta:mu'][:2], [3., 4.])
+    assert np.all(np.isnan(out['hyper:theta:mu'][2:]))
+    assert list(out['group_labels']) == ['B', 'C']
+    assert 'hyper:theta:mu' not in remap_groups(state, [None])
+
+
+@pytest.mark.parametrize('new_names', [['EPL', 'ALiga'], ['EPL', 'LaLiga', 'BL']])
+def test_refit_after_groups_added_or_renamed(new_names):
+    df = leagues(['EPL', 'Liga'])
+    bos = bosko(df, 'test')
+    bos.add_model('Sh', 'Minutes', 'count', 'Shots', engine='conjugate', n_samples=200, group_by=['League', 'Pos'])
+    new_df = leagues(new_names)
+    bos.update_data(new_df)
+    model = bos.get_model('Shots')
+    assert list(model.state['group_labels']) == model.group_labels
+    assert (new_names[1] + ', FW' in model.group_labels) and ('Liga, FW' not in model.group_labels)
+    groups = np.array([league + ', ' + str(pos)[0:2] for league, pos in zip(new_df['League'], new_df['Pos'])])
+    cold = fit_counts_model_conjugate(new_df['Sh'].to_numpy(float), new_df['90s'].to_numpy(float) * 90,
+                                      n_samples=200, groups=groups)
+    warm_thetas, cold_thetas = group_thetas(model), group_thetas(cold)
+    assert set(warm_thetas) == set(cold_thetas)
+    for label in cold_thetas:
+        assert np.allclose(warm_thetas[label], cold_thetas[label], atol=1e-3)
+
+
+def test_mcmc_refit_after_group_added():
+    df = leagues(['EPL', 'Liga'], n_players=60)
+    bos = bosko(df, 'test')
+    bos.add_model('xG', 'Sh', 'xSpA', 'xG/Sh', engine='mcmc', n_samples=100, n_chains=2, n_tune=50,
+                  group_by='League')
+    bos.update_data(leagues(['BL', 'EPL', 'Liga'], n_players=60))
+    model = bos.get_model('xG/Sh')
+    assert model.group_labels == ['BL', 'EPL', 'Liga']
+    assert model.hyper.shape == (100, 3, 3)
+    assert np.all(np.isfinite(model.samples))
@@ -0,0 +1,42 @@
+import pandas as pd
+
+from balaban.ingest import PlayerAccumulator
+
+
+def match_logs():
+    return pd.DataFrame({'Player': ['X', 'X', 'Y', 'Y'],
+                         'Squad': ['A', 'A', 'B', 'B'],
+                         'Pos': ['FW', 'FW', 'MF', 'MF'],
+                         'Match': ['M1', 'M2', 'M1', 'M3'],
+                         'Min': [90, 45, 90, 60],
+                         'Sh': [3, 1, 5, 2]})
+
+
+def accumulator():
+    return PlayerAccumulator(sums={'Sh': 'Sh'}, match_column='Match')
+
+
+def totals(acc):
+    return acc.table().sort_values(['Player', 'Squad']).reset_index(drop=True)
+
+
+def test_updates_match_single_update():
+    logs = match_logs()
+    once = accumulator()
+    once.update(logs)
+    several = accumulator()
+    several.update(logs[logs['Player'] == 'X'])
+    several.update(logs[logs['Player'] == 'Y'])
+    pd.testing.assert_frame_equal(totals(once), totals(several))
+    assert totals(several)['Sh'].tolist() == [4, 7]
+
+
+def test_repeated_rows_are_skipped():
+    logs = match_logs()
+    once = accumulator()
+    once.update(logs)
+    repeated = accumulator()
+    repeated.update(logs.iloc[:3])
+    repeated.update(logs)
+    repeated.update(logs.iloc[1:])
+    pd.testing.assert_frame_equal(totals(once), totals(repeated))
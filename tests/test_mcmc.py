@@ -0,0 +1,14 @@
+import numpy as np
+
+from balaban.mcmc import fit_mcmc
+
+
+def test_converged_ignores_worst_player():
+    rng = np.random.default_rng(0)
+    attempts = rng.integers(1, 60, 200).astype(float)
+    sp = rng.beta(2, 18, 200)
+    _, _, _, report = fit_mcmc('expected', dict(sp=sp, attempts=attempts), n_samples=400, n_chains=2, n_tune=100,
+                               random_seed=0)
+    mcmc = report['mcmc']
+    assert mcmc['rhat_player_q99'] <= mcmc['rhat_player_max'] <= mcmc['rhat_max']
+    assert report['converged'] == ((max(mcmc['rhat_hyper']) < 1.01) and (mcmc['rhat_player_q99'] < 1.01))
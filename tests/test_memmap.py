@@ -0,0 +1,33 @@
+import os
+
+from balaban.balaban import bosko
+from balaban.synthetic import synthetic_league
+
+
+def test_memmap_dir_does_not_grow(tmp_path):
+    memmap_dir = str(tmp_path / 'memmap')
+    df, _ = synthetic_league(200, random_seed=0)
+    bos = bosko(df, 'test', memmap_dir=memmap_dir)
+    bos.add_model('Sh', 'Minutes', 'count', 'Shots', engine='conjugate', n_samples=100)
+    bos.add_model('Cmp', 'Att', 'success_rate', 'Cmp%', engine='conjugate', n_samples=100)
+    assert len(os.listdir(memmap_dir)) == 2
+    for _ in range(3):
+        bos.update_data(df)
+        assert len(os.listdir(memmap_dir)) == 2
+    bos.add_model('Sh', 'Minutes', 'count', 'Shots', engine='conjugate', n_samples=100)
+    assert bos.labels == ['Shots', 'Cmp%']
+    assert len(os.listdir(memmap_dir)) == 2
+    bos.delete_model('Cmp%')
+    assert os.listdir(memmap_dir) == [os.path.basename(bos.get_model('Shots').memmap_path)]
+
+
+def test_saved_store_files_are_kept(tmp_path):
+    df, _ = synthetic_league(200, random_seed=0)
+    bos = bosko(df, 'test')
+    bos.add_model('Sh', 'Minutes', 'count', 'Shots', engine='conjugate', n_samples=100)
+    bos.save(str(tmp_path / 'store'))
+    loaded = bosko.load(str(tmp_path / 'store'), memmap_dir=str(tmp_path / 'memmap'))
+    path = loaded.get_model('Shots').memmap_path
+    loaded.update_data(df)
+    loaded.delete_model('Shots')
+    assert os.path.isfile(path)
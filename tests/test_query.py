@@ -0,0 +1,18 @@
+import numpy as np
+
+from balaban.balaban import bosko
+from balaban.synthetic import synthetic_league
+
+
+def test_joint_probability_never_exceeds_marginals():
+    df, _ = synthetic_league(150, random_seed=0)
+    bos = bosko(df, 'test')
+    bos.add_model('Sh', 'Minutes', 'count', 'Shots', engine='conjugate', n_samples=400)
+    bos.add_model('xG', 'Sh', 'xSpA', 'xG/Sh', engine='mcmc', n_samples=200, n_chains=2, n_tune=50)
+    bos.add_model('xG/Sh', 'Shots', 'xSp90', 'xG/90')
+    result = bos.query({'Shots': (0.3, 0.0), 'xG/90': (0.3, 0.0)})
+    assert result.shape[0] > 0
+    assert np.all(result['p_joint'] <= result['Shots_p'])
+    assert np.all(result['p_joint'] <= result['xG/90_p'])
+    strict = bos.query({'Shots': (0.3, 0.9), 'xG/90': (0.3, 0.9)})
+    assert np.all(strict['Shots_p'] >= 0.9) and np.all(strict['xG/90_p'] >= 0.9)
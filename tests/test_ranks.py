@@ -0,0 +1,16 @@
+import pytest
+
+from balaban.balaban import bosko
+from balaban.synthetic import synthetic_league
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_player_ranks_records_timing(n_jobs):
+    df, _ = synthetic_league(100, random_seed=0)
+    bos = bosko(df, 'test')
+    bos.add_model('Sh', 'Minutes', 'count', 'Shots', engine='conjugate', n_samples=100)
+    bos.add_model('Cmp', 'Att', 'success_rate', 'Cmp%', engine='conjugate', n_samples=100)
+    bos.player_ranks(bins=10, n_jobs=n_jobs)
+    for name in bos.labels:
+        assert bos.get_report(name)['timings']['ranks'] >= 0
+        assert bos.get_model(name).cache['rank_table']['bins'] == 10
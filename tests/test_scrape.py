@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import pytest
+
+from balaban.scrape import (CATEGORIES, DirectoryFetcher, Page, PageCache, fetch_pages, league_url, parse_stats_table,
+                            save_pages, scrape_top_five_leagues)
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'div_stats_passing.html')
+
+
+def fixture_page():
+    with open(FIXTURE, encoding='utf-8') as f:
+        return f.read()
+
+
+def category_page(category):
+    ## a minimal page for a non-passing category, with the stats table outside a comment
+    columns = ['Rk', 'Player', 'Nation', 'Pos', 'Squad', 'Age', 'Born', '90s', 'Sh', 'Cmp', 'Matches']
+    rows = [['1', 'Ann Able', 'eng ENG', 'MF', 'Alpha FC', '25', '1995', '30.1', '10', '1,111', 'Matches'],
+            ['2', 'Bo Baker', 'fr FRA', 'DF,MF', 'Beta United', '31', '1989', '', '', '5', 'Matches']]
+    head = '<tr>' + ''.join('<th>' + c + '</th>' for c in columns) + '</tr>'
+    body = ''.join('<tr>' + ''.join('<td>' + v + '</td>' for v in row) + '</tr>' for row in rows)
+    return ('<html><div id="div_stats_' + category + '"><table><thead>' + head + '</thead><tbody>' + body +
+            '</tbody></table></div></html>')
+
+
+def test_parse_commented_table():
+    df = parse_stats_table(fixture_page(), 'passing')
+    ## the repeated header rows are dropped, whether or not they're marked with a class
+    assert list(df.index) == [('Ann Able', 'Alpha FC'), ('Bo Baker', 'Beta United'), ('Cy & Co', 'Alpha FC')]
+    assert list(df['Pos']) == ['MF', 'DF,MF', 'FW']
+    ## thousands separators & blank cells
+    assert df.loc[('Ann Able', 'Alpha FC'), 'Total: Cmp'] == 1234
+    assert df['Total: Att'].dtype == np.float64
+    assert np.isnan(df.loc[('Bo Baker', 'Beta United'), 'Total: Att'])
+    assert np.isnan(df.loc[('Bo Baker', 'Beta United'), '90s'])
+    ## grouped columns with the same name are told apart by their group, & exact duplicates keep the first
+    assert df.loc[('Ann Able', 'Alpha FC'), 'Short: Cmp'] == 600
+    assert list(df.columns).count('Total: Cmp') == 1
+    assert 'Matches' not in df.columns
+
+
+def test_parse_missing_table():
+    with pytest.raises(ValueError, match='div_stats_shooting'):
+        parse_stats_table(fixture_page(), 'shooting')
+
+
+def test_directory_fetcher(tmp_path):
+    pages = {league_url('epl', category): fixture_page() if category == 'passing' else category_page(category)
+             for category in CATEGORIES}
+    save_pages(pages, str(tmp_path))
+    fetcher = DirectoryFetcher(str(tmp_path))
+    assert fetcher.fetch(league_url('epl', 'passing')).text == fixture_page()
+    df = scrape_top_five_leagues(league_names=['epl'], fetcher=fetcher)
+    assert list(df.columns[:4]) == ['League', 'Player', 'Pos', 'Squad']
+    assert df.shape[0] == 3
+    assert list(df.columns).count('Cmp') == 1
+    assert df.loc['Ann Able', 'Cmp'] == 1111
+
+
+class StubFetcher:
+    def __init__(self, pages):
+        self.pages = list(pages)
+        self.calls = []
+
+    def fetch(self, url, etag=None, last_modified=None):
+        self.calls.append((url, etag, last_modified))
+        return self.pages.pop(0)
+
+    def close(self):
+        pass
+
+
+def test_page_cache_conditional_requests(tmp_path):
+    url = league_url('epl', 'passing')
+    fetcher = StubFetcher([Page(200, 'v1', etag='"1"', last_modified='Mon'), Page(304, None, '"1"', 'Mon'),
+                           Page(200, 'v2', etag='"2"')])
+    cache = PageCache(str(tmp_path), max_age=0)
+    assert fetch_pages([url], fetcher, cache) == {url: 'v1'}
+    ## stale pages are re-requested with their ETag/Last-Modified, & a 304 keeps the cached copy
+    assert fetch_pages([url], fetcher, cache) == {url: 'v1'}
+    assert fetcher.calls[1] == (url, '"1"', 'Mon')
+    assert fetch_pages([url], fetcher, cache) == {url: 'v2'}
+    assert cache.get(url)[1]['etag'] == '"2"'
+    ## fresh pages aren't requested at all
+    cache.max_age = 60
+    assert fetch_pages([url], fetcher, cache) == {url: 'v2'}
+    assert len(fetcher.calls) == 3
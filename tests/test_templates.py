@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('pymc3')
+from balaban.templates import fit_template, get_template  # noqa: E402
+
+
+def make_data(model_type, n, seed):
+    rng = np.random.default_rng(seed)
+    attempts = rng.integers(5, 200, n).astype(float)
+    rate = rng.beta(20, 10, n)
+    if model_type == 'count':
+        minutes = rng.uniform(1, 30, n)
+        return dict(counts=rng.poisson(2 * minutes).astype(float), mins_played=minutes)
+    if model_type == 'success':
+        return dict(successes=rng.binomial(attempts.astype(int), rate).astype(float), attempts=attempts)
+    if model_type == 'expected':
+        return dict(sp=rng.beta(2, 20, n), attempts=attempts + 1)
+    long_attempts = rng.integers(1, 50, n).astype(float)
+    return dict(ShCmp=rng.binomial(attempts.astype(int), rate).astype(float), ShAtt=attempts,
+                LonCmp=rng.binomial(long_attempts.astype(int), rate * 0.7).astype(float), LonAtt=long_attempts)
+
+
+MODEL_TYPES = ['count', 'success', 'expected', 'adj_pass']
+
+
+def is_player_level(template, name):
+    return template.model.test_point[name].shape == (template.size,)
+
+
+@pytest.mark.parametrize('model_type', MODEL_TYPES)
+def test_refit_on_shared_template(model_type):
+    ## 40 & 50 players share the 64-player template, which is reset (not rebuilt) between fits
+    template = get_template(model_type, 50)
+    assert get_template(model_type, 40) is template
+    for n, seed in ((50, 0), (40, 1), (50, 2)):
+        approx, state, report = fit_template(model_type, make_data(model_type, n, seed), n=300)
+        assert report['iterations'] == 300
+        assert np.all(np.isfinite(report['elbo']['trace']))
+        assert np.sum(template.model['mask'].get_value()) == n
+        for key, value in state.items():
+            assert np.all(np.isfinite(value))
+            if key.startswith('player:'):
+                assert value.shape == (n,)
+    template.reset()
+    for var, value in template.initial_state:
+        assert np.array_equal(var.get_value(), value)
+
+
+@pytest.mark.parametrize('model_type', MODEL_TYPES)
+def test_padding_does_not_inform_hyperparameters(model_type):
+    ## the padding players' values (and the data left in their slots by a bigger fit) only add a constant to the
+    ## log-density, whatever the population-level parameters are
+    template = get_template(model_type, 40)
+    template.set_data(make_data(model_type, 50, 0))
+    template.set_data(make_data(model_type, 40, 1))
+    logp = template.model.logp
+    point = template.model.test_point
+    player = [name for name in point if is_player_level(template, name)]
+    hyper = [name for name in point if not is_player_level(template, name)]
+
+    def changed(point, names, padding_only, shift):
+        out = dict(point)
+        for name in names:
+            value = np.array(point[name], dtype=float)
+            if padding_only:
+                value[40:] += shift
+            else:
+                value += shift
+            out[name] = value
+        return out
+
+    differences = []
+    for h in (0.0, 0.5):
+        base = changed(point, hyper, False, h)
+        differences.append(logp(changed(base, player, True, 0.7)) - logp(base))
+    assert np.isfinite(differences[0])
+    assert np.isclose(differences[0], differences[1])
+
+
+@pytest.mark.parametrize('model_type', MODEL_TYPES)
+def test_state_round_trip(model_type):
+    template = get_template(model_type, 40)
+    _, state, _ = fit_template(model_type, make_data(model_type, 40, 0), n=200)
+    template.reset()
+    template.set_data(make_data(model_type, 40, 0))
+    template.set_state(state)
+    restored = template.get_state(40)
+    assert set(restored) == set(state)
+    for key in state:
+        assert np.allclose(restored[key], state[key], rtol=1e-5)
@@ -0,0 +1,29 @@
+import pytest
+
+from balaban.balaban import bosko
+from balaban.synthetic import synthetic_league
+
+
+def fitted_league():
+    df, _ = synthetic_league(100, random_seed=0)
+    bos = bosko(df, 'test')
+    bos.add_model('Sh', 'Minutes', 'count', 'C', engine='conjugate', n_samples=100)
+    bos.add_model('xG', 'Sh', 'xSpA', 'A', engine='mcmc', n_samples=100, n_chains=2, n_tune=50)
+    bos.add_model('A', 'C', 'xSp90', 'X')
+    return df, bos
+
+
+def test_update_data_refits_xsp90_from_refitted_parents():
+    df, bos = fitted_league()
+    bos.update_data(df)
+    assert bos.labels == ['C', 'A', 'X']
+    parents = bos.get_model('X').report['draws']
+    assert parents == bos.get_model('A').report['draws'] + bos.get_model('C').report['draws']
+
+
+def test_update_data_with_deleted_parent_raises():
+    df, bos = fitted_league()
+    bos.delete_model('A')
+    assert 'A' not in bos.specs
+    with pytest.raises(ValueError, match="no longer exist"):
+        bos.update_data(df)
@@ -0,0 +1,27 @@
+import multiprocessing
+import os
+import queue
+from concurrent.futures import ProcessPoolExecutor
+
+from balaban.balaban import _init_fit_worker, _single_threaded_blas
+
+
+def test_workers_start_with_single_threaded_blas(monkeypatch):
+    monkeypatch.delenv('OMP_NUM_THREADS', raising=False)
+    monkeypatch.setenv('MKL_NUM_THREADS', '2')
+    with _single_threaded_blas():
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            seen = list(pool.map(os.getenv, ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']))
+    assert seen[0] == '1' and seen[1] == '2'
+    assert 'OMP_NUM_THREADS' not in os.environ
+    assert os.environ['MKL_NUM_THREADS'] == '2'
+
+
+def test_fit_workers_reuse_a_compiledir_per_slot(monkeypatch, tmp_path):
+    monkeypatch.setenv('THEANO_FLAGS', 'floatX=float32,base_compiledir=' + str(tmp_path))
+    slots = queue.Queue()
+    slots.put(1)
+    _init_fit_worker(slots)
+    flags = os.environ['THEANO_FLAGS'].split(',')
+    assert flags[-1] == 'base_compiledir=' + os.path.join(str(tmp_path), 'balaban-worker-1')
+    assert 'floatX=float32' in flags